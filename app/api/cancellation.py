@@ -0,0 +1,34 @@
+import asyncio
+import typing
+
+from starlette.requests import Request
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def _disconnected(request: Request):
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(request: Request, awaitable: typing.Awaitable):
+    '''
+    Ждет awaitable, пока клиент на связи. Если клиент ушел раньше (следующее нажатие клавиши
+    в строке поиска), задача отменяется - asyncpg при этом отменяет и запрос в базе - и поднимается
+    ClientDisconnected. Только для запросов без тела: тело запроса читается здесь же
+    '''
+    task = asyncio.ensure_future(awaitable)
+    listener = asyncio.ensure_future(_disconnected(request))
+    try:
+        await asyncio.wait({task, listener}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        listener.cancel()
+    if not task.done():
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise ClientDisconnected()
+    return task.result()
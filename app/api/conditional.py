@@ -0,0 +1,67 @@
+'''
+Условные GET: строгие ETag по версиям записей и Last-Modified по updated_at
+'''
+import datetime
+import hashlib
+import typing
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, Response
+
+
+def _digest(*parts) -> str:
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=12).hexdigest()
+
+
+def entity_etag(kind: str, entity_id: int, version: int, variant: typing.Optional[str] = None) -> str:
+    '''
+    ETag одной записи; variant - другое представление той же версии (например, fields=)
+    '''
+    if variant:
+        return f'"{kind}-{entity_id}-{version}-{_digest(variant)}"'
+    return f'"{kind}-{entity_id}-{version}"'
+
+
+def list_etag(kind: str, versions: typing.Iterable[typing.Tuple[int, int]], *extra) -> str:
+    '''
+    ETag страницы списка по парам (id, version): меняется при изменении, добавлении и удалении записей страницы
+    '''
+    return f'"{kind}-list-{_digest(tuple(versions), extra)}"'
+
+
+def last_modified(updated_at: typing.Union[datetime.datetime, str, None]) -> typing.Optional[str]:
+    if updated_at is None:
+        return None
+    if isinstance(updated_at, str):
+        updated_at = datetime.datetime.fromisoformat(updated_at)
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=datetime.timezone.utc)
+    return format_datetime(updated_at.astimezone(datetime.timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def validators(etag: str, modified: typing.Optional[str] = None) -> typing.Dict[str, str]:
+    headers = {"ETag": etag}
+    if modified is not None:
+        headers["Last-Modified"] = modified
+    return headers
+
+
+def not_modified(request: Request, headers: typing.Dict[str, str]) -> typing.Optional[Response]:
+    '''
+    304 с теми же валидаторами, если у клиента актуальная версия; If-None-Match важнее If-Modified-Since
+    '''
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        if '*' in tags or headers["ETag"] in tags:
+            return Response(status_code=304, headers=headers)
+        return None
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None and "Last-Modified" in headers:
+        try:
+            if parsedate_to_datetime(headers["Last-Modified"]) <= parsedate_to_datetime(if_modified_since):
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            return None
+    return None
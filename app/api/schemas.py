@@ -1,9 +1,14 @@
 from datetime import date, datetime
+from enum import Enum
 from typing import Generic, Optional, Sequence, TypeVar
 from uuid import UUID
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, computed_field, conint
 import uuid
 from fastapi_users.schemas import BaseUser, BaseUserCreate, BaseUserUpdate
+from app.images.store import derivative_url
+
+# Верхняя граница serial (int4) первичных ключей
+MAX_DB_ID = 2 ** 31 - 1
 
 # User Service Schemas
 class GroupCreate(BaseModel):
@@ -44,6 +49,13 @@ class UserUpdate(BaseUserUpdate):
     username: Optional[str]  = None
     group_id: Optional[int] = None
 
+# Pagination Schemas
+class CountMode(str, Enum):
+    exact = 'exact'
+    estimated = 'estimated'
+    cached = 'cached'
+    none = 'none'
+
 # Apartment Service Schemas
 class BaseApartment(BaseModel):
     title: str
@@ -62,6 +74,19 @@ class BaseApartment(BaseModel):
 class Apartment(BaseApartment):
     id: int
     publisher_email: EmailStr
+    version: int = 1
+    updated_at: Optional[datetime] = None
+
+    # Превью для image1..image6; пока превью не посчитано, по его URL отдается оригинал
+    @computed_field
+    @property
+    def thumbnails(self) -> list[Optional[str]]:
+        return [derivative_url(getattr(self, f'image{i}'), 'thumb') for i in range(1, 7)]
+
+    @computed_field
+    @property
+    def medium_images(self) -> list[Optional[str]]:
+        return [derivative_url(getattr(self, f'image{i}'), 'medium') for i in range(1, 7)]
 
     class Config:
         from_attributes = True
@@ -79,11 +104,24 @@ class ApartmentsQuery(BaseModel):
     radius: Optional[float]
     limit: int = 1
     offset: int = 0
+    cursor: Optional[str] = None
+    count: Optional[CountMode] = None
+    fields: Optional[str] = None
+    arrival_date: Optional[date] = None
+    departure_date: Optional[date] = None
+    sort: Optional[str] = None
+    q: Optional[str] = None
+    min_rooms: Optional[int] = None
+    max_rooms: Optional[int] = None
+    min_area: Optional[int] = None
+    max_area: Optional[int] = None
 
 class PaginatedApartmentResponse(BaseModel):
     items: list[Apartment]
     size: Optional[int]
     total: Optional[int]
+    total_mode: Optional[CountMode] = None
+    next_cursor: Optional[str] = None
 
 # Reservation Service Schemas
 class BaseReservation(BaseModel):
@@ -93,6 +131,8 @@ class BaseReservation(BaseModel):
 
 class Reservation(BaseReservation):
     id: int
+    version: int = 1
+    updated_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -107,6 +147,27 @@ class PaginatedReservation(BaseModel):
     items: list[Reservation]
     size: Optional[int]
     total: Optional[int]
+    total_mode: Optional[CountMode] = None
+    next_cursor: Optional[str] = None
+
+class ListingStats(BaseModel):
+    apartment_id: int
+    review_count: int
+    favorite_count: int
+
+class AutocompleteSuggestion(BaseModel):
+    value: str
+    field: str
+    score: float
+
+class AvailabilityBatchQuery(BaseModel):
+    apartment_ids: list[conint(ge=1, le=MAX_DB_ID)]
+    start_date: date
+    end_date: date
+
+class AvailabilityBatch(BaseModel):
+    available: list[int]
+    booked: list[int]
 
 # Review Service Schemas
 class ReviewBase(BaseModel):
@@ -122,7 +183,12 @@ class ReviewUpdate(BaseModel):
     description: str
 
 class Review(ReviewBase):
-    id: UUID
+    id: int
+    version: int = 1
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
 
 # Favorite Service Schemas
 class BaseFavoriteItem(BaseModel):
@@ -138,6 +204,8 @@ class PaginatedFavoriteItemsResponse(BaseModel):
     items: list[FavoriteItem]
     size: Optional[int]
     total: Optional[int]
+    total_mode: Optional[CountMode] = None
+    next_cursor: Optional[str] = None
 
 class FavoriteItemCreate(BaseFavoriteItem):
     user_email: EmailStr
@@ -145,6 +213,13 @@ class FavoriteItemCreate(BaseFavoriteItem):
 class FavoriteItemDelete(BaseFavoriteItem):
     pass
 
+class FavoriteItemsBatch(BaseModel):
+    apartment_ids: list[int]
+
+class FavoriteItemsBatchResult(BaseModel):
+    # apartment_id, которые действительно добавились / удалились
+    apartment_ids: list[int]
+
 # Notification Service Schemas
 class ApartmentData(BaseModel):
     title: str
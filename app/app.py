@@ -8,24 +8,26 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.schemas import BaseApartment, ApartmentUpdate, ApartmentCreate, PaginatedApartmentResponse, \
     ApartmentsQuery, BaseFavoriteItem, FavoriteItemCreate, PaginatedFavoriteItemsResponse, ReservationCreate, \
-    PaginatedReservation, BaseReservation, ReviewBase, ReviewCreate, ReviewUpdate, Apartment, FavoriteItem, Reservation, Review
+    PaginatedReservation, BaseReservation, ReviewBase, ReviewCreate, ReviewUpdate, Apartment, FavoriteItem, Reservation, Review, CountMode
 
 from app.auth import AuthInitializer, include_routers
 import json
 from fastapi.middleware.cors import CORSMiddleware
 from app import config
-from app.api import schemas
+from app.api import conditional, schemas
 from app.database.models import User
 # from app.database.models import Apartment, FavoriteItem, Reservation, Review
-from app.services import apartment_service, favorite_service, reservation_service, review_service, user_service
-from app.database import async_base, base
-from app.database.base import DB_INITIALIZER
+from app.services import apartment_service, favorite_service, reservation_service, review_service, user_service, \
+    response_cache, bulk_import, export_service, listing_stats, autocomplete
+from app.api.cancellation import cancel_on_disconnect, ClientDisconnected
+from app.database import async_base
+from app import geocoding, images
 from fastapi import FastAPI, Depends, Query
 from starlette.responses import JSONResponse
-from sqlalchemy.orm import Session
 import typing
 import logging
-from fastapi import FastAPI, Depends, Request
+from fastapi import FastAPI, Depends, Request, Response, UploadFile
+from starlette.responses import RedirectResponse, StreamingResponse
 import jwt
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -59,7 +61,7 @@ app.add_middleware(
 )
 
 auth = AuthInitializer()
-auth.initializer(cfg.jwt_secret)
+auth.initializer(cfg.jwt_secret, cfg.AUTH_MODE)
 
 include_routers(app, auth.get_auth_backend(), auth.get_fastapi_users())
 
@@ -67,8 +69,12 @@ include_routers(app, auth.get_auth_backend(), auth.get_fastapi_users())
 @app.on_event("startup")
 async def on_startup():
     await async_base.DB_INITIALIZER.init_db(
-        str(cfg.POSTGRES_DSN_ASYNC)
+        str(cfg.POSTGRES_DSN_ASYNC), cfg
     )
+    geocoding.GEOCODER_INITIALIZER.init_geocoder(cfg)
+    images.IMAGE_STORE_INITIALIZER.init_store(cfg)
+    images.IMAGE_STORE_INITIALIZER.start_pipeline(cfg)
+    response_cache.RESPONSE_CACHE_INITIALIZER.init_cache(cfg)
 
     groups = [
     {
@@ -94,17 +100,38 @@ async def on_startup():
     else:
         logger.error('Конфигурация с группами не была загружена')
 
-SessionLocal = DB_INITIALIZER.init_database(str(cfg.POSTGRES_DSN))
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@app.on_event("shutdown")
+async def on_shutdown():
+    await geocoding.GEOCODER_INITIALIZER.close()
+    await images.IMAGE_STORE_INITIALIZER.close()
+    await response_cache.RESPONSE_CACHE_INITIALIZER.close()
+    await async_base.DB_INITIALIZER.close(cfg.DB_POOL_DRAIN_TIMEOUT)
+
+
+@app.get(
+    "/metrics/db-pool",
+    summary='Состояние пула соединений с базой',
+    tags=['metrics']
+)
+async def get_db_pool_metrics(user: User = Depends(auth.get_current_admin_user())):
+    return async_base.DB_INITIALIZER.pool_stats()
 
 
+@app.get(
+    "/metrics/response-cache",
+    summary='Статистика кэша ответов',
+    tags=['metrics']
+)
+async def get_response_cache_metrics(user: User = Depends(auth.get_current_admin_user())):
+    cache = response_cache.RESPONSE_CACHE_INITIALIZER.cache
+    return cache.stats() if cache is not None else {"enabled": False}
+
 def extract_email_data(request: Request) -> str:
+    # Токен уже проверен зависимостью auth.get_current_active_user()
+    email = getattr(request.state, 'user_email', None)
+    if email is not None:
+        return email
     try:
         if 'authorization' in request.headers:
             token = request.headers['authorization'].split(' ')[1]
@@ -115,20 +142,66 @@ def extract_email_data(request: Request) -> str:
         return None
 
 
+@app.get(
+    "/apartments/stats",
+    response_model=typing.List[schemas.ListingStats],
+    summary='Число отзывов и добавлений в избранное для списка apartments',
+    tags=['apartments']
+)
+async def get_listing_stats(
+        apartment_ids: typing.List[int] = Query(..., description="id квартир, параметр повторяется"),
+        session: AsyncSession = Depends(async_base.get_async_session),
+        user: User = Depends(auth.get_current_active_user())
+):
+    if len(apartment_ids) > listing_stats.MAX_APARTMENT_IDS:
+        return JSONResponse(
+            status_code=400, content={"message": f"At most {listing_stats.MAX_APARTMENT_IDS} apartment_ids"}
+        )
+    return await listing_stats.get_stats(session, apartment_ids)
+
+
+@app.get(
+    "/apartments/autocomplete",
+    response_model=typing.List[schemas.AutocompleteSuggestion],
+    summary='Подсказки адресов и заголовков apartments по началу ввода',
+    tags=['apartments']
+)
+async def get_autocomplete(
+        request: Request,
+        q: str = Query(..., max_length=200),
+        limit: int = Query(10, ge=1, description=f"Не больше {cfg.AUTOCOMPLETE_MAX_RESULTS}"),
+        session: AsyncSession = Depends(async_base.get_async_session),
+        user: User = Depends(auth.get_current_active_user())
+):
+    # Клиент ушел (пользователь напечатал следующую букву) - запрос в базе отменяется, ответ никто не прочтет
+    try:
+        return await cancel_on_disconnect(request, autocomplete.AUTOCOMPLETE.suggest(session, q, limit))
+    except ClientDisconnected:
+        return Response(status_code=499)
+
+
 @app.get(
     "/apartments/{apartment_id}", status_code=201, response_model=Apartment,
     summary='По айди получить apartment',
     tags=['apartments']
 )
 async def get_apartment(
+        request: Request,
         apartment_id: int,
-        db: Session = Depends(get_db),
+        fields: str = Query(None, description="Список полей через запятую или summary"),
+        session: AsyncSession = Depends(async_base.get_async_session),
         user: User = Depends(auth.get_current_active_user())
     ) -> Apartment:
-    item = apartment_service.get_apartment(db, apartment_id)
-    if item is not None:
-        return item
-    return JSONResponse(status_code=404, content={"message": "Item not found"})
+    # Готовый JSON (из кэша ответов или проекция) отдается как есть, минуя валидацию response_model
+    item = await apartment_service.get_apartment_response(session, apartment_id, fields)
+    if item is None:
+        return JSONResponse(status_code=404, content={"message": "Item not found"})
+
+    headers = conditional.validators(
+        conditional.entity_etag('apartment', apartment_id, item['version'], fields),
+        conditional.last_modified(item['updated_at'])
+    )
+    return conditional.not_modified(request, headers) or JSONResponse(status_code=201, content=item, headers=headers)
 
 
 @app.get(
@@ -141,12 +214,25 @@ async def get_apartments(
         request: Request,
         my_apartments: bool = Query(False, description="Получить свои апартаменты"),
         limit: int = Query(10, description="Максимальное количество записей"),
-        offset: int = Query(0, description="Смещение записей"),
+        offset: int = Query(0, description="Смещение записей (игнорируется, если передан cursor)"),
+        cursor: str = Query(None, description="Курсор следующей страницы из next_cursor"),
+        count: CountMode = Query(None, description="Способ подсчета total: exact, estimated, cached, none"),
+        fields: str = Query(None, description="Список полей через запятую или summary"),
+        arrival_date: datetime.date = Query(None, description="Только свободные с этой даты"),
+        departure_date: datetime.date = Query(None, description="Только свободные до этой даты"),
+        sort: str = Query(
+            None, description="popularity - по числу отзывов и добавлений в избранное; rooms, -rooms, area, -area"
+        ),
+        q: str = Query(None, description="Полнотекстовый поиск по объявлениям и отзывам"),
+        min_rooms: int = Query(None, ge=0, description="Комнат не меньше"),
+        max_rooms: int = Query(None, ge=0, description="Комнат не больше"),
+        min_area: int = Query(None, ge=0, description="Площадь не меньше"),
+        max_area: int = Query(None, ge=0, description="Площадь не больше"),
         city_name: str = Query(None, description="Название города"),
         radius: float = Query(None, description="радиус в метрах"),
         latitude: float = Query(None, description="широта"),
         longitude: float = Query(None, description="долгота"),
-        db: Session = Depends(get_db),
+        session: AsyncSession = Depends(async_base.get_async_session),
         user: User = Depends(auth.get_current_active_user())
 ) -> PaginatedApartmentResponse:
     """
@@ -154,25 +240,72 @@ async def get_apartments(
     В первую очередь по городу.
     Во вторую очередь по широте и долготе.
     Если не указать город и координаты, то вернет просто список квартир.
+    С q= найденные квартиры сортируются по релевантности (радиус при этом продолжает фильтровать).
+    min_/max_rooms и min_/max_area фильтруют по диапазону, sort=rooms/area (с минусом - по убыванию)
+    задает порядок явно.
     """
 
     if my_apartments:
-        apartments = apartment_service.get_my_apartments(db, extract_email_data(request))
-
-        return apartments
+        apartments = await apartment_service.get_my_apartments(session, extract_email_data(request), fields)
+        headers = conditional.validators(conditional.list_etag(
+            'apartments', [(item['id'], item['version']) if fields else (item.id, item.version)
+                           for item in apartments['items']]
+        ))
+        if fields:
+            return conditional.not_modified(request, headers) or JSONResponse(content=apartments, headers=headers)
+        return conditional.not_modified(request, headers) or JSONResponse(
+            content=PaginatedApartmentResponse(**apartments).model_dump(mode='json'), headers=headers
+        )
 
     apartments_query = ApartmentsQuery(
         limit=limit,
         offset=offset,
+        cursor=cursor,
+        count=count,
+        fields=fields,
+        arrival_date=arrival_date,
+        departure_date=departure_date,
+        sort=sort,
+        q=q,
+        min_rooms=min_rooms,
+        max_rooms=max_rooms,
+        min_area=min_area,
+        max_area=max_area,
         city_name=city_name,
         radius=radius,
         latitude=latitude,
         longitude=longitude
     )
 
-    apartments = apartment_service.get_apartments(db, apartments_query)
+    # Готовый JSON (из кэша ответов или проекция) отдается как есть, минуя валидацию response_model
+    apartments = await apartment_service.get_apartments_response(session, apartments_query)
+    headers = conditional.validators(conditional.list_etag(
+        'apartments', [(item['id'], item['version']) for item in apartments['items']],
+        apartments['total'], apartments['next_cursor']
+    ))
+    return conditional.not_modified(request, headers) or JSONResponse(content=apartments, headers=headers)
+
 
-    return PaginatedApartmentResponse(**apartments)
+@app.post(
+    "/apartments/import",
+    summary='Массовая загрузка apartments из CSV или NDJSON',
+    tags=['apartments']
+)
+async def import_apartments(
+        request: Request,
+        format: str = Query(None, description="csv или ndjson; по умолчанию - по Content-Type"),
+        session: AsyncSession = Depends(async_base.get_async_session),
+        user: User = Depends(auth.get_current_active_user())
+):
+    """
+    Тело запроса читается потоком. Владелец всех квартир - текущий пользователь.
+    Строки с ошибками пропускаются и перечисляются в errors с номером строки.
+    """
+    if format is None:
+        format = 'ndjson' if 'json' in request.headers.get('content-type', '') else 'csv'
+    if format not in bulk_import.FORMATS:
+        return JSONResponse(status_code=400, content={"message": "format must be csv or ndjson"})
+    return await bulk_import.import_apartments(session, request.stream(), format, extract_email_data(request))
 
 
 @app.post(
@@ -185,13 +318,13 @@ async def get_apartments(
 async def add_apartment(
         request: Request,
         apartment: BaseApartment,
-        db: Session = Depends(get_db),
+        session: AsyncSession = Depends(async_base.get_async_session),
         user: User = Depends(auth.get_current_active_user())
     ) -> Apartment:
     p = extract_email_data(request)
     print(p)
     apartment_item_create = ApartmentCreate(**apartment.dict(), publisher_email=p)
-    return apartment_service.add_apartment(db, apartment_item_create)
+    return await apartment_service.add_apartment(session, apartment_item_create)
 
 
 @app.patch(
@@ -203,11 +336,11 @@ async def update_apartment(
         request: Request,
         apartment_id: int,
         updated_item: BaseApartment,
-        db: Session = Depends(get_db),
+        session: AsyncSession = Depends(async_base.get_async_session),
         user: User = Depends(auth.get_current_active_user())
     ) -> Apartment:
     apartment_item_updated = ApartmentUpdate(**updated_item.dict(), publisher_email=extract_email_data(request))
-    item = apartment_service.update_apartment(db, apartment_id, apartment_item_updated)
+    item = await apartment_service.update_apartment(session, apartment_id, apartment_item_updated)
     if item is not None:
         return item
     return JSONResponse(status_code=404, content={"message": "Item not found"})
@@ -219,14 +352,116 @@ async def update_apartment(
 )
 async def delete_apartment(
         apartment_id: int,
-        db: Session = Depends(get_db),
+        session: AsyncSession = Depends(async_base.get_async_session),
         user: User = Depends(auth.get_current_active_user())
     ) -> Apartment:
-    if apartment_service.delete_apartment(db, apartment_id):
+    if await apartment_service.delete_apartment(session, apartment_id):
         return JSONResponse(status_code=200, content={"message": "Item successfully deleted"})
     return JSONResponse(status_code=404, content={"message": "Item not found"})
 
 
+@app.post(
+    "/images",
+    status_code=201,
+    summary='Загружает картинку и возвращает ее URL',
+    tags=['images']
+)
+async def upload_image(
+        file: UploadFile,
+        user: User = Depends(auth.get_current_active_user())
+):
+    data = await file.read(cfg.IMAGE_MAX_SIZE + 1)
+    if len(data) > cfg.IMAGE_MAX_SIZE:
+        return JSONResponse(status_code=413, content={"message": "Image is too large"})
+    key = await images.IMAGE_STORE_INITIALIZER.store.put(data)
+    return {"url": f'{images.IMAGE_STORE_INITIALIZER.url_prefix}/{key}'}
+
+
+@app.get(
+    "/images/{key}",
+    summary='Отдает картинку по ключу',
+    tags=['images']
+)
+async def get_image(key: str, request: Request):
+    if not images.KEY_RE.match(key):
+        return JSONResponse(status_code=404, content={"message": "Item not found"})
+
+    # Ключ - хэш содержимого, поэтому картинка по нему никогда не меняется
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{key}"',
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    store = images.IMAGE_STORE_INITIALIZER.store
+    blob = await store.get(key)
+    if blob is None:
+        # Превью еще не посчитано - временно отдаем оригинал
+        for original_key in images.original_keys(key):
+            if await store.exists(original_key):
+                return RedirectResponse(
+                    f'{images.IMAGE_STORE_INITIALIZER.url_prefix}/{original_key}',
+                    status_code=307, headers={"Cache-Control": "no-store"}
+                )
+        return JSONResponse(status_code=404, content={"message": "Item not found"})
+    headers["Content-Length"] = str(blob.size)
+    return StreamingResponse(blob.chunks, media_type=images.content_type(key), headers=headers)
+
+
+def export_response(query, format: str, gzip: bool, name: str):
+    if format not in export_service.FORMATS:
+        return JSONResponse(status_code=400, content={"message": "format must be ndjson or csv"})
+    headers = {"Content-Disposition": f'attachment; filename="{name}.{format}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        export_service.stream_rows(query, format, gzip), media_type=export_service.MEDIA_TYPES[format],
+        headers=headers
+    )
+
+
+@app.get(
+    "/export/apartments",
+    summary='Потоковая выгрузка всех apartments в NDJSON или CSV',
+    tags=['export']
+)
+async def export_apartments(
+        format: str = 'ndjson',
+        gzip: bool = False,
+        publisher_email: str = None,
+        updated_since: datetime.datetime = None,
+        user: User = Depends(auth.get_current_admin_user())
+):
+    return export_response(
+        export_service.apartments_query(publisher_email, updated_since), format, gzip, 'apartments'
+    )
+
+
+@app.get(
+    "/export/reservations",
+    summary='Потоковая выгрузка reservations в NDJSON или CSV',
+    tags=['export']
+)
+async def export_reservations(
+        format: str = 'ndjson',
+        gzip: bool = False,
+        apartment_id: int = None,
+        email: str = None,
+        start_date: datetime.date = None,
+        end_date: datetime.date = None,
+        user: User = Depends(auth.get_current_admin_user())
+):
+    """
+    start_date / end_date - брони, пересекающие [start_date, end_date)
+    """
+    if start_date is not None and end_date is not None and start_date >= end_date:
+        return JSONResponse(status_code=400, content={"message": "start_date must be before end_date"})
+    return export_response(
+        export_service.reservations_query(apartment_id, email, start_date, end_date), format, gzip, 'reservations'
+    )
+
+
 @app.get(
     "/favorites",
     summary='Возвращает список favorite items по почте пользователя',
@@ -237,10 +472,26 @@ async def get_favorite_items(
         request: Request,
         limit: int = 1,
         offset: int = 0,
-        db: Session = Depends(get_db),
+        cursor: str = None,
+        count: CountMode = None,
+        sort: str = Query('id', description="id - по порядку добавления, recent - сначала новые"),
+        expand: str = Query(None, description="apartment - добавить к записям карточку квартиры"),
+        session: AsyncSession = Depends(async_base.get_async_session),
         user: User = Depends(auth.get_current_active_user())
     ) -> typing.List[FavoriteItem]:
-    return favorite_service.get_favorite_items_by_user_email(db, user_email=extract_email_data(request), limit=limit, offset=offset)
+    """
+    С expand=apartment у каждой записи есть apartment - краткая карточка квартиры без картинок
+    (thumbnail - превью image1) или null, если квартиру удалили
+    """
+    if expand not in (None, 'apartment'):
+        return JSONResponse(status_code=400, content={"message": "expand must be apartment"})
+    favorites = await favorite_service.get_favorite_items_by_user_email(
+        session, user_email=extract_email_data(request), limit=limit, offset=offset, cursor=cursor, count=count,
+        sort=sort, expand_apartment=expand == 'apartment'
+    )
+    if expand:
+        return JSONResponse(content=favorites)
+    return favorites
 
 
 @app.post(
@@ -253,11 +504,49 @@ async def get_favorite_items(
 async def add_favorite_item(
         request: Request,
         favorite_item: BaseFavoriteItem,
-        db: Session = Depends(get_db),
+        session: AsyncSession = Depends(async_base.get_async_session),
         user: User = Depends(auth.get_current_active_user())
     ) -> FavoriteItem:
     favorite_item_create = FavoriteItemCreate(**favorite_item.dict(), user_email=extract_email_data(request))
-    return favorite_service.add_favorite_item(db, favorite_item_create)
+    return await favorite_service.add_favorite_item(session, favorite_item_create)
+
+@app.post(
+    "/favorites/batch",
+    response_model=schemas.FavoriteItemsBatchResult,
+    summary='Добавляет в избранное несколько apartments одним запросом',
+    tags=['favorites']
+)
+async def add_favorite_items(
+        request: Request,
+        batch: schemas.FavoriteItemsBatch,
+        session: AsyncSession = Depends(async_base.get_async_session),
+        user: User = Depends(auth.get_current_active_user())
+):
+    """
+    Уже добавленные квартиры пропускаются; в ответе - только новые
+    """
+    added = await favorite_service.add_favorite_items(session, extract_email_data(request), batch.apartment_ids)
+    return {"apartment_ids": added}
+
+
+@app.post(
+    "/favorites/batch/delete",
+    response_model=schemas.FavoriteItemsBatchResult,
+    summary='Удаляет из избранного несколько apartments одним запросом',
+    tags=['favorites']
+)
+async def delete_favorite_items(
+        request: Request,
+        batch: schemas.FavoriteItemsBatch,
+        session: AsyncSession = Depends(async_base.get_async_session),
+        user: User = Depends(auth.get_current_active_user())
+):
+    """
+    В ответе - квартиры, которые были в избранном
+    """
+    removed = await favorite_service.delete_favorite_items(session, extract_email_data(request), batch.apartment_ids)
+    return {"apartment_ids": removed}
+
 
 @app.delete(
     "/favorites/{item_id}",
@@ -266,10 +555,10 @@ async def add_favorite_item(
 )
 async def delete_favorite_item(
         item_id: int,
-        db: Session = Depends(get_db),
+        session: AsyncSession = Depends(async_base.get_async_session),
         user: User = Depends(auth.get_current_active_user())
     ) -> FavoriteItem:
-    if favorite_service.delete_favorite_item(db, item_id):
+    if await favorite_service.delete_favorite_item(session, item_id):
         return JSONResponse(status_code=200, content={"message": "Item successfully deleted"})
     return JSONResponse(status_code=404, content={"message": "Item not found"})
 
@@ -280,14 +569,21 @@ async def delete_favorite_item(
     tags=['reservations']
 )
 async def get_reservation(
+        request: Request,
+        response: Response,
         reservation_id: int,
-        db: Session = Depends(get_db),
+        session: AsyncSession = Depends(async_base.get_async_session),
         user: User = Depends(auth.get_current_active_user())
     ) -> Reservation:
-    item = reservation_service.get_reservation_item(db, reservation_id)
-    if item is not None:
-        return item
-    return JSONResponse(status_code=404, content={"message": "Item not found"})
+    item = await reservation_service.get_reservation_item(session, reservation_id)
+    if item is None:
+        return JSONResponse(status_code=404, content={"message": "Item not found"})
+
+    headers = conditional.validators(
+        conditional.entity_etag('reservation', item.id, item.version), conditional.last_modified(item.updated_at)
+    )
+    response.headers.update(headers)
+    return conditional.not_modified(request, headers) or item
 
 
 @app.get(
@@ -298,12 +594,23 @@ async def get_reservation(
 )
 async def get_reservations(
         request: Request,
+        response: Response,
         limit: int = 1,
         offset: int = 0,
-        db: Session = Depends(get_db),
+        cursor: str = None,
+        count: CountMode = None,
+        session: AsyncSession = Depends(async_base.get_async_session),
         user: User = Depends(auth.get_current_active_user())
 ) -> typing.List[Reservation]:
-    return reservation_service.get_reservation_items(db, extract_email_data(request), limit=limit, offset=offset)
+    reservations = await reservation_service.get_reservation_items(
+        session, extract_email_data(request), limit=limit, offset=offset, cursor=cursor, count=count
+    )
+    headers = conditional.validators(conditional.list_etag(
+        'reservations', [(item.id, item.version) for item in reservations['items']],
+        reservations['total'], reservations['next_cursor']
+    ))
+    response.headers.update(headers)
+    return conditional.not_modified(request, headers) or reservations
 
 
 @app.get(
@@ -317,10 +624,10 @@ async def get_reserved_periods_trimmed(
         apartment_id: int,
         start_date: datetime.date,
         end_date: datetime.date,
-        db: Session = Depends(get_db),
+        session: AsyncSession = Depends(async_base.get_async_session),
         user: User = Depends(auth.get_current_active_user())
 ) -> List[Tuple[str, datetime.date, datetime.date]]:
-    return reservation_service.get_reserved_periods_trimmed(db, apartment_id, start_date, end_date)
+    return await reservation_service.get_reserved_periods_trimmed(session, apartment_id, start_date, end_date)
 
 
 @app.get(
@@ -334,10 +641,26 @@ async def get_available_periods(
         apartment_id: int,
         start_date: datetime.date,
         end_date: datetime.date,
-        db: Session = Depends(get_db),
+        session: AsyncSession = Depends(async_base.get_async_session),
         user: User = Depends(auth.get_current_active_user())
 ) -> List[Tuple[datetime.date, datetime.date]]:
-    return reservation_service.get_available_periods(db, apartment_id, start_date, end_date)
+    return await reservation_service.get_available_periods(session, apartment_id, start_date, end_date)
+
+
+@app.post(
+    "/availability/batch",
+    summary='Какие из квартир свободны на даты',
+    response_model=schemas.AvailabilityBatch,
+    tags=['reservations']
+)
+async def get_availability_batch(
+        query: schemas.AvailabilityBatchQuery,
+        session: AsyncSession = Depends(async_base.get_async_session),
+        user: User = Depends(auth.get_current_active_user())
+):
+    return await reservation_service.get_available_apartments(
+        session, query.apartment_ids, query.start_date, query.end_date
+    )
 
 
 @app.post(
@@ -350,11 +673,11 @@ async def get_available_periods(
 async def add_reservation(
         request: Request,
         reservation: BaseReservation,
-        db: Session = Depends(get_db),
+        session: AsyncSession = Depends(async_base.get_async_session),
         user: User = Depends(auth.get_current_active_user())
     ) -> Reservation:
     reservation_item_create = ReservationCreate(**reservation.dict(), email=extract_email_data(request))
-    item = await reservation_service.add_reservation_item(db, reservation_item_create)
+    item = await reservation_service.add_reservation_item(session, reservation_item_create)
     if item is not None:
         return item
     return JSONResponse(status_code=404, content={"message": f"Элемент уже существует в списке."})
@@ -367,10 +690,10 @@ async def add_reservation(
 )
 async def delete_reservation(
         reservation_id: int,
-        db: Session = Depends(get_db),
+        session: AsyncSession = Depends(async_base.get_async_session),
         user: User = Depends(auth.get_current_active_user())
     ) -> Reservation:
-    if reservation_service.delete_reservation_item(db, reservation_id):
+    if await reservation_service.delete_reservation_item(session, reservation_id):
         return JSONResponse(status_code=200, content={"message": "Item successfully deleted"})
     return JSONResponse(status_code=404, content={"message": "Item not found"})
 
@@ -381,13 +704,24 @@ async def delete_reservation(
          tags=['reviews']
 )
 async def get_reviews(
+    request: Request,
+    response: Response,
     apartment_id: int,
     skip: int = 0,
     limit: int = 10,
-    db: Session = Depends(get_db),
+    cursor: str = None,
+    session: AsyncSession = Depends(async_base.get_async_session),
     user: User = Depends(auth.get_current_active_user())
 ):
-    return review_service.get_reviews_by_apartment_id(db, apartment_id, skip, limit)
+    # Тело ответа остается списком, курсор следующей страницы отдается в заголовке
+    reviews = await review_service.get_reviews_by_apartment_id(session, apartment_id, skip, limit, cursor)
+    headers = conditional.validators(conditional.list_etag(
+        'reviews', [(item.id, item.version) for item in reviews["items"]], reviews["next_cursor"]
+    ))
+    if reviews["next_cursor"] is not None:
+        headers["X-Next-Cursor"] = reviews["next_cursor"]
+    response.headers.update(headers)
+    return conditional.not_modified(request, headers) or reviews["items"]
 
 
 @app.post("/reviews",
@@ -398,11 +732,11 @@ async def get_reviews(
 async def add_review(
     request: Request,
     review: ReviewBase,
-    db: Session = Depends(get_db),
+    session: AsyncSession = Depends(async_base.get_async_session),
     user: User = Depends(auth.get_current_active_user())
 ) -> Review:
     review_item_create = ReviewCreate(**review.dict(), user_email=extract_email_data(request))
-    review = await review_service.add_review(db, review_item_create)
+    review = await review_service.add_review(session, review_item_create)
     if review:
         return review
     return JSONResponse(status_code=400, content={"message": "Отзыв уже существует"})
@@ -412,14 +746,21 @@ async def add_review(
          tags=['reviews']
 )
 async def get_review_uid(
+    request: Request,
+    response: Response,
     review_id: int,
-    db: Session = Depends(get_db),
+    session: AsyncSession = Depends(async_base.get_async_session),
     user: User = Depends(auth.get_current_active_user())
 ) -> Review:
-    review = review_service.get_review_by_uid(db, review_id)
+    review = await review_service.get_review_by_uid(session, review_id)
     if review is None:
         return JSONResponse(status_code=404, content={"message": "Not found"})
-    return review
+
+    headers = conditional.validators(
+        conditional.entity_etag('review', review.id, review.version), conditional.last_modified(review.updated_at)
+    )
+    response.headers.update(headers)
+    return conditional.not_modified(request, headers) or review
 
 
 @app.patch("/reviews/{review_id}",
@@ -429,10 +770,10 @@ async def get_review_uid(
 async def update_review(
     review_id: int,
     review_update: ReviewUpdate,
-    db: Session = Depends(get_db),
+    session: AsyncSession = Depends(async_base.get_async_session),
     user: User = Depends(auth.get_current_active_user())
 ) -> Review:
-    review = review_service.update_review_by_uid(db, review_id, review_update)
+    review = await review_service.update_review_by_uid(session, review_id, review_update)
     if review is None:
         return JSONResponse(status_code=404, content={"message": "Not found"})
     return review
@@ -444,10 +785,10 @@ async def update_review(
 )
 async def delete_review(
     review_id: int,
-    db: Session = Depends(get_db),
+    session: AsyncSession = Depends(async_base.get_async_session),
     user: User = Depends(auth.get_current_active_user())
 ) -> Review:
-    return review_service.remove_review_by_uid(db, review_id)
+    return await review_service.remove_review_by_uid(session, review_id)
 
 
 
@@ -1,8 +1,12 @@
 import uuid
-from typing import Any, Coroutine
+from typing import Any, Coroutine, Optional
 from uuid import UUID
+from fastapi import Depends, HTTPException, Request
 from fastapi_users import FastAPIUsers
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import async_base
 from app.database.models import User
+from app.auth import identity
 from app.auth.manager import get_user_manager
 from fastapi_users.authentication import (
     AuthenticationBackend,
@@ -11,6 +15,9 @@ from fastapi_users.authentication import (
 )
 from fastapi_users.jwt import generate_jwt
 
+# id группы Admin (группы по умолчанию создаются при старте, см. app.py)
+ADMIN_GROUP_ID = 3
+
 
 class CustomJWTStrategy(JWTStrategy):
     async def write_token(self, user: Any) -> Coroutine[Any, Any, str]:
@@ -25,8 +32,11 @@ class AuthInitializer():
         self.secret_phrase: str | None = None
         self.cookie_transport = None
         self.auth_backend = None
+        self.fastapi_users = None
+        self.current_active_user = None
+        self.current_admin_user = None
 
-    def initializer(self, secret):
+    def initializer(self, secret, mode: str = 'database'):
         self.secret_phrase = secret
         self.cookie_transport = BearerTransport(tokenUrl="auth/jwt/login")
         #self.cookie_transport = CookieTransport(cookie_name="bonds", cookie_max_age=3600,cookie_secure=False)
@@ -35,6 +45,46 @@ class AuthInitializer():
             transport=self.cookie_transport,
             get_strategy=self.get_jwt_strategy,
         )
+        # Зависимости создаются один раз: FastAPI кэширует их в пределах запроса по идентичности
+        self.fastapi_users = FastAPIUsers[User, uuid.UUID](get_user_manager, [self.auth_backend])
+        if mode == 'stateless':
+            self.current_active_user = self._stateless_user()
+        else:
+            self.current_active_user = self._database_user()
+        self.current_admin_user = self._admin_user(self.current_active_user)
+
+    def _database_user(self):
+        current_user = self.fastapi_users.current_user(active=True)
+
+        async def current_active_user(request: Request, user: User = Depends(current_user)):
+            request.state.user_email = user.email
+            return user
+
+        return current_active_user
+
+    def _stateless_user(self):
+        strategy = self.get_jwt_strategy()
+
+        async def current_active_user(
+                request: Request,
+                token: Optional[str] = Depends(self.cookie_transport.scheme),
+                session: AsyncSession = Depends(async_base.get_async_session)
+        ) -> identity.TokenUser:
+            user = await identity.user_from_token(session, token, strategy.decode_key, strategy.token_audience)
+            if user is None:
+                raise HTTPException(status_code=401, detail="Unauthorized")
+            request.state.user_email = user.email
+            return user
+
+        return current_active_user
+
+    def _admin_user(self, current_active_user):
+        async def current_admin_user(user: User = Depends(current_active_user)):
+            if user.group_id != ADMIN_GROUP_ID:
+                raise HTTPException(status_code=403, detail="Forbidden")
+            return user
+
+        return current_admin_user
 
     def get_jwt_strategy(self) -> JWTStrategy:
         return CustomJWTStrategy(secret=self.secret_phrase, lifetime_seconds=3600)
@@ -43,9 +93,12 @@ class AuthInitializer():
         return self.auth_backend
 
     def get_fastapi_users(self) -> FastAPIUsers[User, UUID]:
-        return FastAPIUsers[User, uuid.UUID](get_user_manager, [self.get_auth_backend()])
+        return self.fastapi_users
 
     def get_current_active_user(self):
-        return self.get_fastapi_users().current_user(active=True)
+        return self.current_active_user
+
+    def get_current_admin_user(self):
+        return self.current_admin_user
 
 
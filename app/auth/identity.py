@@ -0,0 +1,60 @@
+import typing
+import uuid
+
+import jwt
+from fastapi_users.jwt import SecretType, decode_jwt
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config
+from app.cache import LRUCache, MISSING
+from app.database.models import User
+
+cfg: config.Config = config.load_config()
+
+
+class TokenUser(typing.NamedTuple):
+    '''
+    Пользователь, восстановленный из claims JWT (см. CustomJWTStrategy.write_token)
+    '''
+    id: uuid.UUID
+    email: str
+    group_id: typing.Optional[int]
+
+
+# user id -> TokenUser активного пользователя или None (удален, заблокирован)
+USER_CACHE = LRUCache(cfg.AUTH_USER_CACHE_SIZE)
+
+
+def revoke(user_id: uuid.UUID) -> None:
+    '''
+    Сбрасывает закэшированное состояние пользователя; следующий запрос перечитает его из базы.
+    Другие воркеры увидят изменение не позже AUTH_USER_CACHE_TTL
+    '''
+    USER_CACHE.pop(user_id)
+
+
+async def user_from_token(
+        session: AsyncSession, token: typing.Optional[str], secret: SecretType, audience: typing.List[str]
+) -> typing.Optional[TokenUser]:
+    '''
+    Проверяет подпись и срок токена и возвращает пользователя из claims.
+    База читается только при промахе USER_CACHE - чтобы заблокированный пользователь не жил дольше TTL
+    '''
+    if token is None:
+        return None
+    try:
+        claims = decode_jwt(token, secret, audience)
+        user_id = uuid.UUID(claims["sub"])
+    except (jwt.PyJWTError, KeyError, ValueError):
+        return None
+
+    user = USER_CACHE.get(user_id)
+    if user is MISSING:
+        row = await session.get(User, user_id)
+        user = TokenUser(row.id, row.email, row.group_id) if row is not None and row.is_active else None
+        USER_CACHE.set(user_id, user, cfg.AUTH_USER_CACHE_TTL)
+
+    # Токен, выписанный до смены email, больше не подходит
+    if user is None or user.email != claims.get("email"):
+        return None
+    return user
@@ -18,6 +18,9 @@ from fastapi_users.authentication import (
 # from fastapi_users.db import BeanieUserDatabase, ObjectIDIDMixin
 
 from app.database.models import User
+from app.auth import identity
+
+cfg: config.Config = config.load_config()
 
 
 class UserManager(UUIDIDMixin, BaseUserManager[models.User, uuid.UUID]):
@@ -35,12 +38,22 @@ class UserManager(UUIDIDMixin, BaseUserManager[models.User, uuid.UUID]):
     ):
         print(f"Verification requested for user {user.id}. Verification token: {token}")
 
+    # Изменения, после которых закэшированный в stateless режиме пользователь устаревает
+    async def on_after_update(self, user: models.User, update_dict: dict, request: Optional[Request] = None):
+        identity.revoke(user.id)
+
+    async def on_after_reset_password(self, user: models.User, request: Optional[Request] = None):
+        identity.revoke(user.id)
+
+    async def on_after_delete(self, user: models.User, request: Optional[Request] = None):
+        identity.revoke(user.id)
+
 
 async def get_user_manager(
         user_db=Depends(models.get_user_db),
 ):
     user_manager = UserManager(user_db)
-    user_manager.reset_password_token_secret = config.load_config().reset_password_token_secret
-    user_manager.verification_token_secret = config.load_config().verification_token_secret
+    user_manager.reset_password_token_secret = cfg.reset_password_token_secret
+    user_manager.verification_token_secret = cfg.verification_token_secret
     yield user_manager
 
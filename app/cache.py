@@ -0,0 +1,41 @@
+import collections
+import time
+import typing
+
+MISSING = object()
+
+
+class LRUCache():
+    '''
+    In-process LRU с TTL на каждую запись. Значение None тоже кэшируется,
+    промах возвращается как MISSING
+    '''
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: collections.OrderedDict = collections.OrderedDict()
+
+    def get(self, key: typing.Hashable):
+        entry = self._data.get(key, MISSING)
+        if entry is MISSING:
+            return MISSING
+        value, expires_at = entry
+        if expires_at <= time.time():
+            del self._data[key]
+            return MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: typing.Hashable, value, ttl: float) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (value, time.time() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: typing.Hashable) -> None:
+        self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -14,6 +14,67 @@ class Config(BaseSettings):
         alias='POSTGRES_DSN_ASYNC'
     )
 
+    # Пул соединений на один воркер: pool_size + max_overflow <= бюджет соединений Postgres / число воркеров
+    DB_POOL_SIZE: int = Field(
+        default=5,
+        env='DB_POOL_SIZE',
+        alias='DB_POOL_SIZE'
+    )
+
+    DB_MAX_OVERFLOW: int = Field(
+        default=10,
+        env='DB_MAX_OVERFLOW',
+        alias='DB_MAX_OVERFLOW'
+    )
+
+    # Сколько секунд ждать свободного соединения
+    DB_POOL_TIMEOUT: float = Field(
+        default=30,
+        env='DB_POOL_TIMEOUT',
+        alias='DB_POOL_TIMEOUT'
+    )
+
+    # Переоткрывать соединения старше N секунд; -1 - не переоткрывать
+    DB_POOL_RECYCLE: int = Field(
+        default=1800,
+        env='DB_POOL_RECYCLE',
+        alias='DB_POOL_RECYCLE'
+    )
+
+    DB_POOL_PRE_PING: bool = Field(
+        default=True,
+        env='DB_POOL_PRE_PING',
+        alias='DB_POOL_PRE_PING'
+    )
+
+    # Сколько соединений открыть при старте
+    DB_POOL_WARMUP: int = Field(
+        default=2,
+        env='DB_POOL_WARMUP',
+        alias='DB_POOL_WARMUP'
+    )
+
+    # Сколько секунд при остановке ждать возврата выданных соединений
+    DB_POOL_DRAIN_TIMEOUT: float = Field(
+        default=10,
+        env='DB_POOL_DRAIN_TIMEOUT',
+        alias='DB_POOL_DRAIN_TIMEOUT'
+    )
+
+    # Кэш prepared statements asyncpg на соединение
+    DB_STATEMENT_CACHE_SIZE: int = Field(
+        default=100,
+        env='DB_STATEMENT_CACHE_SIZE',
+        alias='DB_STATEMENT_CACHE_SIZE'
+    )
+
+    # Работа через pgbouncer в transaction pooling: без кэша prepared statements
+    DB_PGBOUNCER: bool = Field(
+        default=False,
+        env='DB_PGBOUNCER',
+        alias='DB_PGBOUNCER'
+    )
+
     FRONT: str = Field(
         default='http://localhost:3000',
         env='FRONT',
@@ -38,6 +99,328 @@ class Config(BaseSettings):
         alias='VERIFICATION_TOKEN_SECRET'
     )
 
+    # database - пользователь читается из базы на каждый запрос (fastapi-users),
+    # stateless - из claims JWT, база только при промахе кэша пользователей
+    AUTH_MODE: str = Field(
+        default='database',
+        env='AUTH_MODE',
+        alias='AUTH_MODE'
+    )
+
+    # Сколько секунд заблокированный/удаленный пользователь может оставаться активным в других воркерах
+    AUTH_USER_CACHE_TTL: float = Field(
+        default=60,
+        env='AUTH_USER_CACHE_TTL',
+        alias='AUTH_USER_CACHE_TTL'
+    )
+
+    AUTH_USER_CACHE_SIZE: int = Field(
+        default=10000,
+        env='AUTH_USER_CACHE_SIZE',
+        alias='AUTH_USER_CACHE_SIZE'
+    )
+
+    # nominatim - внешний HTTP сервис, gazetteer - локальный файл GeoNames без сетевых запросов
+    GEOCODER_BACKEND: str = Field(
+        default='nominatim',
+        env='GEOCODER_BACKEND',
+        alias='GEOCODER_BACKEND'
+    )
+
+    GEOCODER_GAZETTEER_PATH: str = Field(
+        default='data/cities.tsv',
+        env='GEOCODER_GAZETTEER_PATH',
+        alias='GEOCODER_GAZETTEER_PATH'
+    )
+
+    GEOCODER_URL: str = Field(
+        default='https://nominatim.openstreetmap.org/search',
+        env='GEOCODER_URL',
+        alias='GEOCODER_URL'
+    )
+
+    GEOCODER_TIMEOUT: float = Field(
+        default=10,
+        env='GEOCODER_TIMEOUT',
+        alias='GEOCODER_TIMEOUT'
+    )
+
+    # Пустая строка отключает дисковый кэш
+    GEOCODER_CACHE_PATH: str = Field(
+        default='geocode_cache.sqlite3',
+        env='GEOCODER_CACHE_PATH',
+        alias='GEOCODER_CACHE_PATH'
+    )
+
+    GEOCODER_LRU_SIZE: int = Field(
+        default=4096,
+        env='GEOCODER_LRU_SIZE',
+        alias='GEOCODER_LRU_SIZE'
+    )
+
+    # Время жизни найденных координат, секунды
+    GEOCODER_CACHE_TTL: float = Field(
+        default=30 * 24 * 3600,
+        env='GEOCODER_CACHE_TTL',
+        alias='GEOCODER_CACHE_TTL'
+    )
+
+    # Время жизни отрицательного результата ("город не найден"), секунды
+    GEOCODER_NEGATIVE_TTL: float = Field(
+        default=3600,
+        env='GEOCODER_NEGATIVE_TTL',
+        alias='GEOCODER_NEGATIVE_TTL'
+    )
+
+    # exact | estimated | cached | none - способ подсчета total в пагинированных ответах
+    PAGINATION_COUNT_MODE: str = Field(
+        default='exact',
+        env='PAGINATION_COUNT_MODE',
+        alias='PAGINATION_COUNT_MODE'
+    )
+
+    PAGINATION_COUNT_CACHE_TTL: float = Field(
+        default=30,
+        env='PAGINATION_COUNT_CACHE_TTL',
+        alias='PAGINATION_COUNT_CACHE_TTL'
+    )
+
+    PAGINATION_COUNT_CACHE_SIZE: int = Field(
+        default=1024,
+        env='PAGINATION_COUNT_CACHE_SIZE',
+        alias='PAGINATION_COUNT_CACHE_SIZE'
+    )
+
+    # local | s3 - где хранятся картинки квартир
+    IMAGE_STORE: str = Field(
+        default='local',
+        env='IMAGE_STORE',
+        alias='IMAGE_STORE'
+    )
+
+    IMAGE_STORE_PATH: str = Field(
+        default='images',
+        env='IMAGE_STORE_PATH',
+        alias='IMAGE_STORE_PATH'
+    )
+
+    # Префикс URL, по которому картинки отдаются клиентам
+    IMAGE_URL_PREFIX: str = Field(
+        default='/images',
+        env='IMAGE_URL_PREFIX',
+        alias='IMAGE_URL_PREFIX'
+    )
+
+    IMAGE_MAX_SIZE: int = Field(
+        default=10 * 1024 * 1024,
+        env='IMAGE_MAX_SIZE',
+        alias='IMAGE_MAX_SIZE'
+    )
+
+    # Процессы для расчета превью; 0 - не считать превью внутри сервиса
+    IMAGE_DERIVATIVE_WORKERS: int = Field(
+        default=2,
+        env='IMAGE_DERIVATIVE_WORKERS',
+        alias='IMAGE_DERIVATIVE_WORKERS'
+    )
+
+    IMAGE_THUMB_SIZE: int = Field(
+        default=256,
+        env='IMAGE_THUMB_SIZE',
+        alias='IMAGE_THUMB_SIZE'
+    )
+
+    IMAGE_MEDIUM_SIZE: int = Field(
+        default=1024,
+        env='IMAGE_MEDIUM_SIZE',
+        alias='IMAGE_MEDIUM_SIZE'
+    )
+
+    IMAGE_S3_BUCKET: str = Field(
+        default='apartment-images',
+        env='IMAGE_S3_BUCKET',
+        alias='IMAGE_S3_BUCKET'
+    )
+
+    IMAGE_S3_ENDPOINT_URL: str = Field(
+        default='',
+        env='IMAGE_S3_ENDPOINT_URL',
+        alias='IMAGE_S3_ENDPOINT_URL'
+    )
+
+    IMAGE_S3_REGION: str = Field(
+        default='',
+        env='IMAGE_S3_REGION',
+        alias='IMAGE_S3_REGION'
+    )
+
+    IMAGE_S3_ACCESS_KEY: str = Field(
+        default='',
+        env='IMAGE_S3_ACCESS_KEY',
+        alias='IMAGE_S3_ACCESS_KEY'
+    )
+
+    IMAGE_S3_SECRET_KEY: SecretStr = Field(
+        default='',
+        env='IMAGE_S3_SECRET_KEY',
+        alias='IMAGE_S3_SECRET_KEY'
+    )
+
+    # Сколько квартир держит in-memory индекс броней
+    AVAILABILITY_INDEX_SIZE: int = Field(
+        default=10000,
+        env='AVAILABILITY_INDEX_SIZE',
+        alias='AVAILABILITY_INDEX_SIZE'
+    )
+
+    # Время жизни квартиры в индексе, секунды: брони могут меняться другими воркерами
+    AVAILABILITY_INDEX_TTL: float = Field(
+        default=60,
+        env='AVAILABILITY_INDEX_TTL',
+        alias='AVAILABILITY_INDEX_TTL'
+    )
+
+    # Каждое N-е чтение из индекса сверяется с базой; 0 - не сверять
+    AVAILABILITY_INDEX_VERIFY_EVERY: int = Field(
+        default=1000,
+        env='AVAILABILITY_INDEX_VERIFY_EVERY',
+        alias='AVAILABILITY_INDEX_VERIFY_EVERY'
+    )
+
+    # Время жизни года в битовых масках занятости, секунды
+    OCCUPANCY_INDEX_TTL: float = Field(
+        default=300,
+        env='OCCUPANCY_INDEX_TTL',
+        alias='OCCUPANCY_INDEX_TTL'
+    )
+
+    # Сколько лет битовых масок занятости держать в памяти
+    OCCUPANCY_INDEX_YEARS: int = Field(
+        default=4,
+        env='OCCUPANCY_INDEX_YEARS',
+        alias='OCCUPANCY_INDEX_YEARS'
+    )
+
+    # Максимальная длина диапазона дат в /availability/batch, дни
+    OCCUPANCY_MAX_DAYS: int = Field(
+        default=366,
+        env='OCCUPANCY_MAX_DAYS',
+        alias='OCCUPANCY_MAX_DAYS'
+    )
+
+    # Максимум apartment_ids в одном запросе /availability/batch
+    OCCUPANCY_BATCH_MAX: int = Field(
+        default=5000,
+        env='OCCUPANCY_BATCH_MAX',
+        alias='OCCUPANCY_BATCH_MAX'
+    )
+
+    # Максимум apartment_ids в одном запросе /favorites/batch
+    FAVORITES_BATCH_MAX: int = Field(
+        default=1000,
+        env='FAVORITES_BATCH_MAX',
+        alias='FAVORITES_BATCH_MAX'
+    )
+
+    RESPONSE_CACHE_ENABLED: bool = Field(
+        default=True,
+        env='RESPONSE_CACHE_ENABLED',
+        alias='RESPONSE_CACHE_ENABLED'
+    )
+
+    RESPONSE_CACHE_SIZE: int = Field(
+        default=10000,
+        env='RESPONSE_CACHE_SIZE',
+        alias='RESPONSE_CACHE_SIZE'
+    )
+
+    # Время жизни записи в локальном уровне: столько изменения из других воркеров могут быть не видны
+    RESPONSE_CACHE_LOCAL_TTL: float = Field(
+        default=5,
+        env='RESPONSE_CACHE_LOCAL_TTL',
+        alias='RESPONSE_CACHE_LOCAL_TTL'
+    )
+
+    # Время жизни записи в общем уровне, секунды
+    RESPONSE_CACHE_TTL: int = Field(
+        default=300,
+        env='RESPONSE_CACHE_TTL',
+        alias='RESPONSE_CACHE_TTL'
+    )
+
+    # redis://... общий уровень кэша (пакет redis), пустая строка - только локальный
+    RESPONSE_CACHE_REDIS_URL: str = Field(
+        default='',
+        env='RESPONSE_CACHE_REDIS_URL',
+        alias='RESPONSE_CACHE_REDIS_URL'
+    )
+
+    # Шаг округления координат (градусы) и радиуса (метры) гео-запросов для ключа кэша
+    RESPONSE_CACHE_COORD_STEP: float = Field(
+        default=0.001,
+        env='RESPONSE_CACHE_COORD_STEP',
+        alias='RESPONSE_CACHE_COORD_STEP'
+    )
+
+    RESPONSE_CACHE_RADIUS_STEP: float = Field(
+        default=100,
+        env='RESPONSE_CACHE_RADIUS_STEP',
+        alias='RESPONSE_CACHE_RADIUS_STEP'
+    )
+
+    # Автодополнение: не больше стольких подсказок в ответе
+    AUTOCOMPLETE_MAX_RESULTS: int = Field(
+        default=20,
+        env='AUTOCOMPLETE_MAX_RESULTS',
+        alias='AUTOCOMPLETE_MAX_RESULTS'
+    )
+
+    # Сколько совпадений по каждому полю ранжировать; ограничивает работу на коротких частых префиксах
+    AUTOCOMPLETE_CANDIDATES: int = Field(
+        default=300,
+        env='AUTOCOMPLETE_CANDIDATES',
+        alias='AUTOCOMPLETE_CANDIDATES'
+    )
+
+    # pg_trgm.word_similarity_threshold для подсказок
+    AUTOCOMPLETE_MIN_SIMILARITY: float = Field(
+        default=0.5,
+        env='AUTOCOMPLETE_MIN_SIMILARITY',
+        alias='AUTOCOMPLETE_MIN_SIMILARITY'
+    )
+
+    # statement_timeout запроса подсказок, мс
+    AUTOCOMPLETE_TIMEOUT_MS: int = Field(
+        default=200,
+        env='AUTOCOMPLETE_TIMEOUT_MS',
+        alias='AUTOCOMPLETE_TIMEOUT_MS'
+    )
+
+    AUTOCOMPLETE_CACHE_SIZE: int = Field(
+        default=5000,
+        env='AUTOCOMPLETE_CACHE_SIZE',
+        alias='AUTOCOMPLETE_CACHE_SIZE'
+    )
+
+    AUTOCOMPLETE_CACHE_TTL: float = Field(
+        default=30,
+        env='AUTOCOMPLETE_CACHE_TTL',
+        alias='AUTOCOMPLETE_CACHE_TTL'
+    )
+
+    # Строк на одну выборку из серверного курсора при выгрузке (/export/*): от него зависит память воркера
+    EXPORT_BATCH_SIZE: int = Field(
+        default=2000,
+        env='EXPORT_BATCH_SIZE',
+        alias='EXPORT_BATCH_SIZE'
+    )
+
+    EXPORT_GZIP_LEVEL: int = Field(
+        default=6,
+        env='EXPORT_GZIP_LEVEL',
+        alias='EXPORT_GZIP_LEVEL'
+    )
+
     class Config:
         env_file = "example.env"  # Указываем имя файла example.env
         extra = Extra.allow  # Разрешаем дополнительные входные данные
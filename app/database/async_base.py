@@ -1,19 +1,99 @@
-from sqlalchemy import inspect
+import asyncio
+import logging
+import time
+import uuid
+
+from sqlalchemy import exc, inspect, text
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.schema import CreateSchema
 
 from typing import AsyncGenerator
 
+logger = logging.getLogger(__name__)
+
+
+class PoolMetrics():
+    '''
+    Счетчики выдачи соединений из пула: сколько раз, сколько ждали, сколько раз не дождались
+    '''
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def observe(self, wait: float):
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    '''
+    Пул, замеряющий ожидание соединения (включая установку нового соединения)
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        self.metrics.observe(time.perf_counter() - started)
+        return connection
+
+
+def engine_options(cfg) -> dict:
+    '''
+    Параметры create_async_engine из конфигурации. В режиме pgbouncer (transaction pooling)
+    prepared statements не кэшируются и получают уникальные имена
+    '''
+    if cfg.DB_PGBOUNCER:
+        connect_args = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f'__asyncpg_{uuid.uuid4()}__',
+        }
+    else:
+        connect_args = {"prepared_statement_cache_size": cfg.DB_STATEMENT_CACHE_SIZE}
+
+    return {
+        "pool_size": cfg.DB_POOL_SIZE,
+        "max_overflow": cfg.DB_MAX_OVERFLOW,
+        "pool_timeout": cfg.DB_POOL_TIMEOUT,
+        "pool_recycle": cfg.DB_POOL_RECYCLE,
+        "pool_pre_ping": cfg.DB_POOL_PRE_PING,
+        "connect_args": connect_args,
+    }
+
 
 class Database_Initializer():
-    def __init__(self, base, schema):
+    def __init__(self, base, schema, extensions=()):
         self.base = base
         self.schema = schema
+        self.extensions = extensions
+        self.engine = None
         self.async_session_maker = None
+        self.metrics = PoolMetrics()
 
-    async def init_db(self, postgre_dsn):
-        engine = create_async_engine(postgre_dsn)
+    async def init_db(self, postgre_dsn, cfg=None):
+        options = engine_options(cfg) if cfg is not None else {}
+        engine = create_async_engine(postgre_dsn, poolclass=MeteredQueuePool, **options)
+        engine.pool.metrics = self.metrics
+        self.engine = engine
         self.async_session_maker = async_sessionmaker(
             engine, expire_on_commit=False
         )
@@ -28,15 +108,61 @@ class Database_Initializer():
                 await connection.execute(CreateSchema(schema))
                 # await connection.commit()
 
+            # extensions, нужные ограничениям и индексам моделей
+            for extension in self.extensions:
+                await connection.execute(text(f'CREATE EXTENSION IF NOT EXISTS {extension}'))
+
             # create metadata
             await connection.run_sync(self.base.metadata.create_all)
 
+        if cfg is not None and cfg.DB_POOL_WARMUP:
+            await self.warm_up(min(cfg.DB_POOL_WARMUP, cfg.DB_POOL_SIZE))
+
+    async def warm_up(self, connections: int):
+        '''
+        Открывает соединения заранее, чтобы первые запросы после старта не платили за connect
+        '''
+        opened = await asyncio.gather(*(self.engine.connect() for _ in range(connections)))
+        for connection in opened:
+            await connection.close()
+        logger.info(f'Database pool warmed up: {self.pool_stats()}')
+
+    def pool_stats(self) -> dict:
+        if self.engine is None:
+            # Пул еще не создан или уже закрыт (остановка сервиса)
+            return {"closed": True}
+        pool = self.engine.pool
+        return {
+            "closed": False,
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "checkouts": self.metrics.checkouts,
+            "timeouts": self.metrics.timeouts,
+            "wait_avg_ms": 1000 * self.metrics.wait_total / self.metrics.checkouts if self.metrics.checkouts else 0.0,
+            "wait_max_ms": 1000 * self.metrics.wait_max,
+        }
+
+    async def close(self, drain_timeout: float = 0):
+        '''
+        Ждет возврата выданных соединений (не дольше drain_timeout) и закрывает пул
+        '''
+        if self.engine is None:
+            return
+        deadline = time.monotonic() + drain_timeout
+        while self.engine.pool.checkedout() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        logger.info(f'Disposing database pool: {self.pool_stats()}')
+        await self.engine.dispose()
+        self.engine = None
+
 
 SCHEMA = "users"
 BASE = declarative_base()
-DB_INITIALIZER = Database_Initializer(BASE, SCHEMA)
+DB_INITIALIZER = Database_Initializer(BASE, SCHEMA, extensions=('btree_gist', 'pg_trgm'))
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with DB_INITIALIZER.async_session_maker() as session:
-        yield session
\ No newline at end of file
+        yield session
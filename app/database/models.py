@@ -1,10 +1,10 @@
 # apartment_rental_monolith/app/database/models.py
-from sqlalchemy import Column, Integer, String, Float, Text, Date, ForeignKey
-from sqlalchemy.orm import relationship, mapped_column
-from geoalchemy2 import Geometry
+from sqlalchemy import Column, Computed, Integer, String, Float, Text, Date, DateTime, ForeignKey, Index, func, text
+from sqlalchemy.dialects.postgresql import DATERANGE, TSVECTOR, ExcludeConstraint
+from sqlalchemy.orm import deferred, relationship, mapped_column
+from geoalchemy2 import Geography
 from fastapi_users.db import SQLAlchemyBaseUserTableUUID
 from uuid import uuid4
-from app.database.base import Base
 from app.database import async_base
 from fastapi import Depends
 from fastapi_users.db import SQLAlchemyBaseUserTableUUID, SQLAlchemyUserDatabase
@@ -33,8 +33,39 @@ async def get_user_db(session: AsyncSession = Depends(async_base.get_async_sessi
     yield SQLAlchemyUserDatabase(session, User)
 
 
-class Apartment(Base):
+# Конфигурация полнотекстового поиска: русская морфология, латиница - английский стемминг
+SEARCH_CONFIG = 'russian'
+
+
+def search_vector(*weighted_columns) -> str:
+    '''
+    Выражение generated колонки tsvector: (колонка, вес A-D), ...
+    '''
+    return ' || '.join(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce({column}, '')), '{weight}')"
+        for column, weight in weighted_columns
+    )
+
+
+class Apartment(async_base.BASE):
     __tablename__ = 'apartments'
+    __table_args__ = (
+        Index('ix_apartments_search', 'search', postgresql_using='gin'),
+        # Триграммы для автодополнения (services/autocomplete.py)
+        Index(
+            'ix_apartments_address_trgm', 'address',
+            postgresql_using='gin', postgresql_ops={'address': 'gin_trgm_ops'}
+        ),
+        Index(
+            'ix_apartments_title_trgm', 'title',
+            postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}
+        ),
+        # Гео-поиск с фильтрами rooms/area одним проходом по GiST (rooms и area - через btree_gist)
+        Index('ix_apartments_location_rooms_area', 'location', 'rooms', 'area', postgresql_using='gist'),
+        # Фильтры и keyset сортировки sort=rooms/area без точки; строки без значения в индекс не попадают
+        Index('ix_apartments_rooms_id', 'rooms', 'id', postgresql_where=text('rooms IS NOT NULL')),
+        Index('ix_apartments_area_id', 'area', 'id', postgresql_where=text('area IS NOT NULL')),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     title = Column(String, index=True)
@@ -43,8 +74,12 @@ class Apartment(Base):
     area = Column(Integer)
     latitude = Column(Float)
     longitude = Column(Float)
-    location = Column(Geometry("POINT", srid=4326))
+    # geography: ST_DWithin/<-> работают в метрах; GiST индекс idx_apartments_location создает geoalchemy2.
+    # deferred: в ответы точка не попадает, поэтому по умолчанию не выбирается
+    location = deferred(Column(Geography("POINT", srid=4326)))
     publisher_email = Column(String)
+    # Полнотекстовый поиск (q= в GET /apartments); считается базой, в ответы не попадает
+    search = deferred(Column(TSVECTOR, Computed(search_vector(('title', 'A'), ('address', 'B')), persisted=True)))
 
     image1 = Column(Text)
     image2 = Column(Text)
@@ -53,33 +88,79 @@ class Apartment(Base):
     image5 = Column(Text)
     image6 = Column(Text)
 
+    # Версия записи для ETag: увеличивается при каждом изменении (см. *_service.update_*)
+    version = Column(Integer, nullable=False, default=1, server_default=text('1'))
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
 
-class Reservation(Base):
+class Reservation(async_base.BASE):
     __tablename__ = 'reservation'
+    __table_args__ = (
+        # Поиск пересекающихся броней по квартире (фильтр свободных квартир, календарь)
+        Index('ix_reservation_apartment_dates', 'apartment_id', 'arrival_date', 'departure_date'),
+        # Двойное бронирование запрещено на уровне базы; GiST индекс ограничения обслуживает и запросы по &&
+        ExcludeConstraint(
+            ('apartment_id', '='), ('stay', '&&'),
+            name='reservation_no_overlap', using='gist'
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String)
     arrival_date = Column(Date)
     departure_date = Column(Date)
     apartment_id = Column(Integer)
+    # [arrival_date, departure_date): день выезда свободен для следующего заезда
+    stay = deferred(Column(DATERANGE, Computed("daterange(arrival_date, departure_date, '[)')", persisted=True)))
+    version = Column(Integer, nullable=False, default=1, server_default=text('1'))
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
 
 
-class Review(Base):
+class Review(async_base.BASE):
     __tablename__ = 'review'
+    __table_args__ = (
+        Index('ix_review_search', 'search', postgresql_using='gin'),
+    )
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String)
     description = Column(String)
-    apartment_id = Column(Integer)
+    apartment_id = Column(Integer, index=True)
     user_email = Column(String)
+    search = deferred(Column(TSVECTOR, Computed(search_vector(('title', 'A'), ('description', 'B')), persisted=True)))
+    version = Column(Integer, nullable=False, default=1, server_default=text('1'))
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
 
     def __str__(self):
         return (f"title={self.title}, description={self.description}"
                 f"apartment_id={self.apartment_id}, user_email={self.user_email}")
 
 
-class FavoriteItem(Base):
+class FavoriteItem(async_base.BASE):
     __tablename__ = 'favorite_items'
+    __table_args__ = (
+        # Одна квартира в избранном пользователя один раз; по нему же работает ON CONFLICT DO NOTHING
+        Index('ux_favorite_items_user_apartment', 'user_email', 'apartment_id', unique=True),
+        # Страницы избранного пользователя по id в обе стороны (keyset, sort=recent)
+        Index('ix_favorite_items_user_id', 'user_email', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True, index=True)
-    apartment_id = Column(Integer)
-    user_email = Column(String)
\ No newline at end of file
+    apartment_id = Column(Integer, index=True)
+    user_email = Column(String)
+
+
+class ListingStats(async_base.BASE):
+    '''
+    Счетчики квартиры для карточек и сортировки по популярности. Меняются в той же транзакции,
+    что и отзывы / избранное (services/listing_stats.py); расхождения чинит listing_stats.repair
+    '''
+    __tablename__ = 'listing_stats'
+    __table_args__ = (
+        # ORDER BY popularity DESC, apartment_id DESC идет обратным проходом по индексу
+        Index('ix_listing_stats_popularity', 'popularity', 'apartment_id'),
+    )
+
+    apartment_id = Column(Integer, primary_key=True)
+    review_count = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    favorite_count = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    popularity = Column(Integer, Computed('review_count + favorite_count', persisted=True))
@@ -0,0 +1,11 @@
+from .geocoder import Coordinates, Geocoder, NominatimGeocoder, normalize_city_name
+from .cache import CachingGeocoder, LRUCache, SQLiteGeocodeCache
+from .gazetteer import GazetteerGeocoder, GazetteerIndex, build_index
+from .initializer import Geocoder_Initializer, GEOCODER_INITIALIZER, geocode_city
+
+__all__ = [
+    Coordinates, Geocoder, NominatimGeocoder, normalize_city_name,
+    CachingGeocoder, LRUCache, SQLiteGeocodeCache,
+    GazetteerGeocoder, GazetteerIndex, build_index,
+    Geocoder_Initializer, GEOCODER_INITIALIZER, geocode_city
+]
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import typing
+
+from app.cache import LRUCache, MISSING as _MISSING
+from app.geocoding.geocoder import Coordinates, Geocoder, normalize_city_name
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteGeocodeCache():
+    '''
+    Дисковый кэш геокодирования. Строка с lat = NULL - отрицательный результат
+    '''
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode_cache ("
+                "key TEXT PRIMARY KEY, lat REAL, lng REAL, expires_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT lat, lng, expires_at FROM geocode_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[2] <= time.time():
+            return _MISSING, 0
+        value = Coordinates(row[0], row[1]) if row[0] is not None else None
+        return value, row[2] - time.time()
+
+    def set(self, key: str, value: typing.Optional[Coordinates], ttl: float) -> None:
+        lat, lng = value if value is not None else (None, None)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode_cache (key, lat, lng, expires_at) VALUES (?, ?, ?, ?)",
+                (key, lat, lng, time.time() + ttl)
+            )
+
+    def purge_expired(self) -> int:
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM geocode_cache WHERE expires_at <= ?", (time.time(),)
+            ).rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class CachingGeocoder():
+    '''
+    Оборачивает любой Geocoder: LRU -> дисковый кэш -> backend.
+    На один ключ одновременно выполняется не больше одного внешнего запроса
+    '''
+
+    def __init__(
+            self,
+            backend: Geocoder,
+            lru_size: int = 4096,
+            ttl: float = 30 * 24 * 3600,
+            negative_ttl: float = 3600,
+            disk_cache: typing.Optional[SQLiteGeocodeCache] = None
+    ):
+        self.backend = backend
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.disk_cache = disk_cache
+        self._lru = LRUCache(lru_size)
+        self._inflight: typing.Dict[str, asyncio.Task] = {}
+
+    async def geocode(self, city_name: str) -> typing.Optional[Coordinates]:
+        key = normalize_city_name(city_name)
+        if not key:
+            return None
+
+        value = self._lru.get(key)
+        if value is not _MISSING:
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._resolve(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _resolve(self, key: str) -> typing.Optional[Coordinates]:
+        if self.disk_cache is not None:
+            value, ttl_left = await asyncio.to_thread(self.disk_cache.get, key)
+            if value is not _MISSING:
+                self._lru.set(key, value, ttl_left)
+                return value
+
+        try:
+            value = await self.backend.geocode(key)
+        except Exception as e:
+            # Ошибку сети не кэшируем, чтобы следующий запрос попробовал снова
+            logger.warning(f'Geocoding of "{key}" failed: {e!r}')
+            return None
+
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._lru.set(key, value, ttl)
+        if self.disk_cache is not None:
+            await asyncio.to_thread(self.disk_cache.set, key, value, ttl)
+        return value
+
+    async def close(self) -> None:
+        await self.backend.close()
+        if self.disk_cache is not None:
+            self.disk_cache.close()
@@ -0,0 +1,183 @@
+import bisect
+import csv
+import logging
+import mmap
+import os
+import struct
+import sys
+import typing
+
+from app.geocoding.geocoder import Coordinates, normalize_city_name
+
+logger = logging.getLogger(__name__)
+
+# Формат индекса:
+#   header      - magic, количество ключей
+#   offsets     - uint32[count + 1], смещения ключей в blob
+#   coords      - float32[count * 2], lat/lng
+#   population  - uint32[count], для ранжирования при поиске по префиксу
+#   blob        - отсортированные ключи в UTF-8
+_MAGIC = b'GZT1'
+_HEADER = struct.Struct('<4sI')
+
+# Колонки GeoNames dump (geonames.org/export/dump, readme.txt)
+_NAME, _ASCIINAME, _LATITUDE, _LONGITUDE, _FEATURE_CLASS, _POPULATION = 1, 2, 4, 5, 6, 14
+
+
+def _read_geonames_tsv(tsv_path: str) -> typing.Dict[bytes, typing.Tuple[float, float, int]]:
+    '''
+    Читает GeoNames-style TSV, оставляет только населенные пункты (feature class P).
+    При совпадении ключей побеждает город с большим населением
+    '''
+    entries: typing.Dict[bytes, typing.Tuple[float, float, int]] = {}
+    csv.field_size_limit(sys.maxsize)
+
+    with open(tsv_path, encoding='utf-8', newline='') as f:
+        for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            if len(row) <= _POPULATION or row[_FEATURE_CLASS] not in ('P', ''):
+                continue
+            try:
+                lat, lng = float(row[_LATITUDE]), float(row[_LONGITUDE])
+                population = int(row[_POPULATION] or 0)
+            except ValueError:
+                continue
+
+            for name in (row[_NAME], row[_ASCIINAME]):
+                key = normalize_city_name(name).encode('utf-8')
+                if not key:
+                    continue
+                current = entries.get(key)
+                if current is None or current[2] < population:
+                    entries[key] = (lat, lng, population)
+
+    return entries
+
+
+def build_index(tsv_path: str, index_path: str) -> int:
+    '''
+    Строит бинарный индекс из TSV. Возвращает количество ключей
+    '''
+    entries = _read_geonames_tsv(tsv_path)
+    keys = sorted(entries)
+
+    offsets = [0]
+    for key in keys:
+        offsets.append(offsets[-1] + len(key))
+
+    tmp_path = f'{index_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, len(keys)))
+        f.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        coords = []
+        for key in keys:
+            coords.extend(entries[key][:2])
+        f.write(struct.pack(f'<{len(coords)}f', *coords))
+        f.write(struct.pack(f'<{len(keys)}I', *(min(entries[key][2], 0xFFFFFFFF) for key in keys)))
+        for key in keys:
+            f.write(key)
+    os.replace(tmp_path, index_path)
+
+    return len(keys)
+
+
+class GazetteerIndex():
+    '''
+    Отсортированный memory-mapped индекс названий городов.
+    Точный и префиксный поиск - бинарный поиск по ключам, без загрузки файла в память
+    '''
+
+    def __init__(self, index_path: str):
+        self._file = open(index_path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC:
+            raise ValueError(f'{index_path} is not a gazetteer index')
+
+        view = memoryview(self._mmap)
+        position = _HEADER.size
+        self._offsets = view[position:position + 4 * (count + 1)].cast('I')
+        position += 4 * (count + 1)
+        self._coords = view[position:position + 8 * count].cast('f')
+        position += 8 * count
+        self._population = view[position:position + 4 * count].cast('I')
+        position += 4 * count
+        self._blob_start = position
+        self._count = count
+
+    @classmethod
+    def open(cls, tsv_path: str, index_path: typing.Optional[str] = None) -> 'GazetteerIndex':
+        '''
+        Открывает индекс, при необходимости (нет файла или TSV новее) пересобирает его
+        '''
+        index_path = index_path or f'{tsv_path}.idx'
+        if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(tsv_path):
+            logger.info(f'Building gazetteer index {index_path} from {tsv_path}')
+            count = build_index(tsv_path, index_path)
+            logger.info(f'Gazetteer index built: {count} names')
+        return cls(index_path)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _key(self, i: int) -> bytes:
+        start = self._blob_start + self._offsets[i]
+        end = self._blob_start + self._offsets[i + 1]
+        return self._mmap[start:end]
+
+    def _coordinates(self, i: int) -> Coordinates:
+        return Coordinates(self._coords[2 * i], self._coords[2 * i + 1])
+
+    def _bisect(self, key: bytes) -> int:
+        return bisect.bisect_left(range(self._count), key, key=self._key)
+
+    def lookup(self, city_name: str) -> typing.Optional[Coordinates]:
+        key = normalize_city_name(city_name).encode('utf-8')
+        if not key:
+            return None
+        i = self._bisect(key)
+        if i < self._count and self._key(i) == key:
+            return self._coordinates(i)
+        return None
+
+    def prefix(
+            self, prefix: str, limit: int = 10, max_scan: int = 10000
+    ) -> typing.List[typing.Tuple[str, Coordinates]]:
+        '''
+        Возвращает до limit городов с данным префиксом, самые населенные первыми.
+        Просматривается не больше max_scan ключей, чтобы короткий префикс не обходил весь индекс
+        '''
+        key = normalize_city_name(prefix).encode('utf-8')
+        if not key:
+            return []
+
+        matches = []
+        i = self._bisect(key)
+        while i < self._count and len(matches) < max_scan and self._key(i).startswith(key):
+            matches.append(i)
+            i += 1
+        matches.sort(key=lambda j: self._population[j], reverse=True)
+
+        return [(self._key(j).decode('utf-8'), self._coordinates(j)) for j in matches[:limit]]
+
+    def close(self) -> None:
+        self._offsets.release()
+        self._coords.release()
+        self._population.release()
+        self._mmap.close()
+        self._file.close()
+
+
+class GazetteerGeocoder():
+    '''
+    Offline backend геокодера: ищет город в локальном индексе без сетевых запросов
+    '''
+
+    def __init__(self, index: GazetteerIndex):
+        self.index = index
+
+    async def geocode(self, city_name: str) -> typing.Optional[Coordinates]:
+        return self.index.lookup(city_name)
+
+    async def close(self) -> None:
+        self.index.close()
@@ -0,0 +1,59 @@
+import logging
+import typing
+import unicodedata
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class Coordinates(typing.NamedTuple):
+    lat: float
+    lng: float
+
+
+class Geocoder(typing.Protocol):
+    async def geocode(self, city_name: str) -> typing.Optional[Coordinates]:
+        ...
+
+    async def close(self) -> None:
+        ...
+
+
+def normalize_city_name(city_name: str) -> str:
+    '''
+    Приводит название города к ключу кэша: NFKC, casefold, схлопнутые пробелы
+    '''
+    name = unicodedata.normalize("NFKC", city_name or "")
+    return " ".join(name.casefold().split())
+
+
+class NominatimGeocoder():
+    '''
+    Неблокирующий клиент Nominatim
+    '''
+
+    def __init__(self, base_url: str, timeout: float = 10, user_agent: str = "apartment-service"):
+        self.base_url = base_url
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            headers={"User-Agent": user_agent}
+        )
+
+    async def geocode(self, city_name: str) -> typing.Optional[Coordinates]:
+        params = {
+            "q": city_name,
+            "format": "json",
+            "limit": 1,
+        }
+
+        response = await self.client.get(self.base_url, params=params)
+        response.raise_for_status()
+        data = response.json()
+
+        if data and len(data) > 0:
+            return Coordinates(float(data[0]["lat"]), float(data[0]["lon"]))
+        return None
+
+    async def close(self) -> None:
+        await self.client.aclose()
@@ -0,0 +1,48 @@
+import typing
+
+from app import config
+from app.geocoding.cache import CachingGeocoder, SQLiteGeocodeCache
+from app.geocoding.gazetteer import GazetteerGeocoder, GazetteerIndex
+from app.geocoding.geocoder import Coordinates, Geocoder, NominatimGeocoder
+
+
+class Geocoder_Initializer():
+    def __init__(self):
+        self.geocoder: typing.Optional[Geocoder] = None
+
+    def init_geocoder(self, cfg: config.Config, backend: typing.Optional[Geocoder] = None):
+        if backend is None:
+            backend = self.create_backend(cfg)
+
+        disk_cache = None
+        # Gazetteer сам по себе локальный, дисковый кэш ему не нужен
+        if cfg.GEOCODER_CACHE_PATH and not isinstance(backend, GazetteerGeocoder):
+            disk_cache = SQLiteGeocodeCache(cfg.GEOCODER_CACHE_PATH)
+
+        self.geocoder = CachingGeocoder(
+            backend,
+            lru_size=cfg.GEOCODER_LRU_SIZE,
+            ttl=cfg.GEOCODER_CACHE_TTL,
+            negative_ttl=cfg.GEOCODER_NEGATIVE_TTL,
+            disk_cache=disk_cache
+        )
+
+    @staticmethod
+    def create_backend(cfg: config.Config) -> Geocoder:
+        if cfg.GEOCODER_BACKEND == 'gazetteer':
+            return GazetteerGeocoder(GazetteerIndex.open(cfg.GEOCODER_GAZETTEER_PATH))
+        if cfg.GEOCODER_BACKEND == 'nominatim':
+            return NominatimGeocoder(cfg.GEOCODER_URL, timeout=cfg.GEOCODER_TIMEOUT)
+        raise ValueError(f'Unknown geocoder backend: {cfg.GEOCODER_BACKEND}')
+
+    async def close(self):
+        if self.geocoder is not None:
+            await self.geocoder.close()
+            self.geocoder = None
+
+
+GEOCODER_INITIALIZER = Geocoder_Initializer()
+
+
+async def geocode_city(city_name: str) -> typing.Optional[Coordinates]:
+    return await GEOCODER_INITIALIZER.geocoder.geocode(city_name)
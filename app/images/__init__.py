@@ -0,0 +1,13 @@
+from .store import Blob, BlobStore, LocalBlobStore, S3BlobStore, KEY_RE, content_type, derivative_url, \
+    original_keys
+from .derivatives import DerivativePipeline, render_derivative
+from .ingest import IMAGE_FIELDS, decode_inline_image, externalize_image, externalize_images, is_external
+from .initializer import Image_Store_Initializer, IMAGE_STORE_INITIALIZER, externalize_apartment_images, \
+    schedule_derivatives
+
+__all__ = [
+    Blob, BlobStore, LocalBlobStore, S3BlobStore, KEY_RE, content_type, derivative_url, original_keys,
+    DerivativePipeline, render_derivative,
+    IMAGE_FIELDS, decode_inline_image, externalize_image, externalize_images, is_external,
+    Image_Store_Initializer, IMAGE_STORE_INITIALIZER, externalize_apartment_images, schedule_derivatives
+]
@@ -0,0 +1,65 @@
+'''
+Досчитывает превью для картинок всех квартир. Готовые превью пропускаются,
+поэтому прерванный запуск можно просто повторить.
+
+    python -m app.images.backfill --workers 4
+'''
+import argparse
+import asyncio
+import logging
+import time
+
+from sqlalchemy import select
+
+from app import config
+from app.database import async_base, models
+from app.images.derivatives import DerivativePipeline
+from app.images.ingest import IMAGE_FIELDS
+from app.images.initializer import IMAGE_STORE_INITIALIZER
+
+logger = logging.getLogger(__name__)
+
+
+async def backfill(workers: int):
+    cfg = config.load_config()
+    await async_base.DB_INITIALIZER.init_db(str(cfg.POSTGRES_DSN_ASYNC), cfg)
+    IMAGE_STORE_INITIALIZER.init_store(cfg)
+    pipeline = DerivativePipeline(
+        IMAGE_STORE_INITIALIZER.store,
+        {'thumb': cfg.IMAGE_THUMB_SIZE, 'medium': cfg.IMAGE_MEDIUM_SIZE},
+        workers
+    )
+    pipeline.start()
+
+    started = time.perf_counter()
+    last_id = 0
+    try:
+        while True:
+            async with async_base.DB_INITIALIZER.async_session_maker() as session:
+                query = select(models.Apartment.id, *(getattr(models.Apartment, field) for field in IMAGE_FIELDS)) \
+                    .filter(models.Apartment.id > last_id) \
+                    .order_by(models.Apartment.id) \
+                    .limit(500)
+                rows = (await session.execute(query)).all()
+            if not rows:
+                break
+            for row in rows:
+                pipeline.enqueue(row[1:])
+            last_id = rows[-1].id
+            await pipeline.join()
+    finally:
+        await pipeline.stop()
+        await IMAGE_STORE_INITIALIZER.close()
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f'Derivatives done: {pipeline.processed} rendered, {pipeline.skipped} up to date, {pipeline.failed} failed, '
+        f'{pipeline.processed / elapsed if elapsed else 0:.1f} images/s wall clock'
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(backfill(args.workers))
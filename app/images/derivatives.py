@@ -0,0 +1,114 @@
+'''
+Превью картинок квартир (thumb, medium). Рендеринг идет в пуле процессов вне обработки запроса,
+результат кладется в то же хранилище рядом с оригиналом под ключом <sha256>_<размер>.jpg.
+Уже существующие превью не пересчитываются, поэтому обработку можно безопасно перезапускать
+'''
+import asyncio
+import concurrent.futures
+import io
+import logging
+import time
+import typing
+
+from PIL import Image, ImageOps
+
+from app.images.store import BlobStore, derivative_key, original_key
+
+logger = logging.getLogger(__name__)
+
+def render_derivative(data: bytes, max_side: int, quality: int = 82) -> bytes:
+    '''
+    Уменьшает картинку до max_side по большей стороне и кодирует в JPEG. Выполняется в дочернем процессе
+    '''
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+        return output.getvalue()
+
+
+class DerivativePipeline():
+    '''
+    Очередь оригиналов и asyncio-воркеры, отдающие рендеринг в ProcessPoolExecutor
+    '''
+
+    def __init__(self, store: BlobStore, sizes: typing.Dict[str, int], workers: int):
+        self.store = store
+        self.sizes = sizes
+        self.workers = workers
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+        self._render_time = 0.0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._executor: typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._tasks: typing.List[asyncio.Task] = []
+
+    def start(self):
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def enqueue(self, urls: typing.Iterable[typing.Optional[str]]):
+        for url in urls:
+            key = original_key(url)
+            if key is not None:
+                self._queue.put_nowait(key)
+
+    async def join(self):
+        await self._queue.join()
+
+    @property
+    def images_per_second(self) -> float:
+        '''
+        Пропускная способность пула: воркеры * картинок на секунду работы одного воркера
+        '''
+        return self.workers * self.processed / self._render_time if self._render_time else 0.0
+
+    async def _worker(self):
+        while True:
+            key = await self._queue.get()
+            try:
+                await self.process(key)
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f'Derivatives for {key} failed: {e!r}')
+            finally:
+                self._queue.task_done()
+
+    async def process(self, key: str):
+        missing = {
+            size: max_side for size, max_side in self.sizes.items()
+            if not await self.store.exists(derivative_key(key, size))
+        }
+        if not missing:
+            self.skipped += 1
+            return
+
+        blob = await self.store.get(key)
+        if blob is None:
+            self.skipped += 1
+            return
+
+        started = time.perf_counter()
+        data = b''.join([chunk async for chunk in blob.chunks])
+        loop = asyncio.get_running_loop()
+        for size, max_side in missing.items():
+            rendered = await loop.run_in_executor(self._executor, render_derivative, data, max_side)
+            await self.store.put(rendered, derivative_key(key, size))
+
+        self.processed += 1
+        self._render_time += time.perf_counter() - started
+        if self.processed % 100 == 0:
+            logger.info(f'Derivatives: {self.processed} images, {self.images_per_second:.1f} images/s')
@@ -0,0 +1,55 @@
+import base64
+import binascii
+import re
+import typing
+
+from app.images.store import BlobStore, sniff_extension
+
+IMAGE_FIELDS = ('image1', 'image2', 'image3', 'image4', 'image5', 'image6')
+
+_DATA_URL_RE = re.compile(r'^data:[^,]*?;base64,', re.IGNORECASE)
+
+
+def is_external(value: str, url_prefix: str) -> bool:
+    return value.startswith(url_prefix) or value.startswith(('http://', 'https://'))
+
+
+def decode_inline_image(value: str) -> typing.Optional[bytes]:
+    '''
+    Декодирует data URL или голый base64. None - значение не похоже на встроенную картинку.
+    Голый base64 принимается, только если внутри известный формат изображения
+    '''
+    match = _DATA_URL_RE.match(value)
+    payload = value[match.end():] if match else value
+    try:
+        data = base64.b64decode(''.join(payload.split()), validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if match is None and sniff_extension(data) == 'bin':
+        return None
+    return data
+
+
+async def externalize_image(
+        store: BlobStore, value: typing.Optional[str], url_prefix: str
+) -> typing.Optional[str]:
+    '''
+    Переносит встроенную картинку в хранилище и возвращает ее URL. URL и пустые значения не трогает
+    '''
+    if not value or is_external(value, url_prefix):
+        return value
+    data = decode_inline_image(value)
+    if not data:
+        return value
+    key = await store.put(data)
+    return f'{url_prefix}/{key}'
+
+
+async def externalize_images(store: BlobStore, images: typing.Dict[str, typing.Optional[str]], url_prefix: str):
+    '''
+    Возвращает новый словарь image1..image6, в котором встроенные картинки заменены на URL
+    '''
+    return {
+        field: await externalize_image(store, images.get(field), url_prefix)
+        for field in IMAGE_FIELDS
+    }
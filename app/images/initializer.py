@@ -0,0 +1,75 @@
+import typing
+
+from app import config
+from app.images.ingest import IMAGE_FIELDS, externalize_images
+from app.images.derivatives import DerivativePipeline
+from app.images.store import BlobStore, LocalBlobStore, S3BlobStore
+
+
+class Image_Store_Initializer():
+    def __init__(self):
+        self.store: typing.Optional[BlobStore] = None
+        self.url_prefix: str = '/images'
+        self.pipeline: typing.Optional[DerivativePipeline] = None
+
+    def init_store(self, cfg: config.Config, store: typing.Optional[BlobStore] = None):
+        self.url_prefix = cfg.IMAGE_URL_PREFIX.rstrip('/')
+        self.store = store or self.create_store(cfg)
+
+    def start_pipeline(self, cfg: config.Config):
+        '''
+        Запускает фоновый расчет превью; вызывается из работающего event loop
+        '''
+        if cfg.IMAGE_DERIVATIVE_WORKERS <= 0:
+            return
+        self.pipeline = DerivativePipeline(
+            self.store,
+            {'thumb': cfg.IMAGE_THUMB_SIZE, 'medium': cfg.IMAGE_MEDIUM_SIZE},
+            cfg.IMAGE_DERIVATIVE_WORKERS
+        )
+        self.pipeline.start()
+
+    @staticmethod
+    def create_store(cfg: config.Config) -> BlobStore:
+        if cfg.IMAGE_STORE == 'local':
+            return LocalBlobStore(cfg.IMAGE_STORE_PATH)
+        if cfg.IMAGE_STORE == 's3':
+            return S3BlobStore(
+                cfg.IMAGE_S3_BUCKET,
+                endpoint_url=cfg.IMAGE_S3_ENDPOINT_URL or None,
+                region=cfg.IMAGE_S3_REGION or None,
+                access_key=cfg.IMAGE_S3_ACCESS_KEY or None,
+                secret_key=cfg.IMAGE_S3_SECRET_KEY.get_secret_value() or None
+            )
+        raise ValueError(f'Unknown image store: {cfg.IMAGE_STORE}')
+
+    async def close(self):
+        if self.pipeline is not None:
+            await self.pipeline.stop()
+            self.pipeline = None
+        if self.store is not None:
+            await self.store.close()
+            self.store = None
+
+
+IMAGE_STORE_INITIALIZER = Image_Store_Initializer()
+
+
+async def externalize_apartment_images(apartment):
+    '''
+    Возвращает копию pydantic модели квартиры, где image1..image6 содержат только URL
+    '''
+    images = await externalize_images(
+        IMAGE_STORE_INITIALIZER.store,
+        {field: getattr(apartment, field) for field in IMAGE_FIELDS},
+        IMAGE_STORE_INITIALIZER.url_prefix
+    )
+    return apartment.model_copy(update=images)
+
+
+def schedule_derivatives(apartment):
+    '''
+    Ставит картинки квартиры в очередь на расчет превью, не дожидаясь результата
+    '''
+    if IMAGE_STORE_INITIALIZER.pipeline is not None:
+        IMAGE_STORE_INITIALIZER.pipeline.enqueue(getattr(apartment, field) for field in IMAGE_FIELDS)
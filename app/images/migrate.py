@@ -0,0 +1,85 @@
+'''
+Переносит встроенные (base64 / data URL) картинки квартир в хранилище блобов пачками.
+Повторный запуск безопасен: уже перенесенные значения являются URL и пропускаются.
+После каждой пачки сбрасываются закэшированные ответы с ее квартирами: через общий уровень кэша
+(RESPONSE_CACHE_REDIS_URL), локальные записи воркеров истекают сами за RESPONSE_CACHE_LOCAL_TTL.
+
+    python -m app.images.migrate --batch-size 100
+'''
+import argparse
+import asyncio
+import logging
+
+from sqlalchemy import and_, or_, select, update
+
+from app import config
+from app.database import async_base, models
+from app.images.ingest import IMAGE_FIELDS, externalize_images
+from app.images.initializer import IMAGE_STORE_INITIALIZER
+from app.services import apartment_service
+from app.services.response_cache import RESPONSE_CACHE_INITIALIZER
+
+logger = logging.getLogger(__name__)
+
+
+def _inline_image_filter(url_prefix: str):
+    columns = [getattr(models.Apartment, field) for field in IMAGE_FIELDS]
+    return or_(*(
+        and_(
+            column.is_not(None),
+            column != '',
+            column.not_like(f'{url_prefix}/%'),
+            column.not_like('http://%'),
+            column.not_like('https://%'),
+        )
+        for column in columns
+    ))
+
+
+async def migrate(batch_size: int) -> int:
+    url_prefix = IMAGE_STORE_INITIALIZER.url_prefix
+    moved = 0
+    last_id = 0
+
+    while True:
+        async with async_base.DB_INITIALIZER.async_session_maker() as session:
+            query = select(models.Apartment.id, *(getattr(models.Apartment, field) for field in IMAGE_FIELDS)) \
+                .filter(models.Apartment.id > last_id, _inline_image_filter(url_prefix)) \
+                .order_by(models.Apartment.id) \
+                .limit(batch_size)
+            rows = (await session.execute(query)).all()
+            if not rows:
+                return moved
+
+            for row in rows:
+                images = await externalize_images(IMAGE_STORE_INITIALIZER.store, row._asdict(), url_prefix)
+                await session.execute(
+                    update(models.Apartment).where(models.Apartment.id == row.id)
+                    .values(**images, version=models.Apartment.version + 1)
+                )
+            await session.commit()
+            await apartment_service.invalidate_apartments([row.id for row in rows])
+
+            moved += len(rows)
+            last_id = rows[-1].id
+            logger.info(f'Images moved for {moved} apartments (last id {last_id})')
+
+
+async def main(batch_size: int):
+    cfg = config.load_config()
+    await async_base.DB_INITIALIZER.init_db(str(cfg.POSTGRES_DSN_ASYNC), cfg)
+    IMAGE_STORE_INITIALIZER.init_store(cfg)
+    RESPONSE_CACHE_INITIALIZER.init_cache(cfg)
+    try:
+        moved = await migrate(batch_size)
+        logger.info(f'Done, {moved} apartments updated')
+    finally:
+        await IMAGE_STORE_INITIALIZER.close()
+        await RESPONSE_CACHE_INITIALIZER.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size))
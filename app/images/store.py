@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import os
+import re
+import typing
+
+import anyio
+
+CHUNK_SIZE = 64 * 1024
+
+# Ключ блоба: sha256 содержимого + расширение по сигнатуре файла.
+# Производные (превью) лежат рядом с оригиналом: <sha256>_<размер>.jpg
+KEY_RE = re.compile(r'^[0-9a-f]{64}(_(thumb|medium))?\.(jpg|png|gif|webp|bin)$')
+
+CONTENT_TYPES = {
+    'jpg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    'bin': 'application/octet-stream',
+}
+
+
+def sniff_extension(data: bytes) -> str:
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if data.startswith(b'GIF8'):
+        return 'gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return 'bin'
+
+
+def blob_key(data: bytes) -> str:
+    return f'{hashlib.sha256(data).hexdigest()}.{sniff_extension(data)}'
+
+
+def content_type(key: str) -> str:
+    return CONTENT_TYPES[key.rsplit('.', 1)[1]]
+
+
+_ORIGINAL_KEY_RE = re.compile(r'(?P<hash>[0-9a-f]{64})\.(jpg|png|gif|webp)$')
+
+
+def derivative_key(original_key: str, size: str) -> str:
+    return f'{original_key.split(".", 1)[0]}_{size}.jpg'
+
+
+def original_key(url: typing.Optional[str]) -> typing.Optional[str]:
+    '''
+    Ключ оригинала из URL картинки, None для внешних и не-картинок
+    '''
+    if not url:
+        return None
+    match = _ORIGINAL_KEY_RE.search(url)
+    return match.group(0) if match else None
+
+
+def original_keys(key: str) -> typing.List[str]:
+    '''
+    Возможные ключи оригинала для ключа превью (расширение оригинала в ключе превью не сохраняется)
+    '''
+    if '_' not in key:
+        return []
+    digest = key.split('_', 1)[0]
+    return [f'{digest}.{extension}' for extension in ('jpg', 'png', 'webp', 'gif')]
+
+
+def derivative_url(url: typing.Optional[str], size: str) -> typing.Optional[str]:
+    key = original_key(url)
+    if key is None:
+        return None
+    return f'{url[:-len(key)]}{derivative_key(key, size)}'
+
+
+class Blob(typing.NamedTuple):
+    size: int
+    chunks: typing.AsyncIterator[bytes]
+
+
+class BlobStore(typing.Protocol):
+    async def put(self, data: bytes, key: typing.Optional[str] = None) -> str:
+        ...
+
+    async def exists(self, key: str) -> bool:
+        ...
+
+    async def get(self, key: str) -> typing.Optional[Blob]:
+        ...
+
+    async def close(self) -> None:
+        ...
+
+
+class LocalBlobStore():
+    '''
+    Content-addressed хранилище на локальном диске: root/ab/cd/<sha256>.<ext>.
+    Одинаковое содержимое записывается один раз
+    '''
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def _write(self, key: str, data: bytes) -> None:
+        path = self.path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    async def put(self, data: bytes, key: typing.Optional[str] = None) -> str:
+        key = key or await asyncio.to_thread(blob_key, data)
+        await asyncio.to_thread(self._write, key, data)
+        return key
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(os.path.exists, self.path(key))
+
+    async def get(self, key: str) -> typing.Optional[Blob]:
+        path = self.path(key)
+        try:
+            size = (await anyio.Path(path).stat()).st_size
+        except FileNotFoundError:
+            return None
+
+        async def chunks():
+            async with await anyio.open_file(path, 'rb') as f:
+                while chunk := await f.read(CHUNK_SIZE):
+                    yield chunk
+
+        return Blob(size, chunks())
+
+    async def close(self) -> None:
+        pass
+
+
+class S3BlobStore():
+    '''
+    Content-addressed хранилище в S3-совместимом бакете. Требует пакет aiobotocore
+    '''
+
+    def __init__(
+            self, bucket: str, endpoint_url: typing.Optional[str] = None, region: typing.Optional[str] = None,
+            access_key: typing.Optional[str] = None, secret_key: typing.Optional[str] = None
+    ):
+        try:
+            from aiobotocore.session import get_session
+        except ImportError as e:
+            raise RuntimeError('IMAGE_STORE=s3 requires the aiobotocore package') from e
+
+        self.bucket = bucket
+        self._client_context = get_session().create_client(
+            's3', endpoint_url=endpoint_url, region_name=region,
+            aws_access_key_id=access_key, aws_secret_access_key=secret_key
+        )
+        self._client = None
+
+    async def _get_client(self):
+        if self._client is None:
+            self._client = await self._client_context.__aenter__()
+        return self._client
+
+    async def put(self, data: bytes, key: typing.Optional[str] = None) -> str:
+        key = key or await asyncio.to_thread(blob_key, data)
+        if not await self.exists(key):
+            client = await self._get_client()
+            await client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type(key))
+        return key
+
+    async def exists(self, key: str) -> bool:
+        client = await self._get_client()
+        try:
+            await client.head_object(Bucket=self.bucket, Key=key)
+        except client.exceptions.ClientError:
+            return False
+        return True
+
+    async def get(self, key: str) -> typing.Optional[Blob]:
+        client = await self._get_client()
+        try:
+            response = await client.get_object(Bucket=self.bucket, Key=key)
+        except client.exceptions.NoSuchKey:
+            return None
+
+        async def chunks():
+            async with response['Body'] as body:
+                while chunk := await body.read(CHUNK_SIZE):
+                    yield chunk
+
+        return Blob(response['ContentLength'], chunks())
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client_context.__aexit__(None, None, None)
+            self._client = None
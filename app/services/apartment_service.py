@@ -1,121 +1,524 @@
-from app.api.schemas import ApartmentsQuery, ApartmentCreate, ApartmentUpdate
-from sqlalchemy.orm import Session
-from app.database import models
-from sqlalchemy import func
-from geoalchemy2 import Geometry
-from sqlalchemy import text
+import math
+from typing import List, Optional
 
-import requests
+from fastapi import HTTPException
 
+from app.api.schemas import ApartmentsQuery, ApartmentCreate, ApartmentUpdate, CountMode
+from app.api import schemas
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import models
+from sqlalchemy import Float, cast, exists, func, literal_column, select, delete, tuple_, union
+from geoalchemy2 import Geography
+
+from app import geocoding, images
+from app import config
+from app.services import counting, listing_stats, pagination, reservation_service
+from app.services.response_cache import RESPONSE_CACHE_INITIALIZER
+from app.services.availability_index import AVAILABILITY_INDEX
+from app.services.occupancy import OCCUPANCY_INDEX
+
+cfg: config.Config = config.load_config()
+
+# Ячейки гео-сетки (градусы) для тегов кэша ответов; круг больше MAX_CACHE_CELLS ячеек помечается ALL_APARTMENTS_TAG
+CACHE_CELL = 0.1
+MAX_CACHE_CELLS = 64
+ALL_APARTMENTS_TAG = 'apartments:all'
+# Выдачи с q=: ищут и по тексту отзывов, сбрасываются при записи отзыва
+SEARCH_TAG = 'apartments:search'
+# Сортировки по колонке: имя -> (колонка, по убыванию); keyset по индексам ix_apartments_<колонка>_id
+COLUMN_SORTS = {'rooms': ('rooms', False), '-rooms': ('rooms', True), 'area': ('area', False), '-area': ('area', True)}
+# None - по расстоянию (если задана точка) или по id
+SORTS = (None, 'popularity', *COLUMN_SORTS)
+METERS_PER_DEGREE = 111320
+
+
+# Геокодирование города через кэширующий геокодер (см. app.geocoding)
+async def geocode_city(city_name):
+    return await geocoding.geocode_city(city_name)
+
+
+# Поля, которые можно запросить через fields=, и готовые наборы полей
+APARTMENT_COLUMNS = (
+    'id', 'title', 'address', 'rooms', 'area', 'latitude', 'longitude', 'publisher_email', *images.IMAGE_FIELDS,
+    'version', 'updated_at'
+)
+# Выбираются всегда: по ним строятся ETag и Last-Modified
+META_FIELDS = ('id', 'version', 'updated_at')
+DERIVED_FIELDS = {'thumbnails': 'thumb', 'medium_images': 'medium'}
+FIELD_PRESETS = {
+    'summary': ('id', 'title', 'address', 'rooms', 'area', 'latitude', 'longitude', 'thumbnails'),
+}
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    '''
+    Разбирает fields= ("title,rooms", "summary"). None - нужна квартира целиком
+    '''
+    if not fields:
+        return None
 
-# Функция для геокодирования города через Nominatim
-def geocode_city(city_name):
-    base_url = "https://nominatim.openstreetmap.org/search"
+    names = []
+    for name in fields.split(','):
+        name = name.strip()
+        names.extend(FIELD_PRESETS.get(name, (name,)))
+
+    unknown = [name for name in names if name not in APARTMENT_COLUMNS and name not in DERIVED_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys([*META_FIELDS, *names]))
+
+
+def _projection(fields: List[str]) -> list:
+    columns = [name for name in fields if name in APARTMENT_COLUMNS]
+    if any(name in DERIVED_FIELDS for name in fields):
+        columns.extend(field for field in images.IMAGE_FIELDS if field not in columns)
+    return [getattr(models.Apartment, name) for name in columns]
+
+
+def _project_row(row, fields: List[str]) -> dict:
+    '''
+    Собирает ответ из выбранных колонок без валидации pydantic моделью
+    '''
+    item = {}
+    for name in fields:
+        if name in DERIVED_FIELDS:
+            item[name] = [images.derivative_url(row[field], DERIVED_FIELDS[name]) for field in images.IMAGE_FIELDS]
+        elif name == 'updated_at':
+            item[name] = row[name].isoformat() if row[name] is not None else None
+        else:
+            item[name] = row[name]
+    return item
+
+
+async def get_apartment(session: AsyncSession, apartment_id: int):
+    query = select(models.Apartment).filter(models.Apartment.id == apartment_id).limit(1)
+    result = await session.execute(query)
+    return result.scalars().one_or_none()
+
+
+async def get_apartment_fields(session: AsyncSession, apartment_id: int, fields: List[str]) -> Optional[dict]:
+    query = select(*_projection(fields)).filter(models.Apartment.id == apartment_id).limit(1)
+    row = (await session.execute(query)).mappings().one_or_none()
+    return _project_row(row, fields) if row is not None else None
+
+
+def _row_id(row) -> int:
+    return row.Apartment.id if 'Apartment' in row._fields else row.id
+
+
+def _in_range(column, minimum, maximum) -> list:
+    if minimum is not None and maximum is not None and minimum > maximum:
+        raise HTTPException(status_code=400, detail=f"min_{column.key} must not exceed max_{column.key}")
+    filters = []
+    if minimum is not None:
+        filters.append(column >= minimum)
+    if maximum is not None:
+        filters.append(column <= maximum)
+    return filters
+
+
+def _available_between(arrival_date, departure_date):
+    '''
+    Условие "у квартиры нет брони, пересекающейся с [arrival_date, departure_date)".
+    Подзапрос коррелирован по apartment_id и идет по GiST индексу reservation_no_overlap
+    '''
+    if arrival_date is None or departure_date is None or arrival_date >= departure_date:
+        raise HTTPException(status_code=400, detail="arrival_date must be before departure_date")
+    return ~exists().where(
+        models.Reservation.apartment_id == models.Apartment.id,
+        reservation_service.overlapping_stay(arrival_date, departure_date)
+    )
+
+
+def search_query(q: str):
+    '''
+    tsquery из пользовательской строки: слова через AND, "фраза", -исключение, or
+    '''
+    return func.websearch_to_tsquery(literal_column(f"'{models.SEARCH_CONFIG}'::regconfig"), q)
+
+
+def _matches_text(tsquery):
+    '''
+    Квартиры, у которых совпал текст объявления или отзыва. UNION двух выборок по GIN индексам вместо OR:
+    с OR по двум таблицам Postgres не может использовать индексы и читает все квартиры
+    '''
+    by_apartment = select(models.Apartment.id).filter(models.Apartment.search.op('@@')(tsquery)).correlate(None)
+    by_review = select(models.Review.apartment_id).filter(models.Review.search.op('@@')(tsquery))
+    return models.Apartment.id.in_(union(by_apartment, by_review))
+
+
+def make_point(latitude: float, longitude: float):
+    '''
+    Точка geography (SRID 4326) из координат. Координаты уходят в запрос параметрами
+    '''
+    return cast(func.ST_SetSRID(func.ST_MakePoint(longitude, latitude), 4326), Geography("POINT", srid=4326))
+
+
+async def build_apartments_query(apartments_query: ApartmentsQuery):
+    '''
+    Запросы GET /apartments без выполнения: (fields, запрос для total, запрос страницы, имя сортировки, ключ курсора).
+    total считается по тем же FROM и фильтрам, что и страница (без курсора). По ним же проверяются планы
+    '''
+    if apartments_query.sort not in SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(SORTS[1:])}")
+    fields = parse_fields(apartments_query.fields)
+    entities = [models.Apartment] if fields is None else _projection(fields)
+    filters = []
+    location = None
+
+    if apartments_query.city_name is not None:
+        city_coords = await geocode_city(apartments_query.city_name)
+        if city_coords is not None:
+            location = make_point(city_coords.lat, city_coords.lng)
+    elif apartments_query.latitude is not None and apartments_query.longitude is not None:
+        location = make_point(apartments_query.latitude, apartments_query.longitude)
+
+    if location is not None and apartments_query.radius is not None:
+        filters.append(func.ST_DWithin(models.Apartment.location, location, apartments_query.radius))
+
+    filters.extend(_in_range(models.Apartment.rooms, apartments_query.min_rooms, apartments_query.max_rooms))
+    filters.extend(_in_range(models.Apartment.area, apartments_query.min_area, apartments_query.max_area))
+
+    if apartments_query.arrival_date is not None or apartments_query.departure_date is not None:
+        filters.append(_available_between(apartments_query.arrival_date, apartments_query.departure_date))
+
+    tsquery = None
+    if apartments_query.q is not None and apartments_query.q.strip():
+        tsquery = search_query(apartments_query.q)
+        filters.append(_matches_text(tsquery))
+
+    count_query = select(models.Apartment.id).filter(*filters)
+    if apartments_query.sort == 'popularity':
+        # Обратный проход по ix_listing_stats_popularity; квартиры без строки listing_stats не попадают (см. repair)
+        stats = models.ListingStats
+        query = select(*entities, stats.popularity.label('popularity')) \
+            .join(stats, stats.apartment_id == models.Apartment.id) \
+            .filter(*filters) \
+            .order_by(stats.popularity.desc(), stats.apartment_id.desc())
+        count_query = count_query.join(stats, stats.apartment_id == models.Apartment.id)
+        sort, key = 'popularity', lambda row: (row.popularity, _row_id(row))
+        if apartments_query.cursor is not None:
+            last_popularity, last_id = pagination.decode_cursor(apartments_query.cursor, sort, (int, int))
+            query = query.filter(tuple_(stats.popularity, stats.apartment_id) < tuple_(last_popularity, last_id))
+    elif apartments_query.sort in COLUMN_SORTS:
+        # Квартиры без значения колонки не попадают: NULL не участвует в keyset сравнении
+        name, descending = COLUMN_SORTS[apartments_query.sort]
+        column = getattr(models.Apartment, name)
+        order = (column.desc(), models.Apartment.id.desc()) if descending else (column, models.Apartment.id)
+        query = select(*entities, column.label('sort_value')) \
+            .filter(*filters, column.isnot(None)) \
+            .order_by(*order)
+        count_query = count_query.filter(column.isnot(None))
+        sort, key = apartments_query.sort, lambda row: (row.sort_value, _row_id(row))
+        if apartments_query.cursor is not None:
+            last_value, last_id = pagination.decode_cursor(apartments_query.cursor, sort, (int, int))
+            after = tuple_(column, models.Apartment.id)
+            query = query.filter(after < tuple_(last_value, last_id) if descending else after > tuple_(last_value, last_id))
+    elif tsquery is not None:
+        # Сначала совпадения в заголовке (вес A), потом в адресе; найденные только по отзывам - в конце
+        rank = func.ts_rank(models.Apartment.search, tsquery).label('rank')
+        query = select(*entities, rank) \
+            .filter(*filters) \
+            .order_by(rank.desc(), models.Apartment.id.desc())
+        sort, key = 'rank', lambda row: (row.rank, _row_id(row))
+        if apartments_query.cursor is not None:
+            last_rank, last_id = pagination.decode_cursor(apartments_query.cursor, sort, (float, int))
+            query = query.filter(tuple_(rank, models.Apartment.id) < tuple_(last_rank, last_id))
+    elif location is not None:
+        # KNN сортировка по GiST индексу; без radius возвращаются просто ближайшие limit квартир
+        distance = models.Apartment.location.op('<->', return_type=Float)(location)
+        query = select(*entities, distance.label('distance')) \
+            .filter(*filters) \
+            .order_by(distance, models.Apartment.id)
+        sort, key = 'distance', lambda row: (row.distance, _row_id(row))
+        if apartments_query.cursor is not None:
+            last_distance, last_id = pagination.decode_cursor(apartments_query.cursor, sort, (float, int))
+            query = query.filter(tuple_(distance, models.Apartment.id) > tuple_(last_distance, last_id))
+    else:
+        query = select(*entities).filter(*filters).order_by(models.Apartment.id)
+        sort, key = 'id', lambda row: (_row_id(row),)
+        if apartments_query.cursor is not None:
+            last_id, = pagination.decode_cursor(apartments_query.cursor, sort, (int,))
+            query = query.filter(models.Apartment.id > last_id)
+
+    if apartments_query.cursor is None:
+        query = query.offset(apartments_query.offset)
+    query = query.limit(apartments_query.limit + 1)
+    return fields, count_query, query, sort, key
+
+
+async def get_apartments(session: AsyncSession, apartments_query: ApartmentsQuery):
+    fields, count_query, query, sort, key = await build_apartments_query(apartments_query)
+    total_items, total_mode = await counting.count_rows(
+        session,
+        count_query,
+        counting.resolve_count_mode(apartments_query.count, apartments_query.cursor)
+    )
+
+    result = await session.execute(query)
+    rows, next_cursor = pagination.keyset_page(result.all(), apartments_query.limit, sort, key)
+    if fields is None:
+        apartments = [row.Apartment for row in rows]
+    else:
+        apartments = [_project_row(row._mapping, fields) for row in rows]
 
-    params = {
-        "q": city_name,
-        "format": "json",
+    return {
+        "items": apartments,
+        "total": total_items,
+        "total_mode": total_mode,
+        "size": len(apartments),
+        "next_cursor": next_cursor,
     }
 
-    response = requests.get(base_url, params=params, timeout=10)
-    data = response.json()
-
-    if data and len(data) > 0:
-        city_coords = {
-            "lat": float(data[0]["lat"]),
-            "lng": float(data[0]["lon"])
-        }
-        return city_coords
-    else:
-        return None
-def get_apartment(db: Session, apartment_id: int):
-    return db.query(models.Apartment) \
-        .filter(models.Apartment.id == apartment_id) \
-        .first()
-
 
-def get_apartments(db: Session, apartments_query: ApartmentsQuery):
+def _apartment_tag(apartment_id: int) -> str:
+    return f'apartment:{apartment_id}'
 
-    query = db.query(models.Apartment)
 
-    if apartments_query.city_name is not None and apartments_query.radius is not None:
-        city_coords = geocode_city(apartments_query.city_name)
-        if city_coords is not None:
-            latitude = city_coords["lat"]
-            longitude = city_coords["lng"]
-            location = func.ST_GeogFromText(f'POINT({latitude} {longitude})', type_=Geometry)
-            query = query.filter(func.ST_DWithin(models.Apartment.location, location, apartments_query.radius))
-            query = query.order_by(func.ST_Distance(models.Apartment.location, location))
+def _cell_tag(latitude: float, longitude: float) -> str:
+    return f'cell:{math.floor(latitude / CACHE_CELL)}:{math.floor(longitude / CACHE_CELL)}'
 
 
-    if apartments_query.city_name is None and apartments_query.latitude is not None and apartments_query.longitude \
-            is not None and apartments_query.radius is not None:
-        location = func.ST_GeogFromText(f'POINT({apartments_query.latitude} {apartments_query.longitude})', type_=Geometry)
-        query = query.filter(func.ST_DWithin(models.Apartment.location, location, apartments_query.radius))
-        query = query.order_by(func.ST_Distance(models.Apartment.location, location))
+def _circle_tags(latitude: float, longitude: float, radius: float) -> List[str]:
+    '''
+    Теги ячеек, которые задевает круг поиска: квартира, добавленная или перемещенная в любую из них,
+    может изменить ответ
+    '''
+    dlat = radius / METERS_PER_DEGREE
+    dlng = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    if abs(latitude) + dlat >= 90 or abs(longitude) + dlng >= 180:
+        return [ALL_APARTMENTS_TAG]
 
-    total_items = query.count()
+    rows = range(math.floor((latitude - dlat) / CACHE_CELL), math.floor((latitude + dlat) / CACHE_CELL) + 1)
+    columns = range(math.floor((longitude - dlng) / CACHE_CELL), math.floor((longitude + dlng) / CACHE_CELL) + 1)
+    if len(rows) * len(columns) > MAX_CACHE_CELLS:
+        return [ALL_APARTMENTS_TAG]
+    return [f'cell:{row}:{column}' for row in rows for column in columns]
 
-    query = query.offset(apartments_query.offset).limit(apartments_query.limit)
 
-    apartments = query.all()
+def _snap(value: float, step: float) -> float:
+    return round(round(value / step) * step, 9)
 
-    return {
-        "items": apartments,
-        "total": total_items,
-        "size": len(apartments),
-    }
 
+def _shift_meters(point, snapped) -> float:
+    '''
+    Расстояние между точкой и ее округлением (десятки метров, плоское приближение) с запасом в метр
+    на разницу со сфероидом, по которому считает ST_DWithin
+    '''
+    dlat = (snapped[0] - point[0]) * METERS_PER_DEGREE
+    dlng = (snapped[1] - point[1]) * METERS_PER_DEGREE * math.cos(math.radians(point[0]))
+    return math.hypot(dlat, dlng) + 1.0 if dlat or dlng else 0.0
 
-def get_my_apartments(db: Session, email: str):
 
-    query = db.query(models.Apartment).filter(models.Apartment.publisher_email==email)
+def _snap_up(value: float, step: float) -> float:
+    # round внутри ceil убирает погрешность деления: 1200 / 100 не должно стать 13 шагами
+    return round(math.ceil(round(value / step, 9)) * step, 9)
 
-    total_items = query.count()
 
-    res = query.all()
+async def _normalize_geo_query(apartments_query: ApartmentsQuery) -> ApartmentsQuery:
+    '''
+    Приводит гео-запрос к каноническому виду для ключа кэша: город заменяется координатами,
+    координаты и радиус округляются до шага сетки. Запрос выполняется с округленными значениями,
+    поэтому закэшированный ответ в точности соответствует ключу. Радиус увеличивается на сдвиг центра
+    и округляется вверх: новый круг содержит заданный, и квартиры внутри заданного радиуса не теряются
+    '''
+    latitude, longitude = apartments_query.latitude, apartments_query.longitude
+    if apartments_query.city_name is not None:
+        city_coords = await geocode_city(apartments_query.city_name)
+        latitude, longitude = (city_coords.lat, city_coords.lng) if city_coords is not None else (None, None)
+    shift = 0.0
+    if latitude is None or longitude is None:
+        latitude = longitude = None
+    else:
+        snapped = _snap(latitude, cfg.RESPONSE_CACHE_COORD_STEP), _snap(longitude, cfg.RESPONSE_CACHE_COORD_STEP)
+        shift = _shift_meters((latitude, longitude), snapped)
+        latitude, longitude = snapped
+
+    radius = apartments_query.radius
+    if radius is not None:
+        radius = max(_snap_up(radius + shift, cfg.RESPONSE_CACHE_RADIUS_STEP), cfg.RESPONSE_CACHE_RADIUS_STEP)
+
+    return apartments_query.model_copy(update={
+        "city_name": None, "latitude": latitude, "longitude": longitude, "radius": radius,
+    })
+
+
+def _apartments_payload(apartments: dict, fields: Optional[str]) -> dict:
+    if fields:
+        return apartments
+    return schemas.PaginatedApartmentResponse(**apartments).model_dump(mode='json')
+
+
+async def get_apartments_response(session: AsyncSession, apartments_query: ApartmentsQuery) -> dict:
+    '''
+    Готовый JSON ответ GET /apartments, через кэш ответов, если он включен.
+    Поиск по датам зависит от броней и не кэшируется
+    '''
+    cache = RESPONSE_CACHE_INITIALIZER.cache
+    parse_fields(apartments_query.fields)
+    if cache is None or apartments_query.arrival_date is not None or apartments_query.departure_date is not None:
+        return _apartments_payload(await get_apartments(session, apartments_query), apartments_query.fields)
+
+    apartments_query = await _normalize_geo_query(apartments_query)
+
+    async def load():
+        payload = _apartments_payload(await get_apartments(session, apartments_query), apartments_query.fields)
+        tags = [_apartment_tag(item["id"]) for item in payload["items"]]
+        if apartments_query.latitude is not None and apartments_query.radius is not None:
+            tags.extend(_circle_tags(apartments_query.latitude, apartments_query.longitude, apartments_query.radius))
+        else:
+            tags.append(ALL_APARTMENTS_TAG)
+        if apartments_query.sort == 'popularity':
+            tags.append(listing_stats.POPULARITY_TAG)
+        if apartments_query.q is not None and apartments_query.q.strip():
+            tags.append(SEARCH_TAG)
+        return payload, tags
+
+    return await cache.read_through(f'apartments:{apartments_query.model_dump_json()}', load)
+
+
+async def get_apartment_response(session: AsyncSession, apartment_id: int, fields: Optional[str] = None):
+    '''
+    Готовый JSON ответ GET /apartments/{id} или None. В кэше лежит квартира целиком, fields= выбираются из нее
+    '''
+    fields = parse_fields(fields)
+    cache = RESPONSE_CACHE_INITIALIZER.cache
+    if cache is None:
+        if fields is not None:
+            return await get_apartment_fields(session, apartment_id, fields)
+        item = await get_apartment(session, apartment_id)
+        return schemas.Apartment.model_validate(item).model_dump(mode='json') if item is not None else None
+
+    async def load():
+        item = await get_apartment(session, apartment_id)
+        payload = schemas.Apartment.model_validate(item).model_dump(mode='json') if item is not None else None
+        return payload, [_apartment_tag(apartment_id)]
+
+    item = await cache.read_through(_apartment_tag(apartment_id), load)
+    if item is None or fields is None:
+        return item
+    return {name: item[name] for name in fields}
+
+
+async def invalidate_apartment(apartment_id: int, *points):
+    '''
+    Сбрасывает закэшированные ответы с квартирой и списки, которые она могла изменить.
+    points - старые и новые (latitude, longitude) квартиры. Даже правка на месте (rooms, area, заголовок)
+    может добавить квартиру в выдачу с фильтром, q= или sort=, где ее не было, поэтому сбрасываются
+    все списки без точки и ячейки старого и нового места
+    '''
+    cache = RESPONSE_CACHE_INITIALIZER.cache
+    if cache is None:
+        return
+    tags = [_apartment_tag(apartment_id), ALL_APARTMENTS_TAG]
+    tags.extend(_cell_tag(lat, lng) for lat, lng in points if lat is not None and lng is not None)
+    await cache.invalidate(tags)
+
+
+async def invalidate_apartments(apartment_ids: List[int]):
+    '''
+    Сбрасывает ответы с этими квартирами, когда изменилось только содержимое (картинки), а не координаты
+    и не поля, по которым фильтруются списки: такие квартиры не входят в новые выдачи и не выпадают из старых
+    '''
+    cache = RESPONSE_CACHE_INITIALIZER.cache
+    if cache is None:
+        return
+    await cache.invalidate([_apartment_tag(apartment_id) for apartment_id in apartment_ids])
+
+
+async def invalidate_search():
+    '''
+    Сбрасывает выдачи с q= после добавления, правки или удаления отзыва
+    '''
+    cache = RESPONSE_CACHE_INITIALIZER.cache
+    if cache is None:
+        return
+    await cache.invalidate([SEARCH_TAG])
+
+
+async def invalidate_area(points):
+    '''
+    Сбрасывает гео-запросы после добавления многих квартир сразу (массовая загрузка)
+    '''
+    cache = RESPONSE_CACHE_INITIALIZER.cache
+    if cache is None:
+        return
+    await cache.invalidate([ALL_APARTMENTS_TAG, *{_cell_tag(lat, lng) for lat, lng in points}])
+
+
+async def get_my_apartments(session: AsyncSession, email: str, fields: Optional[str] = None):
+    fields = parse_fields(fields)
+
+    if fields is None:
+        query = select(models.Apartment).filter(models.Apartment.publisher_email == email)
+        res = (await session.execute(query)).scalars().all()
+    else:
+        query = select(*_projection(fields)).filter(models.Apartment.publisher_email == email)
+        res = [_project_row(row, fields) for row in (await session.execute(query)).mappings()]
 
     return {
         "items": res,
-        "total": total_items,
+        "total": len(res),
+        "total_mode": CountMode.exact,
         "size": len(res),
     }
 
-def add_apartment(db: Session, apartment: ApartmentCreate):
+
+async def add_apartment(session: AsyncSession, apartment: ApartmentCreate):
+    apartment = await images.externalize_apartment_images(apartment)
     db_item = models.Apartment(**apartment.model_dump())
-    db_item.location = f'POINT({apartment.latitude} {apartment.longitude})'
+    db_item.location = make_point(apartment.latitude, apartment.longitude)
 
-    db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
+    session.add(db_item)
+    await session.flush()
+    await listing_stats.created(session, db_item.id)
+    await session.commit()
+    await session.refresh(db_item)
+    images.schedule_derivatives(db_item)
+    await invalidate_apartment(db_item.id, (db_item.latitude, db_item.longitude))
 
     return db_item
 
 
-def update_apartment(db: Session, apartment_id: int, updated_apartment: ApartmentUpdate):
-    db_apartment = db.query(models.Apartment).filter(models.Apartment.id == apartment_id).first()
+async def update_apartment(session: AsyncSession, apartment_id: int, updated_apartment: ApartmentUpdate):
+    db_apartment = await get_apartment(session, apartment_id)
 
     if db_apartment:
-        for attr, value in updated_apartment.dict().items():
+        old_point = (db_apartment.latitude, db_apartment.longitude)
+        updated_apartment = await images.externalize_apartment_images(updated_apartment)
+        for attr, value in updated_apartment.model_dump().items():
             setattr(db_apartment, attr, value)
 
-        db_apartment.location = f'POINT({updated_apartment.latitude} {updated_apartment.longitude})'
+        db_apartment.location = make_point(updated_apartment.latitude, updated_apartment.longitude)
+        db_apartment.version = models.Apartment.version + 1
 
-        db.commit()
+        await session.commit()
+        await session.refresh(db_apartment)
+        images.schedule_derivatives(db_apartment)
+        new_point = (db_apartment.latitude, db_apartment.longitude)
+        await invalidate_apartment(apartment_id, old_point, new_point)
         return db_apartment
 
     return None
 
 
-def delete_apartment(db: Session, apartment_id: int):
-    result = db.query(models.Apartment) \
-        .filter(models.Apartment.id == apartment_id) \
-        .delete()
-    db.commit()
-    query = text("delete from favorite_items where apartment_id = :id;")
-    db.execute(query, {"id": apartment_id})
-    db.commit()
-    query = text("delete from reservation where apartment_id = :id;")
-    db.execute(query, {"id": apartment_id})
-    db.commit()
-    return result == 1
+async def delete_apartment(session: AsyncSession, apartment_id: int):
+    result = await session.execute(
+        delete(models.Apartment).filter(models.Apartment.id == apartment_id)
+        .returning(models.Apartment.latitude, models.Apartment.longitude)
+    )
+    deleted = result.all()
+    await session.execute(
+        delete(models.FavoriteItem).filter(models.FavoriteItem.apartment_id == apartment_id)
+    )
+    await session.execute(
+        delete(models.Reservation).filter(models.Reservation.apartment_id == apartment_id)
+    )
+    await session.execute(
+        delete(models.ListingStats).filter(models.ListingStats.apartment_id == apartment_id)
+    )
+    await session.commit()
+    AVAILABILITY_INDEX.invalidate(apartment_id)
+    OCCUPANCY_INDEX.cleared(apartment_id)
+    await invalidate_apartment(apartment_id, *deleted)
+    return len(deleted) == 1
@@ -0,0 +1,98 @@
+'''
+Подсказки для строки поиска: похожие адреса и заголовки квартир по триграммам (pg_trgm).
+Запрос идет по GIN индексам ix_apartments_*_trgm, на каждое поле ранжируется не больше
+AUTOCOMPLETE_CANDIDATES совпадений; statement_timeout ограничивает худший случай.
+Ответы на частые префиксы держатся в коротком LRU кэше
+'''
+import logging
+import typing
+
+from sqlalchemy import func, literal, select, text, union_all
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config
+from app.cache import LRUCache, MISSING
+from app.database import models
+
+logger = logging.getLogger(__name__)
+
+cfg: config.Config = config.load_config()
+
+FIELDS = ('address', 'title')
+# Из одной-двух букв триграмм не получается, индекс не помогает
+MIN_QUERY_LENGTH = 3
+# SQLSTATE query_canceled: сработал statement_timeout
+QUERY_CANCELED = '57014'
+
+
+def normalize(q: str) -> str:
+    return ' '.join(q.lower().split())
+
+
+def _candidates(field: str, q: str, limit: int):
+    column = getattr(models.Apartment, field)
+    # column %> q: word_similarity(q, column) >= pg_trgm.word_similarity_threshold, проверяется по GIN индексу
+    return select(
+        literal(field).label('field'), column.label('value'), func.word_similarity(q, column).label('score')
+    ).where(column.op('%>')(q)).limit(limit)
+
+
+def suggestions_query(q: str, limit: int, candidates: int):
+    '''
+    Различные значения полей, лучшие по word_similarity
+    '''
+    matches = union_all(*(_candidates(field, q, candidates) for field in FIELDS)).subquery()
+    score = func.max(matches.c.score)
+    return select(matches.c.field, matches.c.value, score.label('score')) \
+        .group_by(matches.c.field, matches.c.value) \
+        .order_by(score.desc(), matches.c.value) \
+        .limit(limit)
+
+
+class Autocomplete():
+    def __init__(self, cfg: config.Config):
+        self.max_results = cfg.AUTOCOMPLETE_MAX_RESULTS
+        self.candidates = cfg.AUTOCOMPLETE_CANDIDATES
+        self.min_similarity = cfg.AUTOCOMPLETE_MIN_SIMILARITY
+        self.timeout_ms = cfg.AUTOCOMPLETE_TIMEOUT_MS
+        self.ttl = cfg.AUTOCOMPLETE_CACHE_TTL
+        # Кэшируется полный список (max_results), меньший limit - срез из него
+        self.cache = LRUCache(cfg.AUTOCOMPLETE_CACHE_SIZE)
+
+    async def _load(self, session: AsyncSession, q: str) -> typing.Optional[typing.List[dict]]:
+        # Настройки только на эту транзакцию: соединение вернется в пул с обычными значениями
+        await session.execute(
+            text(
+                "SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true), "
+                "set_config('statement_timeout', :timeout, true)"
+            ),
+            {"threshold": str(self.min_similarity), "timeout": str(self.timeout_ms)}
+        )
+        try:
+            rows = (await session.execute(suggestions_query(q, self.max_results, self.candidates))).all()
+        except DBAPIError as e:
+            if getattr(e.orig, 'sqlstate', None) != QUERY_CANCELED:
+                raise
+            await session.rollback()
+            logger.warning(f'Autocomplete for {q!r} exceeded {self.timeout_ms} ms')
+            return None
+        return [{"value": row.value, "field": row.field, "score": round(row.score, 3)} for row in rows]
+
+    async def suggest(self, session: AsyncSession, q: str, limit: int) -> typing.List[dict]:
+        q = normalize(q)
+        limit = max(min(limit, self.max_results), 0)
+        if len(q) < MIN_QUERY_LENGTH or limit == 0:
+            return []
+
+        suggestions = self.cache.get(q)
+        if suggestions is MISSING:
+            suggestions = await self._load(session, q)
+            if suggestions is None:
+                # Таймаут: пустой ответ, но не в кэш - следующий запрос попробует снова
+                return []
+            self.cache.set(q, suggestions, self.ttl)
+        return suggestions[:limit]
+
+
+AUTOCOMPLETE = Autocomplete(cfg)
@@ -0,0 +1,160 @@
+import bisect
+import collections
+import datetime
+import logging
+import time
+import typing
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config
+from app.database import models
+
+logger = logging.getLogger(__name__)
+
+cfg: config.Config = config.load_config()
+
+
+class Booking(typing.NamedTuple):
+    arrival_date: datetime.date
+    departure_date: datetime.date
+    email: str
+    id: int
+
+
+def _sort_key(booking: Booking):
+    return booking.arrival_date, booking.id
+
+
+class ApartmentBookings():
+    '''
+    Брони одной квартиры, отсортированные по дате заезда.
+    max_length - самая длинная бронь: пересекающие [start, end) брони начинаются не раньше start - max_length
+    '''
+    __slots__ = ('arrivals', 'bookings', 'max_length', 'loaded_at')
+
+    def __init__(self, bookings: typing.Iterable[Booking]):
+        self.bookings: typing.List[Booking] = sorted(bookings, key=_sort_key)
+        self.arrivals = [b.arrival_date for b in self.bookings]
+        self.max_length = max((b.departure_date - b.arrival_date for b in self.bookings), default=datetime.timedelta())
+        self.loaded_at = time.monotonic()
+
+    def add(self, booking: Booking):
+        i = bisect.bisect_right(self.bookings, _sort_key(booking), key=_sort_key)
+        self.bookings.insert(i, booking)
+        self.arrivals.insert(i, booking.arrival_date)
+        self.max_length = max(self.max_length, booking.departure_date - booking.arrival_date)
+
+    def remove(self, reservation_id: int):
+        for i, booking in enumerate(self.bookings):
+            if booking.id == reservation_id:
+                del self.bookings[i]
+                del self.arrivals[i]
+                return
+
+    def overlapping(self, start_date: datetime.date, end_date: datetime.date) -> typing.List[Booking]:
+        lo = bisect.bisect_left(self.arrivals, start_date - self.max_length)
+        hi = bisect.bisect_left(self.arrivals, end_date)
+        return [b for b in self.bookings[lo:hi] if b.departure_date > start_date]
+
+
+def _booking(reservation) -> typing.Optional[Booking]:
+    if reservation.arrival_date is None or reservation.departure_date is None:
+        return None
+    return Booking(reservation.arrival_date, reservation.departure_date, reservation.email, reservation.id)
+
+
+class AvailabilityIndex():
+    '''
+    In-process индекс броней по квартирам. Квартира загружается из базы при первом обращении,
+    дальше поддерживается записями reservation_service. Число квартир в памяти ограничено LRU,
+    запись живет не дольше ttl (другие воркеры тоже пишут в базу).
+    '''
+
+    def __init__(self, max_apartments: int, ttl: float, verify_every: int = 0):
+        self.max_apartments = max_apartments
+        self.ttl = ttl
+        self.verify_every = verify_every
+        self.hits = 0
+        self.misses = 0
+        self.mismatches = 0
+        self._reads = 0
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        # Счетчик изменений по квартире: загрузка, во время которой была запись, в индекс не попадает
+        self._generations: typing.Dict[int, int] = collections.defaultdict(int)
+
+    async def _load(self, session: AsyncSession, apartment_id: int) -> ApartmentBookings:
+        query = select(
+            models.Reservation.arrival_date, models.Reservation.departure_date,
+            models.Reservation.email, models.Reservation.id
+        ).filter(models.Reservation.apartment_id == apartment_id)
+        rows = (await session.execute(query)).all()
+        return ApartmentBookings(b for b in map(_booking, rows) if b is not None)
+
+    async def get(self, session: AsyncSession, apartment_id: int) -> ApartmentBookings:
+        entry = self._entries.get(apartment_id)
+        if entry is not None and time.monotonic() - entry.loaded_at < self.ttl:
+            self.hits += 1
+            self._entries.move_to_end(apartment_id)
+            self._reads += 1
+            if self.verify_every and self._reads % self.verify_every == 0:
+                return await self.verify(session, apartment_id)
+            return entry
+
+        self.misses += 1
+        generation = self._generations[apartment_id]
+        entry = await self._load(session, apartment_id)
+        if self._generations[apartment_id] == generation:
+            self._store(apartment_id, entry)
+        return entry
+
+    def _store(self, apartment_id: int, entry: ApartmentBookings):
+        self._entries[apartment_id] = entry
+        self._entries.move_to_end(apartment_id)
+        while len(self._entries) > self.max_apartments:
+            self._entries.popitem(last=False)
+
+    async def verify(self, session: AsyncSession, apartment_id: int) -> ApartmentBookings:
+        '''
+        Сверяет квартиру с базой; при расхождении заменяет запись данными из базы
+        '''
+        generation = self._generations[apartment_id]
+        fresh = await self._load(session, apartment_id)
+        entry = self._entries.get(apartment_id)
+        if entry is not None and entry.bookings != fresh.bookings and self._generations[apartment_id] == generation:
+            self.mismatches += 1
+            logger.warning(f'Availability index for apartment {apartment_id} diverged from the database, reloaded')
+        if self._generations[apartment_id] == generation:
+            self._store(apartment_id, fresh)
+        return fresh
+
+    def added(self, reservation):
+        self._generations[reservation.apartment_id] += 1
+        entry = self._entries.get(reservation.apartment_id)
+        booking = _booking(reservation)
+        if entry is not None and booking is not None:
+            entry.add(booking)
+
+    def removed(self, apartment_id: int, reservation_id: int):
+        self._generations[apartment_id] += 1
+        entry = self._entries.get(apartment_id)
+        if entry is not None:
+            entry.remove(reservation_id)
+
+    def invalidate(self, apartment_id: int):
+        self._generations[apartment_id] += 1
+        self._entries.pop(apartment_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "apartments": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "mismatches": self.mismatches,
+        }
+
+
+AVAILABILITY_INDEX = AvailabilityIndex(
+    cfg.AVAILABILITY_INDEX_SIZE, cfg.AVAILABILITY_INDEX_TTL, cfg.AVAILABILITY_INDEX_VERIFY_EVERY
+)
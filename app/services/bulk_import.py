@@ -0,0 +1,317 @@
+'''
+Массовая загрузка квартир из CSV / NDJSON потока: строки валидируются по BaseApartment,
+пачка копируется через COPY во временную таблицу, location считается одним INSERT ... SELECT.
+Каждая пачка - своя транзакция. Ошибочные строки пропускаются и возвращаются с номером строки.
+
+    python -m app.services.bulk_import listings.csv --publisher-email partner@example.com
+    python -m app.services.bulk_import listings.ndjson --format ndjson
+'''
+import argparse
+import asyncio
+import codecs
+import collections
+import csv
+import functools
+import json
+import logging
+import math
+import time
+import typing
+
+from pydantic import EmailStr, TypeAdapter, ValidationError
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config
+from app.api.schemas import BaseApartment
+from app.database import async_base
+from app.images import IMAGE_STORE_INITIALIZER, IMAGE_FIELDS, is_external
+from app.services import apartment_service
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'ndjson')
+COLUMNS = ('title', 'address', 'rooms', 'area', 'latitude', 'longitude', 'publisher_email', *IMAGE_FIELDS)
+_LATITUDE, _LONGITUDE = COLUMNS.index('latitude'), COLUMNS.index('longitude')
+STAGING_TABLE = 'apartments_import'
+# Сколько ошибок возвращать в ответе; считаются все
+MAX_REPORTED_ERRORS = 1000
+
+_CREATE_STAGING = f'''
+CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+    title text, address text, rooms integer, area integer, latitude double precision,
+    longitude double precision, publisher_email text,
+    image1 text, image2 text, image3 text, image4 text, image5 text, image6 text
+) ON COMMIT DROP
+'''
+
+# Вместе с квартирами создаются их пустые строки listing_stats
+_INSERT_FROM_STAGING = f'''
+WITH inserted AS (
+    INSERT INTO apartments ({', '.join(COLUMNS)}, location)
+    SELECT {', '.join(COLUMNS)}, ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography
+    FROM {STAGING_TABLE}
+    RETURNING id
+)
+INSERT INTO listing_stats (apartment_id) SELECT id FROM inserted
+'''
+
+
+async def _lines(chunks: typing.AsyncIterable[bytes]) -> typing.AsyncIterator[str]:
+    '''
+    Режет поток байт на строки, не дожидаясь конца тела
+    '''
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    tail = ''
+    async for chunk in chunks:
+        lines = (tail + decoder.decode(chunk)).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+class _PendingLines():
+    '''
+    Источник строк для одного csv.reader на весь поток: пополняется по мере чтения тела.
+    csv.reader продолжает работу после StopIteration, как только строки появятся снова
+    '''
+
+    def __init__(self):
+        self.lines = collections.deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+def _inside_quotes(line: str, inside: bool) -> bool:
+    '''
+    Остается ли открытым поле в кавычках после строки (перевод строки внутри значения).
+    Как в csv: кавычка открывает поле только в его начале, "" внутри поля - экранированная кавычка
+    '''
+    position = line.find('"')
+    while position != -1:
+        if inside:
+            if line.startswith('"', position + 1):
+                position = line.find('"', position + 2)
+                continue
+            inside = False
+        elif position == 0 or line[position - 1] == ',':
+            inside = True
+        position = line.find('"', position + 1)
+    return inside
+
+
+async def parse_rows(
+        chunks: typing.AsyncIterable[bytes], format: str
+) -> typing.AsyncIterator[typing.Tuple[int, typing.Union[dict, str]]]:
+    '''
+    (номер строки, dict) или (номер строки, текст ошибки разбора). В CSV первая строка - заголовок;
+    значения в кавычках могут содержать переводы строк, тогда номер - первая строка записи.
+    Запись попадает в csv.reader, только когда закрыты все ее кавычки
+    '''
+    if format == 'ndjson':
+        number = 0
+        async for line in _lines(chunks):
+            number += 1
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, f'invalid JSON: {e}'
+                continue
+            yield number, row if isinstance(row, dict) else 'expected a JSON object'
+        return
+
+    pending = _PendingLines()
+    reader = csv.reader(pending)
+    header = None
+    number = first = 0
+    inside = False
+    async for line in _lines(chunks):
+        number += 1
+        if not inside:
+            if not line.strip():
+                continue
+            first = number
+        pending.lines.append(line + '\n')
+        inside = _inside_quotes(line, inside)
+        if inside:
+            continue
+
+        values = next(reader)
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield first, f'expected {len(header)} columns, got {len(values)}'
+            continue
+        yield first, {name: value for name, value in zip(header, values) if value != ''}
+    if inside:
+        yield first, 'unterminated quoted field'
+
+
+_EMAIL = TypeAdapter(EmailStr)
+
+
+def _errors(e: ValidationError) -> typing.List[str]:
+    return [f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()]
+
+
+@functools.lru_cache(maxsize=4096)
+def _email_errors(email: str) -> typing.Tuple[str, ...]:
+    '''
+    Проверка email дороже всей остальной валидации строки, а владельцев в файле обычно немного
+    '''
+    try:
+        _EMAIL.validate_python(email)
+        return ()
+    except ValidationError as e:
+        return tuple(f"publisher_email: {error['msg']}" for error in e.errors())
+
+
+def _validate(row: dict, publisher_email: typing.Optional[str], url_prefix: str):
+    '''
+    Кортеж значений для COPY или список ошибок строки
+    '''
+    email = publisher_email if publisher_email is not None else row.get('publisher_email')
+    errors = list(_email_errors(email)) if isinstance(email, str) else ['publisher_email: Field required']
+    try:
+        apartment = BaseApartment.model_validate(row)
+    except ValidationError as e:
+        return errors + _errors(e)
+
+    if not (-90 <= apartment.latitude <= 90) or not (-180 <= apartment.longitude <= 180) \
+            or not math.isfinite(apartment.latitude) or not math.isfinite(apartment.longitude):
+        errors.append('latitude/longitude out of range')
+    for field in IMAGE_FIELDS:
+        value = getattr(apartment, field)
+        if value and not is_external(value, url_prefix):
+            errors.append(f'{field}: inline images are not supported, upload them via POST /images')
+    if errors:
+        return errors
+    return (
+        apartment.title, apartment.address, apartment.rooms, apartment.area, apartment.latitude,
+        apartment.longitude, email, *(getattr(apartment, field) for field in IMAGE_FIELDS)
+    )
+
+
+async def _load_chunk(session: AsyncSession, records: typing.List[tuple]) -> int:
+    connection = await session.connection()
+    raw = (await connection.get_raw_connection()).driver_connection
+    await session.execute(text(_CREATE_STAGING))
+    await raw.copy_records_to_table(STAGING_TABLE, records=records, columns=COLUMNS)
+    result = await session.execute(text(_INSERT_FROM_STAGING))
+    await session.execute(text(f'TRUNCATE {STAGING_TABLE}'))
+    return result.rowcount
+
+
+async def import_apartments(
+        session: AsyncSession, chunks: typing.AsyncIterable[bytes], format: str,
+        publisher_email: typing.Optional[str] = None, chunk_size: int = 5000
+) -> dict:
+    '''
+    Загружает квартиры пачками по chunk_size, каждая пачка коммитится отдельно: ошибка базы откатывает
+    только свою пачку (ее строки попадают в errors), загруженные раньше остаются.
+    publisher_email - владелец всех строк (иначе берется из колонки)
+    '''
+    if format not in FORMATS:
+        raise ValueError(f'format must be one of {", ".join(FORMATS)}')
+
+    url_prefix = IMAGE_STORE_INITIALIZER.url_prefix
+    started = time.perf_counter()
+    imported = failed = 0
+    errors = []
+    records: typing.List[tuple] = []
+    lines: typing.List[int] = []
+
+    def report(line: int, row_errors: typing.List[str]):
+        nonlocal failed
+        failed += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"line": line, "errors": row_errors})
+
+    async def load():
+        nonlocal imported
+        try:
+            loaded = await _load_chunk(session, records)
+            await session.commit()
+        except DBAPIError as e:
+            await session.rollback()
+            logger.warning(f'Import batch of lines {lines[0]}-{lines[-1]} failed: {e.orig!r}')
+            for line in lines:
+                report(line, [f'batch of lines {lines[0]}-{lines[-1]} rejected by the database: {e.orig}'])
+            return
+        imported += loaded
+        await apartment_service.invalidate_area({(record[_LATITUDE], record[_LONGITUDE]) for record in records})
+
+    async for line, row in parse_rows(chunks, format):
+        if isinstance(row, str):
+            report(line, [row])
+            continue
+        record = _validate(row, publisher_email, url_prefix)
+        if isinstance(record, list):
+            report(line, record)
+            continue
+        records.append(record)
+        lines.append(line)
+        if len(records) >= chunk_size:
+            await load()
+            records, lines = [], []
+
+    if records:
+        await load()
+
+    elapsed = time.perf_counter() - started
+    logger.info(f'Imported {imported} apartments ({failed} failed) in {elapsed:.2f} s')
+    return {
+        "imported": imported,
+        "failed": failed,
+        "errors": errors,
+        "rows_per_second": round(imported / elapsed) if elapsed else None,
+    }
+
+
+async def _file_chunks(path: str, size: int = 1 << 20) -> typing.AsyncIterator[bytes]:
+    with open(path, 'rb') as f:
+        while chunk := f.read(size):
+            yield chunk
+
+
+async def main(path: str, format: str, publisher_email: typing.Optional[str], chunk_size: int):
+    cfg = config.load_config()
+    await async_base.DB_INITIALIZER.init_db(str(cfg.POSTGRES_DSN_ASYNC), cfg)
+    IMAGE_STORE_INITIALIZER.init_store(cfg)
+    try:
+        async with async_base.DB_INITIALIZER.async_session_maker() as session:
+            result = await import_apartments(session, _file_chunks(path), format, publisher_email, chunk_size)
+        for error in result["errors"]:
+            logger.warning(f'line {error["line"]}: {"; ".join(error["errors"])}')
+        logger.info(f'Done: {result["imported"]} imported, {result["failed"]} failed, '
+                    f'{result["rows_per_second"]} rows/s')
+    finally:
+        await IMAGE_STORE_INITIALIZER.close()
+        await async_base.DB_INITIALIZER.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=FORMATS, help='по умолчанию - по расширению файла')
+    parser.add_argument('--publisher-email', help='владелец всех квартир; иначе колонка publisher_email')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(
+        args.path, args.format or ('ndjson' if args.path.endswith(('.ndjson', '.jsonl')) else 'csv'),
+        args.publisher_email, args.chunk_size
+    ))
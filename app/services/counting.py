@@ -0,0 +1,67 @@
+import json
+import typing
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from app import config
+from app.api.schemas import CountMode
+from app.cache import LRUCache, MISSING
+
+cfg: config.Config = config.load_config()
+
+_count_cache = LRUCache(cfg.PAGINATION_COUNT_CACHE_SIZE)
+
+
+def resolve_count_mode(requested: typing.Optional[CountMode], cursor: typing.Optional[str]) -> CountMode:
+    '''
+    Явно запрошенный режим важнее всего; для страниц по курсору total по умолчанию не считается
+    '''
+    if requested is not None:
+        return requested
+    if cursor is not None:
+        return CountMode.none
+    return CountMode(cfg.PAGINATION_COUNT_MODE)
+
+
+def _literal_sql(session: AsyncSession, query: Select) -> str:
+    return str(query.compile(dialect=session.get_bind().dialect, compile_kwargs={"literal_binds": True}))
+
+
+async def _estimate_rows(session: AsyncSession, query: Select) -> int:
+    '''
+    Оценка планировщика (EXPLAIN без выполнения запроса)
+    '''
+    connection = await session.connection()
+    result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {_literal_sql(session, query)}")
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def count_rows(
+        session: AsyncSession, query: Select, mode: CountMode
+) -> typing.Tuple[typing.Optional[int], CountMode]:
+    '''
+    Считает количество строк запроса выбранным способом, возвращает (total, режим)
+    '''
+    query = query.order_by(None).limit(None).offset(None)
+
+    if mode == CountMode.none:
+        return None, mode
+    if mode == CountMode.estimated:
+        return await _estimate_rows(session, query), mode
+
+    count_query = select(func.count()).select_from(query.subquery())
+    if mode == CountMode.cached:
+        # Ключ - SQL с подставленными значениями, то есть нормализованные фильтры
+        key = _literal_sql(session, count_query)
+        total = _count_cache.get(key)
+        if total is MISSING:
+            total = await session.scalar(count_query)
+            _count_cache.set(key, total, cfg.PAGINATION_COUNT_CACHE_TTL)
+        return total, mode
+
+    return await session.scalar(count_query), CountMode.exact
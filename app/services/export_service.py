@@ -0,0 +1,114 @@
+'''
+Потоковая выгрузка apartments и reservation (NDJSON / CSV, опционально gzip).
+Строки читаются серверным курсором пачками по EXPORT_BATCH_SIZE и сразу отдаются клиенту: следующая пачка
+выбирается, только когда предыдущая ушла в сокет, поэтому память воркера не зависит от размера таблицы
+'''
+import csv
+import datetime
+import io
+import json
+import logging
+import typing
+import zlib
+
+from sqlalchemy import Select, select
+
+from app import config
+from app.database import async_base, models
+from app.services import apartment_service, reservation_service
+
+logger = logging.getLogger(__name__)
+
+cfg: config.Config = config.load_config()
+
+FORMATS = ('ndjson', 'csv')
+MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+RESERVATION_COLUMNS = ('id', 'email', 'arrival_date', 'departure_date', 'apartment_id', 'version', 'updated_at')
+
+
+def apartments_query(
+        publisher_email: typing.Optional[str] = None, updated_since: typing.Optional[datetime.datetime] = None
+) -> Select:
+    # Колонки, а не сущности: строки не попадают в identity map сессии
+    query = select(*(getattr(models.Apartment, name) for name in apartment_service.APARTMENT_COLUMNS))
+    if publisher_email is not None:
+        query = query.filter(models.Apartment.publisher_email == publisher_email)
+    if updated_since is not None:
+        query = query.filter(models.Apartment.updated_at >= updated_since)
+    return query.order_by(models.Apartment.id)
+
+
+def reservations_query(
+        apartment_id: typing.Optional[int] = None, email: typing.Optional[str] = None,
+        start_date: typing.Optional[datetime.date] = None, end_date: typing.Optional[datetime.date] = None
+) -> Select:
+    '''
+    start_date / end_date - брони, пересекающие [start_date, end_date); можно задать только одну границу
+    '''
+    query = select(*(getattr(models.Reservation, name) for name in RESERVATION_COLUMNS))
+    if apartment_id is not None:
+        query = query.filter(models.Reservation.apartment_id == apartment_id)
+    if email is not None:
+        query = query.filter(models.Reservation.email == email)
+    if start_date is not None or end_date is not None:
+        query = query.filter(reservation_service.overlapping_stay(start_date, end_date))
+    return query.order_by(models.Reservation.id)
+
+
+def _plain(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _ndjson(names: typing.Sequence[str], rows: typing.Sequence[tuple]) -> str:
+    return ''.join(
+        json.dumps(dict(zip(names, row)), ensure_ascii=False, default=_plain) + '\n' for row in rows
+    )
+
+
+def _csv(rows: typing.Iterable[typing.Sequence]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue()
+
+
+def _encoder(format: str, names: typing.Sequence[str]) -> typing.Callable[[typing.Sequence[tuple]], str]:
+    if format == 'ndjson':
+        return lambda rows: _ndjson(names, rows)
+    return lambda rows: _csv([tuple(map(_plain, row)) for row in rows])
+
+
+async def stream_rows(
+        query: Select, format: str, gzip: bool = False, batch_size: typing.Optional[int] = None
+) -> typing.AsyncIterator[bytes]:
+    '''
+    Сессия открывается внутри генератора и живет, пока идет ответ; при обрыве соединения генератор
+    отменяется, курсор закрывается и соединение возвращается в пул
+    '''
+    names = [column.key for column in query.selected_columns]
+    encode = _encoder(format, names)
+    compressor = zlib.compressobj(cfg.EXPORT_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if gzip else None
+    exported = 0
+
+    def pack(text: str) -> bytes:
+        data = text.encode('utf-8')
+        return compressor.compress(data) if compressor is not None else data
+
+    if format == 'csv':
+        yield pack(_csv([names]))
+
+    async with async_base.DB_INITIALIZER.async_session_maker() as session:
+        result = await session.stream(query.execution_options(yield_per=batch_size or cfg.EXPORT_BATCH_SIZE))
+        async for rows in result.partitions():
+            exported += len(rows)
+            chunk = pack(encode(rows))
+            if chunk:
+                yield chunk
+
+    if compressor is not None:
+        yield compressor.flush()
+    logger.info(f'Exported {exported} rows')
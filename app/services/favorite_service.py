@@ -1,59 +1,182 @@
-from app.api.schemas import FavoriteItemCreate
-from sqlalchemy.orm import Session
+from app.api.schemas import CountMode, FavoriteItemCreate
+from fastapi import HTTPException
+from sqlalchemy import Integer, any_, bindparam, case, delete, func, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import config, images
 from app.database import models
+from app.services import counting, listing_stats, pagination
+from typing import List, Optional, Sequence
 
+cfg: config.Config = config.load_config()
 
-def get_favorite_items_by_user_email(db: Session, user_email: str, limit: int = 1, offset: int = 0):
-    total_items = db.query(models.FavoriteItem) \
-        .filter(models.FavoriteItem.user_email == user_email) \
-        .count()
+# id - порядок добавления, recent - сначала недавно добавленные
+SORTS = ('id', 'recent')
+# Карточка квартиры в expand=apartment: без колонок картинок, вместо них превью image1
+SUMMARY_FIELDS = ('id', 'title', 'address', 'rooms', 'area', 'latitude', 'longitude', 'version', 'updated_at')
+# Значение image1 длиннее (в байтах) - встроенная картинка (base64), а не URL; из базы не выбирается.
+# octet_length берет размер из заголовка значения и не распаковывает TOAST, length считал бы символы по всей строке
+MAX_IMAGE_URL_LENGTH = 2048
 
-    res = db.query(models.FavoriteItem) \
-        .filter(models.FavoriteItem.user_email == user_email) \
-        .offset(offset) \
-        .limit(limit) \
-        .all()
+
+def _summary_columns() -> list:
+    image1 = models.Apartment.image1
+    return [
+        *(getattr(models.Apartment, name).label(f'apartment__{name}') for name in SUMMARY_FIELDS),
+        case((func.octet_length(image1) <= MAX_IMAGE_URL_LENGTH, image1)).label('apartment__image1'),
+    ]
+
+
+def _summary(row) -> Optional[dict]:
+    '''
+    None - квартиру удалили, а запись в избранном осталась
+    '''
+    if row['apartment__id'] is None:
+        return None
+    item = {name: row[f'apartment__{name}'] for name in SUMMARY_FIELDS}
+    item['updated_at'] = item['updated_at'].isoformat() if item['updated_at'] is not None else None
+    item['thumbnail'] = images.derivative_url(row['apartment__image1'], 'thumb')
+    return item
+
+
+async def get_favorite_items_by_user_email(
+        session: AsyncSession, user_email: str, limit: int = 1, offset: int = 0, cursor: Optional[str] = None,
+        count: Optional[CountMode] = None, sort: str = 'id', expand_apartment: bool = False
+):
+    '''
+    expand_apartment - к каждой записи одним LEFT JOIN добавляется карточка квартиры (apartment),
+    items тогда - готовые к JSON dict
+    '''
+    if sort not in SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(SORTS)}")
+    query = select(models.FavoriteItem) \
+        .filter(models.FavoriteItem.user_email == user_email)
+
+    total_items, total_mode = await counting.count_rows(
+        session, query, counting.resolve_count_mode(count, cursor)
+    )
+
+    recent = sort == 'recent'
+    if cursor is None:
+        query = query.offset(offset)
+    else:
+        last_id, = pagination.decode_cursor(cursor, sort, (int,))
+        query = query.filter(models.FavoriteItem.id < last_id if recent else models.FavoriteItem.id > last_id)
+    query = query.order_by(models.FavoriteItem.id.desc() if recent else models.FavoriteItem.id).limit(limit + 1)
+
+    if expand_apartment:
+        query = query.with_only_columns(
+            models.FavoriteItem.id, models.FavoriteItem.apartment_id, *_summary_columns()
+        ).outerjoin(models.Apartment, models.Apartment.id == models.FavoriteItem.apartment_id)
+        rows = (await session.execute(query)).mappings().all()
+        page, next_cursor = pagination.keyset_page(rows, limit, sort, lambda row: (row['id'],))
+        res = [{"id": row['id'], "apartment_id": row['apartment_id'], "apartment": _summary(row)} for row in page]
+    else:
+        result = await session.execute(query)
+        res, next_cursor = pagination.keyset_page(result.scalars().all(), limit, sort, lambda item: (item.id,))
 
     return {
         "items": res,
         "total": total_items,
+        "total_mode": total_mode,
         "size": len(res),
+        "next_cursor": next_cursor,
     }
 
 
-def get_favorite_item_by_id(db: Session, item_id: int):
-    return db.query(models.FavoriteItem) \
+async def get_favorite_item_by_id(session: AsyncSession, item_id: int):
+    query = select(models.FavoriteItem) \
         .filter(models.FavoriteItem.id == item_id) \
-        .first()
+        .limit(1)
+    result = await session.execute(query)
+    return result.scalars().one_or_none()
 
 
-def add_favorite_item(db: Session, item: FavoriteItemCreate):
+def _apartment_ids(apartment_ids: Sequence[int]) -> List[int]:
+    if len(apartment_ids) > cfg.FAVORITES_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {cfg.FAVORITES_BATCH_MAX} apartment_ids per request")
+    return list(dict.fromkeys(apartment_ids))
+
+
+def _ids_param(apartment_ids: List[int]):
+    # Весь список - один параметр-массив: текст запроса не зависит от числа id (кэш prepared statements).
+    # Значение внутри bindparam: словарь параметров в session.execute превратил бы ORM INSERT в bulk insert
+    return bindparam('apartment_ids', apartment_ids, type_=ARRAY(Integer))
+
+
+async def _insert_favorites(
+        session: AsyncSession, user_email: str, apartment_ids: List[int]
+) -> List[models.FavoriteItem]:
+    '''
+    Один INSERT ... SELECT unnest(...) ON CONFLICT DO NOTHING; возвращает только добавленные строки.
+    Счетчики listing_stats меняются в той же транзакции
+    '''
+    query = insert(models.FavoriteItem).from_select(
+        ['user_email', 'apartment_id'],
+        select(literal(user_email), func.unnest(_ids_param(apartment_ids)))
+    ).on_conflict_do_nothing(
+        index_elements=['user_email', 'apartment_id']
+    ).returning(models.FavoriteItem)
+    result = await session.execute(query)
+    added = list(result.scalars().all())
+    await listing_stats.favorites_added(session, [item.apartment_id for item in added])
+    await session.commit()
+    if added:
+        await listing_stats.invalidate()
+    return added
 
-    # Проверка, есть ли уже такой товар в избранном у пользователя
-    existing_favorite = db.query(models.FavoriteItem).filter(
-        models.FavoriteItem.user_email == item.user_email,
-        models.FavoriteItem.apartment_id == item.apartment_id
-    ).first()
 
-    if existing_favorite:
-        # Если товар уже в избранном, не добавляем его повторно
-        return existing_favorite
+async def add_favorite_items(session: AsyncSession, user_email: str, apartment_ids: Sequence[int]) -> List[int]:
+    '''
+    Возвращает apartment_id, которых в избранном не было
+    '''
+    apartment_ids = _apartment_ids(apartment_ids)
+    if not apartment_ids:
+        return []
+    return [item.apartment_id for item in await _insert_favorites(session, user_email, apartment_ids)]
 
-    db_item = models.FavoriteItem(**item.model_dump())
-    db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
 
-    return db_item
+async def delete_favorite_items(session: AsyncSession, user_email: str, apartment_ids: Sequence[int]) -> List[int]:
+    '''
+    Один DELETE ... WHERE apartment_id = ANY(...). Возвращает apartment_id, которые были в избранном
+    '''
+    apartment_ids = _apartment_ids(apartment_ids)
+    if not apartment_ids:
+        return []
+    query = delete(models.FavoriteItem).filter(
+        models.FavoriteItem.user_email == user_email,
+        models.FavoriteItem.apartment_id == any_(_ids_param(apartment_ids))
+    ).returning(models.FavoriteItem.apartment_id)
+    result = await session.execute(query)
+    removed = list(result.scalars().all())
+    await listing_stats.favorites_removed(session, removed)
+    await session.commit()
+    if removed:
+        await listing_stats.invalidate()
+    return removed
+
+
+async def add_favorite_item(session: AsyncSession, item: FavoriteItemCreate):
+    added = await _insert_favorites(session, item.user_email, [item.apartment_id])
+    if added:
+        return added[0]
+
+    # Уже в избранном - повторно не добавляем, отдаем существующую запись
+    query = select(models.FavoriteItem).filter(
+        models.FavoriteItem.user_email == item.user_email,
+        models.FavoriteItem.apartment_id == item.apartment_id
+    ).limit(1)
+    return (await session.execute(query)).scalars().one()
 
 
-def delete_favorite_item(db: Session, item_id: int):
-    db_favorite_item = (
-        db.query(models.FavoriteItem)
-        .filter(
-            models.FavoriteItem.id == item_id
-        )
-        .delete()
+async def delete_favorite_item(session: AsyncSession, item_id: int):
+    result = await session.execute(
+        delete(models.FavoriteItem).filter(models.FavoriteItem.id == item_id)
+        .returning(models.FavoriteItem.apartment_id)
     )
-    db.commit()
-    return db_favorite_item == 1
+    removed = list(result.scalars().all())
+    await listing_stats.favorites_removed(session, removed)
+    await session.commit()
+    if removed:
+        await listing_stats.invalidate()
+    return len(removed) == 1
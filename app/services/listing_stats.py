@@ -0,0 +1,173 @@
+'''
+Счетчики отзывов и избранного по квартирам (таблица listing_stats).
+Функции *_added / *_removed выполняются в транзакции вызывающего сервиса и не коммитят;
+после коммита вызывающий сбрасывает закэшированные списки по популярности (invalidate).
+repair пересчитывает счетчики пачками по id квартир:
+
+    python -m app.services.listing_stats --batch-size 1000
+'''
+import argparse
+import asyncio
+import logging
+import typing
+
+from sqlalchemy import Integer, any_, bindparam, delete, exists, func, literal, select, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config
+from app.database import async_base, models
+from app.services.response_cache import RESPONSE_CACHE_INITIALIZER
+
+logger = logging.getLogger(__name__)
+
+# Тег кэша ответов для списков квартир, отсортированных по популярности
+POPULARITY_TAG = 'apartments:popularity'
+MAX_APARTMENT_IDS = 1000
+
+
+def _ids(apartment_ids: typing.Iterable[int]):
+    # Один и тот же порядок блокировок строк во всех транзакциях - без взаимных блокировок
+    return bindparam('apartment_ids', sorted(apartment_ids), type_=ARRAY(Integer))
+
+
+async def _increment(session: AsyncSession, column: str, apartment_ids: typing.Collection[int]):
+    if not apartment_ids:
+        return
+    # Строки может не быть (квартира из старых данных до repair) - создается с единицей
+    query = insert(models.ListingStats).from_select(
+        ['apartment_id', column], select(func.unnest(_ids(apartment_ids)), literal(1))
+    )
+    query = query.on_conflict_do_update(
+        index_elements=['apartment_id'],
+        set_={column: getattr(models.ListingStats, column) + query.excluded[column]}
+    )
+    await session.execute(query)
+
+
+async def _decrement(session: AsyncSession, column: str, apartment_ids: typing.Collection[int]):
+    if not apartment_ids:
+        return
+    counter = getattr(models.ListingStats, column)
+    await session.execute(
+        update(models.ListingStats)
+        .where(models.ListingStats.apartment_id == any_(_ids(apartment_ids)))
+        .values({column: func.greatest(counter - 1, 0)})
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def created(session: AsyncSession, apartment_id: int):
+    await session.execute(
+        insert(models.ListingStats).values(apartment_id=apartment_id).on_conflict_do_nothing()
+    )
+
+
+async def review_added(session: AsyncSession, apartment_id: int):
+    await _increment(session, 'review_count', [apartment_id])
+
+
+async def review_removed(session: AsyncSession, apartment_id: int):
+    await _decrement(session, 'review_count', [apartment_id])
+
+
+async def favorites_added(session: AsyncSession, apartment_ids: typing.Collection[int]):
+    await _increment(session, 'favorite_count', apartment_ids)
+
+
+async def favorites_removed(session: AsyncSession, apartment_ids: typing.Collection[int]):
+    await _decrement(session, 'favorite_count', apartment_ids)
+
+
+async def invalidate():
+    cache = RESPONSE_CACHE_INITIALIZER.cache
+    if cache is not None:
+        await cache.invalidate([POPULARITY_TAG])
+
+
+async def get_stats(session: AsyncSession, apartment_ids: typing.Sequence[int]) -> typing.List[dict]:
+    '''
+    Счетчики в порядке apartment_ids; для квартир без строки в listing_stats - нули
+    '''
+    query = select(
+        models.ListingStats.apartment_id, models.ListingStats.review_count, models.ListingStats.favorite_count
+    ).where(models.ListingStats.apartment_id == any_(_ids(set(apartment_ids))))
+    found = {row.apartment_id: row for row in (await session.execute(query)).all()}
+    return [
+        {
+            "apartment_id": apartment_id,
+            "review_count": found[apartment_id].review_count if apartment_id in found else 0,
+            "favorite_count": found[apartment_id].favorite_count if apartment_id in found else 0,
+        }
+        for apartment_id in apartment_ids
+    ]
+
+
+def _recount(first_id: int, last_id: int):
+    '''
+    Пересчет счетчиков квартир с id в (first_id, last_id]; обновляются только разошедшиеся строки
+    '''
+    apartment = models.Apartment
+    review_count = select(func.count()).where(models.Review.apartment_id == apartment.id).scalar_subquery()
+    favorite_count = select(func.count()).where(models.FavoriteItem.apartment_id == apartment.id).scalar_subquery()
+    query = insert(models.ListingStats).from_select(
+        ['apartment_id', 'review_count', 'favorite_count'],
+        select(apartment.id, review_count, favorite_count).where(apartment.id > first_id, apartment.id <= last_id)
+    )
+    stats = models.ListingStats
+    return query.on_conflict_do_update(
+        index_elements=['apartment_id'],
+        set_={"review_count": query.excluded.review_count, "favorite_count": query.excluded.favorite_count},
+        where=(stats.review_count != query.excluded.review_count)
+        | (stats.favorite_count != query.excluded.favorite_count)
+    ).returning(stats.apartment_id)
+
+
+async def repair(session: AsyncSession, batch_size: int = 1000) -> dict:
+    '''
+    Проходит квартиры пачками по batch_size (каждая - своя короткая транзакция) и чинит разошедшиеся счетчики,
+    затем удаляет строки удаленных квартир. Счет в пачке - снимок на момент запроса: изменение, закоммиченное
+    параллельно, может снова дать расхождение на единицу, его исправит следующий запуск
+    '''
+    repaired = checked = 0
+    last_id = 0
+    while True:
+        ids = (await session.execute(
+            select(models.Apartment.id).where(models.Apartment.id > last_id)
+            .order_by(models.Apartment.id).limit(batch_size)
+        )).scalars().all()
+        if not ids:
+            break
+        result = await session.execute(_recount(last_id, ids[-1]))
+        repaired += len(result.all())
+        await session.commit()
+        checked += len(ids)
+        last_id = ids[-1]
+
+    orphaned = await session.execute(
+        delete(models.ListingStats).where(
+            ~exists().where(models.Apartment.id == models.ListingStats.apartment_id)
+        )
+    )
+    await session.commit()
+    if repaired or orphaned.rowcount:
+        await invalidate()
+    logger.info(f'Listing stats: {checked} apartments checked, {repaired} repaired, {orphaned.rowcount} orphaned removed')
+    return {"checked": checked, "repaired": repaired, "orphaned": orphaned.rowcount}
+
+
+async def main(batch_size: int):
+    cfg = config.load_config()
+    await async_base.DB_INITIALIZER.init_db(str(cfg.POSTGRES_DSN_ASYNC), cfg)
+    try:
+        async with async_base.DB_INITIALIZER.async_session_maker() as session:
+            await repair(session, batch_size)
+    finally:
+        await async_base.DB_INITIALIZER.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=1000)
+    asyncio.run(main(parser.parse_args().batch_size))
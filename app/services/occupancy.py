@@ -0,0 +1,240 @@
+import asyncio
+import collections
+import datetime
+import logging
+import time
+import typing
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config
+from app.database import models
+
+logger = logging.getLogger(__name__)
+
+cfg: config.Config = config.load_config()
+
+# 366 дней года, упакованных по 8 в байт
+DAYS = 366
+ROW_BYTES = (DAYS + 7) // 8
+
+
+def _year_start(year: int) -> datetime.date:
+    return datetime.date(year, 1, 1)
+
+
+def _day_span(year: int, start_date: datetime.date, end_date: datetime.date) -> typing.Tuple[int, int]:
+    '''
+    Пересечение [start_date, end_date) с годом в номерах дней [first, last)
+    '''
+    first = max((start_date - _year_start(year)).days, 0)
+    last = min((end_date - _year_start(year)).days, DAYS)
+    return first, last
+
+
+def day_mask(first: int, last: int) -> np.ndarray:
+    days = np.zeros(DAYS, dtype=bool)
+    days[first:last] = True
+    return np.packbits(days)
+
+
+class YearBitmap():
+    '''
+    Занятость квартир за один год: битовая маска занятых дней на каждую квартиру с бронями в этом году.
+    apartment_id броней не обязан быть плотным (и существовать), поэтому строки нумеруются подряд:
+    rows - apartment_id -> номер строки в bits
+    '''
+    __slots__ = ('year', 'bits', 'rows', '_index', 'loaded_at')
+
+    def __init__(self, year: int, bits: np.ndarray, rows: typing.Dict[int, int]):
+        self.year = year
+        self.bits = bits
+        self.rows = rows
+        # (отсортированные apartment_id, их строки) для векторного поиска; None - пересобрать
+        self._index: typing.Optional[typing.Tuple[np.ndarray, np.ndarray]] = None
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def from_reservations(cls, year: int, apartment_ids, arrivals, departures) -> 'YearBitmap':
+        '''
+        Строит маски из массивов броней разностным массивом: +1 в день заезда, -1 в день выезда, cumsum по дням.
+        Брони одной квартиры не пересекаются (reservation_no_overlap), поэтому сумма остается 0 или 1
+        '''
+        ids, rows = np.unique(np.asarray(apartment_ids, dtype=np.int64), return_inverse=True)
+        diff = np.zeros((len(ids), DAYS + 1), dtype=np.int8)
+        np.add.at(diff, (rows, np.asarray(arrivals, dtype=np.int64)), 1)
+        np.add.at(diff, (rows, np.asarray(departures, dtype=np.int64)), -1)
+        occupied = np.cumsum(diff, axis=1, dtype=np.int8)[:, :DAYS] > 0
+        return cls(year, np.packbits(occupied, axis=1), dict(zip(ids.tolist(), range(len(ids)))))
+
+    def _row(self, apartment_id: int) -> int:
+        '''
+        Строка квартиры; новой квартире выделяется следующая, массив растет вдвое
+        '''
+        row = self.rows.get(apartment_id)
+        if row is None:
+            row = self.rows[apartment_id] = len(self.rows)
+            if row >= len(self.bits):
+                bits = np.zeros((max(row + 1, 2 * len(self.bits)), ROW_BYTES), dtype=np.uint8)
+                bits[:len(self.bits)] = self.bits
+                self.bits = bits
+            self._index = None
+        return row
+
+    def mark(self, apartment_id: int, first: int, last: int, occupied: bool):
+        row = self._row(apartment_id)
+        days = np.unpackbits(self.bits[row])[:DAYS].astype(bool)
+        days[first:last] = occupied
+        self.bits[row] = np.packbits(days)
+
+    def clear(self, apartment_id: int):
+        row = self.rows.get(apartment_id)
+        if row is not None:
+            self.bits[row] = 0
+
+    def _lookup(self, apartment_ids: np.ndarray) -> np.ndarray:
+        '''
+        Строки для apartment_ids, -1 - у квартиры нет броней в этом году
+        '''
+        if self._index is None:
+            ids = np.fromiter(self.rows.keys(), dtype=np.int64, count=len(self.rows))
+            rows = np.fromiter(self.rows.values(), dtype=np.int64, count=len(self.rows))
+            order = np.argsort(ids)
+            self._index = (ids[order], rows[order])
+        ids, rows = self._index
+        if not len(ids):
+            return np.full(len(apartment_ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(ids, apartment_ids), len(ids) - 1)
+        return np.where(ids[positions] == apartment_ids, rows[positions], -1)
+
+    def occupied(self, apartment_ids: np.ndarray, first: int, last: int) -> np.ndarray:
+        '''
+        Для каждой квартиры - есть ли занятый день в [first, last)
+        '''
+        result = np.zeros(len(apartment_ids), dtype=bool)
+        rows = self._lookup(apartment_ids)
+        known = rows >= 0
+        result[known] = (self.bits[rows[known]] & day_mask(first, last)).any(axis=1)
+        return result
+
+
+class OccupancyIndex():
+    '''
+    Битовые маски занятости по годам для пакетной проверки "какие из квартир свободны на даты".
+    Год загружается из базы при первом обращении и перечитывается раз в ttl (брони пишут и другие воркеры);
+    записи reservation_service применяются сразу, в том числе к году, который в этот момент загружается.
+    В памяти не больше max_years лет: при загрузке нового вытесняются устаревшие, затем самые давно загруженные
+    '''
+
+    def __init__(self, ttl: float, max_years: int):
+        self.ttl = ttl
+        self.max_years = max_years
+        self._years: typing.Dict[int, YearBitmap] = {}
+        self._locks: typing.Dict[int, asyncio.Lock] = collections.defaultdict(asyncio.Lock)
+        # Изменения, пришедшие во время загрузки года; проигрываются поверх загруженных данных
+        self._loading: typing.Dict[int, list] = {}
+
+    async def _load(self, session: AsyncSession, year: int) -> YearBitmap:
+        start, end = _year_start(year), _year_start(year + 1)
+        query = select(
+            models.Reservation.apartment_id, models.Reservation.arrival_date, models.Reservation.departure_date
+        ).filter(
+            models.Reservation.apartment_id.is_not(None),
+            models.Reservation.arrival_date < end,
+            models.Reservation.departure_date > start
+        )
+        rows = (await session.execute(query)).all()
+        spans = [_day_span(year, arrival, departure) for _, arrival, departure in rows]
+        return YearBitmap.from_reservations(
+            year, [row.apartment_id for row in rows], [s[0] for s in spans], [s[1] for s in spans]
+        )
+
+    async def year(self, session: AsyncSession, year: int) -> YearBitmap:
+        bitmap = self._years.get(year)
+        if bitmap is not None and time.monotonic() - bitmap.loaded_at < self.ttl:
+            return bitmap
+
+        async with self._locks[year]:
+            bitmap = self._years.get(year)
+            if bitmap is not None and time.monotonic() - bitmap.loaded_at < self.ttl:
+                return bitmap
+
+            self._loading[year] = []
+            try:
+                started = time.perf_counter()
+                bitmap = await self._load(session, year)
+                for method, args in self._loading[year]:
+                    method(bitmap, *args)
+            finally:
+                del self._loading[year]
+            logger.info(f'Occupancy for {year} loaded in {time.perf_counter() - started:.2f} s')
+            self._evict(year)
+            self._years[year] = bitmap
+            return bitmap
+
+    async def available(
+            self, session: AsyncSession, apartment_ids: typing.Sequence[int],
+            start_date: datetime.date, end_date: datetime.date
+    ) -> np.ndarray:
+        '''
+        Маска "квартира свободна на [start_date, end_date)" в порядке apartment_ids
+        '''
+        ids = np.asarray(apartment_ids, dtype=np.int64)
+        occupied = np.zeros(len(ids), dtype=bool)
+        for year in range(start_date.year, end_date.year + 1):
+            first, last = _day_span(year, start_date, end_date)
+            if first < last:
+                bitmap = await self.year(session, year)
+                occupied |= bitmap.occupied(ids, first, last)
+        return ~occupied
+
+    def _evict(self, year: int):
+        '''
+        Освобождает место под загруженный год
+        '''
+        self._years.pop(year, None)
+        now = time.monotonic()
+        for cached, bitmap in list(self._years.items()):
+            if now - bitmap.loaded_at >= self.ttl:
+                del self._years[cached]
+        while self._years and len(self._years) >= self.max_years:
+            del self._years[min(self._years, key=lambda cached: self._years[cached].loaded_at)]
+
+    def _apply(self, apartment_id, arrival_date, departure_date, occupied: bool):
+        if apartment_id is None or arrival_date is None or departure_date is None:
+            return
+        for year in range(arrival_date.year, departure_date.year + 1):
+            first, last = _day_span(year, arrival_date, departure_date)
+            if first >= last:
+                continue
+            if year in self._loading:
+                self._loading[year].append((YearBitmap.mark, (apartment_id, first, last, occupied)))
+            bitmap = self._years.get(year)
+            if bitmap is not None:
+                bitmap.mark(apartment_id, first, last, occupied)
+
+    def added(self, apartment_id, arrival_date, departure_date):
+        self._apply(apartment_id, arrival_date, departure_date, True)
+
+    def removed(self, apartment_id, arrival_date, departure_date):
+        self._apply(apartment_id, arrival_date, departure_date, False)
+
+    def cleared(self, apartment_id: int):
+        '''
+        Все брони квартиры удалены (удаление квартиры)
+        '''
+        for pending in self._loading.values():
+            pending.append((YearBitmap.clear, (apartment_id,)))
+        for bitmap in self._years.values():
+            bitmap.clear(apartment_id)
+
+    def stats(self) -> dict:
+        return {
+            "years": sorted(self._years),
+            "bytes": sum(bitmap.bits.nbytes for bitmap in self._years.values()),
+        }
+
+
+OCCUPANCY_INDEX = OccupancyIndex(cfg.OCCUPANCY_INDEX_TTL, cfg.OCCUPANCY_INDEX_YEARS)
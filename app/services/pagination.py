@@ -0,0 +1,43 @@
+import base64
+import json
+import typing
+
+from fastapi import HTTPException
+
+
+def encode_cursor(sort: str, values: typing.Sequence) -> str:
+    '''
+    Непрозрачный курсор: base64url от JSON с именем сортировки и значениями ключа последней строки
+    '''
+    payload = json.dumps({"s": sort, "v": list(values)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, types: typing.Sequence[type]) -> list:
+    '''
+    Разбирает курсор и проверяет, что он выдан для той же сортировки
+    '''
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        values = payload["v"]
+        if payload["s"] != sort or len(values) != len(types):
+            raise ValueError(cursor)
+        for value, value_type in zip(values, types):
+            if isinstance(value, bool) or not isinstance(value, (int, float) if value_type is float else value_type):
+                raise ValueError(cursor)
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def keyset_page(
+        rows: typing.Sequence, limit: int, sort: str, key: typing.Callable[[typing.Any], typing.Sequence]
+) -> typing.Tuple[list, typing.Optional[str]]:
+    '''
+    Принимает limit + 1 строк и возвращает страницу и курсор следующей страницы (None, если это последняя)
+    '''
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(sort, key(rows[-1]))
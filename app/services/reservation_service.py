@@ -1,43 +1,114 @@
 import datetime
-from typing import List, Tuple
-
-from app.api.schemas import ReservationCreate, ReservationUpdate
-from sqlalchemy.orm import Session
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from app.api.schemas import MAX_DB_ID, CountMode, ReservationCreate, ReservationUpdate
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import config
 from app.database import models
+from app.services import counting, pagination
+from app.services.availability_index import AVAILABILITY_INDEX
+from app.services.occupancy import OCCUPANCY_INDEX
+
+cfg: config.Config = config.load_config()
+
+# SQLSTATE exclusion_violation: ограничение reservation_no_overlap
+EXCLUSION_VIOLATION = '23P01'
+
+
+def overlapping_stay(start_date, end_date, bounds: str = '[)'):
+    '''
+    Условие "бронь пересекает диапазон дат" через &&, чтобы запрос шел по GiST индексу reservation_no_overlap
+    '''
+    return models.Reservation.stay.op('&&')(func.daterange(start_date, end_date, bounds))
+
+
+def _check_dates(item):
+    if item.arrival_date >= item.departure_date:
+        raise HTTPException(status_code=400, detail="arrival_date must be before departure_date")
+
 
-def get_reservation_items(db: Session, user_email: str, limit: int = 1, offset: int = 0):
-    total_items = db.query(models.Reservation) \
-        .filter(models.Reservation.email == user_email) \
-        .count()
+async def _check_apartment(session: AsyncSession, apartment_id: int):
+    '''
+    apartment_id брони - из запроса, внешнего ключа на apartments нет
+    '''
+    if not 0 < apartment_id <= MAX_DB_ID or await session.scalar(
+        select(models.Apartment.id).filter(models.Apartment.id == apartment_id)
+    ) is None:
+        raise HTTPException(status_code=404, detail="Apartment not found")
 
-    res = db.query(models.Reservation) \
-        .filter(models.Reservation.email == user_email) \
-        .offset(offset) \
-        .limit(limit) \
-        .all()
+
+async def _commit_booking(session: AsyncSession):
+    try:
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        if getattr(e.orig, 'sqlstate', None) == EXCLUSION_VIOLATION:
+            raise HTTPException(status_code=409, detail="Apartment is already booked for these dates")
+        raise
+
+
+async def get_reservation_items(
+        session: AsyncSession, user_email: str, limit: int = 1, offset: int = 0, cursor: Optional[str] = None,
+        count: Optional[CountMode] = None
+):
+    query = select(models.Reservation) \
+        .filter(models.Reservation.email == user_email)
+
+    total_items, total_mode = await counting.count_rows(
+        session, query, counting.resolve_count_mode(count, cursor)
+    )
+
+    if cursor is None:
+        query = query.offset(offset)
+    else:
+        last_id, = pagination.decode_cursor(cursor, 'id', (int,))
+        query = query.filter(models.Reservation.id > last_id)
+
+    result = await session.execute(query.order_by(models.Reservation.id).limit(limit + 1))
+    res, next_cursor = pagination.keyset_page(result.scalars().all(), limit, 'id', lambda item: (item.id,))
 
     return {
         "items": res,
         "total": total_items,
+        "total_mode": total_mode,
         "size": len(res),
+        "next_cursor": next_cursor,
     }
 
-def get_reservations_by_apartment(db: Session, apartment_id: int, start_date, end_date):
-    return db.query(models.Reservation).filter(
+
+async def get_reservations_by_apartment(session: AsyncSession, apartment_id: int, start_date, end_date):
+    '''
+    Брони с arrival_date <= end_date и departure_date >= start_date, то есть включая выезд ровно в start_date.
+    stay полуоткрыт ([arrival, departure)), поэтому для && по индексу диапазон начинается на день раньше
+    '''
+    query = select(models.Reservation).filter(
         models.Reservation.apartment_id == apartment_id,
-        models.Reservation.arrival_date <= end_date,
-        models.Reservation.departure_date >= start_date
-    ).all()
+        overlapping_stay(start_date - datetime.timedelta(days=1), end_date, '[]')
+    )
+    result = await session.execute(query)
+    return result.scalars().all()
 
 
-def get_reserved_periods_trimmed(
-    db: Session, apartment_id: int, start_date, end_date
-) -> List[Tuple[str, datetime.date, datetime.date]]:
-    reservations = db.query(models.Reservation).filter(
+async def query_overlapping_reservations(session: AsyncSession, apartment_id: int, start_date, end_date):
+    '''
+    Брони, пересекающие [start_date, end_date), напрямую из базы (в обход AVAILABILITY_INDEX)
+    '''
+    query = select(models.Reservation).filter(
         models.Reservation.apartment_id == apartment_id,
-        models.Reservation.arrival_date < end_date,
-        models.Reservation.departure_date > start_date
-    ).order_by(models.Reservation.arrival_date).all()
+        overlapping_stay(start_date, end_date)
+    ).order_by(models.Reservation.arrival_date)
+    result = await session.execute(query)
+    return result.scalars().all()
+
+
+async def get_reserved_periods_trimmed(
+    session: AsyncSession, apartment_id: int, start_date, end_date
+) -> List[Tuple[str, datetime.date, datetime.date]]:
+    bookings = await AVAILABILITY_INDEX.get(session, apartment_id)
+    reservations = bookings.overlapping(start_date, end_date)
 
     return [
         (
@@ -49,13 +120,37 @@ def get_reserved_periods_trimmed(
     ]
 
 
-def get_available_periods(db: Session, apartment_id: int, start_date, end_date) -> List[Tuple[datetime.date, datetime.date]]:
-    reservations = db.query(models.Reservation).filter(
-        models.Reservation.apartment_id == apartment_id,
-        models.Reservation.arrival_date < end_date,
-        models.Reservation.departure_date > start_date
-    ).order_by(models.Reservation.arrival_date).all()
+async def get_available_periods(
+    session: AsyncSession, apartment_id: int, start_date, end_date
+) -> List[Tuple[datetime.date, datetime.date]]:
+    bookings = await AVAILABILITY_INDEX.get(session, apartment_id)
+    return available_periods_between(bookings.overlapping(start_date, end_date), start_date, end_date)
 
+
+async def get_available_apartments(
+    session: AsyncSession, apartment_ids: List[int], start_date, end_date
+) -> dict:
+    '''
+    Какие из apartment_ids свободны на [start_date, end_date): одна векторная операция по битовым маскам
+    '''
+    if start_date >= end_date:
+        raise HTTPException(status_code=400, detail="start_date must be before end_date")
+    if (end_date - start_date).days > cfg.OCCUPANCY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"At most {cfg.OCCUPANCY_MAX_DAYS} days per request")
+    if len(apartment_ids) > cfg.OCCUPANCY_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {cfg.OCCUPANCY_BATCH_MAX} apartment_ids per request")
+
+    available = (await OCCUPANCY_INDEX.available(session, apartment_ids, start_date, end_date)).tolist()
+    return {
+        "available": [a for a, free in zip(apartment_ids, available) if free],
+        "booked": [a for a, free in zip(apartment_ids, available) if not free],
+    }
+
+
+def available_periods_between(reservations, start_date, end_date) -> List[Tuple[datetime.date, datetime.date]]:
+    '''
+    Свободные промежутки [start_date, end_date) между бронями, отсортированными по дате заезда
+    '''
     available_periods = []
     current_start = start_date
 
@@ -70,38 +165,60 @@ def get_available_periods(db: Session, apartment_id: int, start_date, end_date)
     return available_periods
 
 
-
-def get_reservation_item(db: Session, item_id: int):
-    return db.query(models.Reservation) \
+async def get_reservation_item(session: AsyncSession, item_id: int):
+    query = select(models.Reservation) \
         .filter(models.Reservation.id == item_id) \
-        .first()
-
+        .limit(1)
+    result = await session.execute(query)
+    return result.scalars().one_or_none()
 
-async def add_reservation_item(db: Session, item: ReservationCreate):
 
+async def add_reservation_item(session: AsyncSession, item: ReservationCreate):
+    _check_dates(item)
+    await _check_apartment(session, item.apartment_id)
     db_item = models.Reservation(**item.model_dump())
 
-    db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
+    session.add(db_item)
+    await _commit_booking(session)
+    await session.refresh(db_item)
+    AVAILABILITY_INDEX.added(db_item)
+    OCCUPANCY_INDEX.added(db_item.apartment_id, db_item.arrival_date, db_item.departure_date)
 
     return db_item
 
 
-def update_reservation_item(db: Session, item_id: int, updated_item: ReservationUpdate):
-    result = db.query(models.Reservation) \
-        .filter(models.Reservation.id == item_id) \
-        .update(updated_item.dict())
-    db.commit()
-
-    if result == 1:
+async def update_reservation_item(session: AsyncSession, item_id: int, updated_item: ReservationUpdate):
+    _check_dates(updated_item)
+    await _check_apartment(session, updated_item.apartment_id)
+    old = (await session.execute(
+        select(models.Reservation.apartment_id, models.Reservation.arrival_date, models.Reservation.departure_date)
+        .filter(models.Reservation.id == item_id)
+    )).one_or_none()
+    result = await session.execute(
+        update(models.Reservation)
+        .where(models.Reservation.id == item_id)
+        .values(**updated_item.model_dump(), version=models.Reservation.version + 1)
+    )
+    await _commit_booking(session)
+
+    if result.rowcount == 1:
+        AVAILABILITY_INDEX.invalidate(old.apartment_id)
+        AVAILABILITY_INDEX.invalidate(updated_item.apartment_id)
+        OCCUPANCY_INDEX.removed(*old)
+        OCCUPANCY_INDEX.added(updated_item.apartment_id, updated_item.arrival_date, updated_item.departure_date)
         return updated_item
     return None
 
 
-def delete_reservation_item(db: Session, item_id: int):
-    result = db.query(models.Reservation) \
-        .filter(models.Reservation.id == item_id) \
-        .delete()
-    db.commit()
-    return result == 1
+async def delete_reservation_item(session: AsyncSession, item_id: int):
+    result = await session.execute(
+        delete(models.Reservation)
+        .filter(models.Reservation.id == item_id)
+        .returning(models.Reservation.apartment_id, models.Reservation.arrival_date, models.Reservation.departure_date)
+    )
+    deleted = result.all()
+    await session.commit()
+    for row in deleted:
+        AVAILABILITY_INDEX.removed(row.apartment_id, item_id)
+        OCCUPANCY_INDEX.removed(*row)
+    return len(deleted) == 1
@@ -0,0 +1,193 @@
+'''
+Read-through кэш готовых ответов (JSON) в два уровня: in-process LRU и, опционально, общий Redis.
+Записи помечаются тегами (квартира, ячейка гео-сетки); запись в базу отмечает время инвалидации тега,
+и все ответы с этим тегом, собранные раньше, перестают считаться валидными
+'''
+import collections
+import json
+import logging
+import time
+import typing
+
+from app import config
+from app.cache import LRUCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+
+class KeyValueClient(typing.Protocol):
+    '''
+    Подмножество команд Redis, которым пользуется кэш (redis.asyncio.Redis совместим)
+    '''
+
+    async def get(self, key: str) -> typing.Optional[bytes]:
+        ...
+
+    async def set(self, key: str, value: bytes, ex: typing.Optional[int] = None) -> typing.Any:
+        ...
+
+    async def mget(self, keys: typing.Sequence[str]) -> typing.List[typing.Optional[bytes]]:
+        ...
+
+    async def aclose(self) -> None:
+        ...
+
+
+def connect_shared_tier(url: str) -> typing.Optional[KeyValueClient]:
+    if not url:
+        return None
+    try:
+        import redis.asyncio
+    except ImportError as e:
+        raise RuntimeError('RESPONSE_CACHE_REDIS_URL requires the redis package') from e
+    return redis.asyncio.from_url(url)
+
+
+class ResponseCache():
+    '''
+    Ответ ищется в локальном LRU, затем в общем уровне. Каждый тег хранит время последней инвалидации;
+    запись валидна, если собиралась (началась загрузка) позже инвалидации всех своих тегов.
+    Время инвалидации в локальном уровне знает только этот процесс, поэтому локальные записи живут
+    не дольше local_ttl - за это время изменения из других воркеров доходят через общий уровень
+    '''
+
+    def __init__(
+            self, maxsize: int, local_ttl: float, shared_ttl: int,
+            shared: typing.Optional[KeyValueClient] = None, prefix: str = 'rc'
+    ):
+        self.local = LRUCache(maxsize)
+        self.local_ttl = local_ttl
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self.prefix = prefix
+        self._invalidated: typing.Dict[str, float] = {}
+        self.stats_counters = collections.Counter()
+
+    def _entry_key(self, key: str) -> str:
+        return f'{self.prefix}:entry:{key}'
+
+    def _tag_key(self, tag: str) -> str:
+        return f'{self.prefix}:tag:{tag}'
+
+    def _fresh_locally(self, tags: typing.Iterable[str], created_at: float) -> bool:
+        return all(self._invalidated.get(tag, 0.0) < created_at for tag in tags)
+
+    async def _fresh_shared(self, tags: typing.List[str], created_at: float) -> bool:
+        values = await self.shared.mget([self._tag_key(tag) for tag in tags]) if tags else []
+        return all(float(value or 0) < created_at for value in values)
+
+    async def get(self, key: str):
+        entry = self.local.get(key)
+        if entry is not MISSING:
+            value, tags, created_at = entry
+            if self._fresh_locally(tags, created_at):
+                self.stats_counters['local_hits'] += 1
+                return value
+            self.stats_counters['stale'] += 1
+
+        if self.shared is not None:
+            try:
+                raw = await self.shared.get(self._entry_key(key))
+                if raw is not None:
+                    entry = json.loads(raw)
+                    if self._fresh_locally(entry['tags'], entry['created_at']) and \
+                            await self._fresh_shared(entry['tags'], entry['created_at']):
+                        self.stats_counters['shared_hits'] += 1
+                        self.local.set(key, (entry['value'], entry['tags'], entry['created_at']), self.local_ttl)
+                        return entry['value']
+                    self.stats_counters['stale'] += 1
+            except Exception as e:
+                self.stats_counters['errors'] += 1
+                logger.warning(f'Shared response cache read failed: {e!r}')
+
+        self.stats_counters['misses'] += 1
+        return MISSING
+
+    async def set(self, key: str, value, tags: typing.Iterable[str], created_at: float):
+        '''
+        created_at - время начала загрузки ответа из базы: инвалидация, пришедшая во время загрузки,
+        делает запись устаревшей сразу
+        '''
+        tags = list(tags)
+        if not self._fresh_locally(tags, created_at):
+            return
+        self.local.set(key, (value, tags, created_at), self.local_ttl)
+        if self.shared is not None:
+            try:
+                entry = {"tags": tags, "created_at": created_at, "value": value}
+                await self.shared.set(self._entry_key(key), json.dumps(entry), ex=self.shared_ttl)
+            except Exception as e:
+                self.stats_counters['errors'] += 1
+                logger.warning(f'Shared response cache write failed: {e!r}')
+
+    async def read_through(
+            self, key: str, load: typing.Callable[[], typing.Awaitable[typing.Tuple[typing.Any, typing.Iterable[str]]]]
+    ):
+        '''
+        load() возвращает (ответ, теги). Ответ None не кэшируется
+        '''
+        value = await self.get(key)
+        if value is not MISSING:
+            return value
+
+        created_at = time.time()
+        value, tags = await load()
+        if value is not None:
+            await self.set(key, value, tags, created_at)
+        return value
+
+    async def invalidate(self, tags: typing.Iterable[str]):
+        now = time.time()
+        if len(self._invalidated) > self.local.maxsize:
+            # Старше local_ttl отметки не нужны: локальных записей, собранных до них, уже нет,
+            # а общий уровень проверяется по своим отметкам
+            self._invalidated = {
+                tag: invalidated_at for tag, invalidated_at in self._invalidated.items()
+                if invalidated_at > now - self.local_ttl
+            }
+        for tag in set(tags):
+            self._invalidated[tag] = now
+            self.stats_counters['invalidations'] += 1
+            if self.shared is not None:
+                try:
+                    await self.shared.set(self._tag_key(tag), repr(now), ex=self.shared_ttl)
+                except Exception as e:
+                    self.stats_counters['errors'] += 1
+                    logger.warning(f'Shared response cache invalidation failed: {e!r}')
+
+    def stats(self) -> dict:
+        hits = self.stats_counters['local_hits'] + self.stats_counters['shared_hits']
+        lookups = hits + self.stats_counters['misses']
+        return {
+            **{name: self.stats_counters[name] for name in (
+                'local_hits', 'shared_hits', 'misses', 'stale', 'invalidations', 'errors'
+            )},
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "local_entries": len(self.local),
+            "shared": self.shared is not None,
+        }
+
+    async def close(self):
+        if self.shared is not None:
+            await self.shared.aclose()
+
+
+class Response_Cache_Initializer():
+    def __init__(self):
+        self.cache: typing.Optional[ResponseCache] = None
+
+    def init_cache(self, cfg: config.Config):
+        if not cfg.RESPONSE_CACHE_ENABLED:
+            return
+        shared = connect_shared_tier(cfg.RESPONSE_CACHE_REDIS_URL)
+        self.cache = ResponseCache(
+            cfg.RESPONSE_CACHE_SIZE, cfg.RESPONSE_CACHE_LOCAL_TTL, cfg.RESPONSE_CACHE_TTL, shared
+        )
+
+    async def close(self):
+        if self.cache is not None:
+            await self.cache.close()
+            self.cache = None
+
+
+RESPONSE_CACHE_INITIALIZER = Response_Cache_Initializer()
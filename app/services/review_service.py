@@ -1,70 +1,100 @@
 from starlette.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.schemas import ReviewUpdate, ReviewCreate
 from app.database import models
+from app.services import apartment_service, listing_stats, pagination
 from typing import Optional
 from app import config
 
 cfg: config.Config = config.load_config()
 
 
-async def fetch_apartment_email(db: Session, apartment_id: int):
-    return db.query(models.Apartment) \
+async def fetch_apartment_email(session: AsyncSession, apartment_id: int):
+    query = select(models.Apartment) \
         .filter(models.Apartment.id == apartment_id) \
-        .first()
+        .limit(1)
+    result = await session.execute(query)
+    return result.scalars().one_or_none()
 
 
-def get_reviews_by_apartment_id(db: Session, apartment_id: int, skip: int = 0, limit: int = 10):
-    return db.query(models.Review) \
-        .filter(models.Review.apartment_id == apartment_id) \
-        .offset(skip).limit(limit).all()
+async def get_reviews_by_apartment_id(
+        session: AsyncSession, apartment_id: int, skip: int = 0, limit: int = 10, cursor: Optional[str] = None
+):
+    query = select(models.Review) \
+        .filter(models.Review.apartment_id == apartment_id)
 
+    if cursor is None:
+        query = query.offset(skip)
+    else:
+        last_id, = pagination.decode_cursor(cursor, 'id', (int,))
+        query = query.filter(models.Review.id > last_id)
 
-def get_review_by_uid(db: Session, uid: int) -> Optional[models.Review]:
-    return db.query(models.Review).filter(models.Review.id == uid).first()
+    result = await session.execute(query.order_by(models.Review.id).limit(limit + 1))
+    res, next_cursor = pagination.keyset_page(result.scalars().all(), limit, 'id', lambda item: (item.id,))
 
+    return {
+        "items": res,
+        "next_cursor": next_cursor,
+    }
 
-def update_review_by_uid(db: Session, uid: int, review_update: ReviewUpdate):
-    review = db.query(models.Review).filter(models.Review.id == uid).first()
+
+async def get_review_by_uid(session: AsyncSession, uid: int) -> Optional[models.Review]:
+    query = select(models.Review).filter(models.Review.id == uid).limit(1)
+    result = await session.execute(query)
+    return result.scalars().one_or_none()
+
+
+async def update_review_by_uid(session: AsyncSession, uid: int, review_update: ReviewUpdate):
+    review = await get_review_by_uid(session, uid)
 
     if review is None:
         return None
 
     review.title = review_update.title
     review.description = review_update.description
+    review.version = models.Review.version + 1
 
-    db.commit()
-    db.refresh(review)
+    await session.commit()
+    await session.refresh(review)
+    await apartment_service.invalidate_search()
     return review
 
 
-def remove_review_by_uid(db: Session, uid: int):
-    review = db.query(models.Review).filter(models.Review.id == uid).first()
+async def remove_review_by_uid(session: AsyncSession, uid: int):
+    review = await get_review_by_uid(session, uid)
 
     if review is None:
         return JSONResponse(status_code=404, content={"message": "review not found"})
 
-    db.delete(review)
-    db.commit()
+    await session.delete(review)
+    await listing_stats.review_removed(session, review.apartment_id)
+    await session.commit()
+    await listing_stats.invalidate()
+    await apartment_service.invalidate_search()
     return JSONResponse(status_code=200, content={"message": "Deleted"})
 
 
-async def add_review(db: Session, review: ReviewCreate):
-    existing_review = db.query(models.Review).filter(
+async def add_review(session: AsyncSession, review: ReviewCreate):
+    query = select(models.Review).filter(
         models.Review.apartment_id == review.apartment_id,
         models.Review.user_email == review.user_email
-    ).first()
+    ).limit(1)
+    existing_review = (await session.execute(query)).scalars().one_or_none()
 
     if existing_review:
         return None
 
-    apartment = await fetch_apartment_email(db, review.apartment_id)
+    apartment = await fetch_apartment_email(session, review.apartment_id)
     if not apartment:
         return JSONResponse(status_code=404, content={"message": "apartment not found"})
 
     new_review = models.Review(**review.model_dump())
-    db.add(new_review)
-    db.commit()
-    db.refresh(new_review)
-    return new_review
\ No newline at end of file
+    session.add(new_review)
+    await listing_stats.review_added(session, review.apartment_id)
+    await session.commit()
+    await session.refresh(new_review)
+    await listing_stats.invalidate()
+    await apartment_service.invalidate_search()
+    return new_review
@@ -0,0 +1,88 @@
+'''
+Бенчмарк offline геокодера: скорость поиска и resident memory на синтетическом
+GeoNames-style наборе.
+
+    python -m benchmarks.gazetteer_bench --cities 200000
+'''
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+
+from app.geocoding.gazetteer import GazetteerIndex
+
+
+def rss_mb() -> float:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def random_name(rnd: random.Random) -> str:
+    words = rnd.randint(1, 3)
+    return ' '.join(
+        rnd.choice(string.ascii_uppercase) + ''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(3, 10)))
+        for _ in range(words)
+    )
+
+
+def write_tsv(path: str, cities: int, rnd: random.Random) -> list:
+    names = []
+    with open(path, 'w', encoding='utf-8') as f:
+        for geoname_id in range(cities):
+            name = random_name(rnd)
+            names.append(name)
+            row = [''] * 19
+            row[0] = str(geoname_id)
+            row[1] = row[2] = name
+            row[4] = f'{rnd.uniform(-90, 90):.5f}'
+            row[5] = f'{rnd.uniform(-180, 180):.5f}'
+            row[6] = 'P'
+            row[14] = str(rnd.randint(0, 10_000_000))
+            f.write('\t'.join(row) + '\n')
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cities', type=int, default=200_000)
+    parser.add_argument('--lookups', type=int, default=500_000)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        tsv_path = os.path.join(tmp, 'cities.tsv')
+        names = write_tsv(tsv_path, args.cities, rnd)
+
+        started = time.perf_counter()
+        index = GazetteerIndex.open(tsv_path)
+        print(f'index build:      {time.perf_counter() - started:.2f} s, {len(index)} keys, '
+              f'{os.path.getsize(tsv_path + ".idx") / 2 ** 20:.1f} MB on disk')
+
+        queries = [rnd.choice(names).lower() for _ in range(args.lookups)]
+        rss_before = rss_mb()
+
+        started = time.perf_counter()
+        for query in queries:
+            index.lookup(query)
+        elapsed = time.perf_counter() - started
+        print(f'exact lookup:     {args.lookups / elapsed:,.0f} lookups/s')
+
+        prefixes = [q[:3] for q in queries[:50_000]]
+        started = time.perf_counter()
+        for prefix in prefixes:
+            index.prefix(prefix, limit=10)
+        elapsed = time.perf_counter() - started
+        print(f'prefix lookup:    {len(prefixes) / elapsed:,.0f} lookups/s')
+
+        print(f'RSS:              {rss_mb():.1f} MB (index pages touched after load: '
+              f'{rss_mb() - rss_before:+.1f} MB)')
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+'''
+Бенчмарк пакетной проверки занятости: битовые маски OccupancyIndex на 100k квартир x 365 дней.
+Измеряются построение года из броней и запросы "какие из N квартир свободны на даты" против
+построчной проверки через ApartmentBookings.overlapping (как в /get_available_periods).
+
+    python -m benchmarks.occupancy_bench --apartments 100000 --batch 500
+'''
+import argparse
+import datetime
+import random
+import statistics
+import time
+
+import numpy as np
+
+from app.services.availability_index import ApartmentBookings, Booking
+from app.services.occupancy import YearBitmap, _day_span
+
+YEAR = 2026
+YEAR_START = datetime.date(YEAR, 1, 1)
+
+
+def synthetic_year(rnd: random.Random, apartments: int, occupancy: float):
+    '''
+    Брони без пересечений: чередование свободных и занятых отрезков, доля занятых дней ~ occupancy
+    '''
+    bookings = {}
+    for apartment_id in range(1, apartments + 1):
+        day, rows = 0, []
+        while True:
+            day += int(rnd.expovariate(occupancy / (1 - occupancy) / 4)) + 1
+            length = rnd.randint(1, 7)
+            if day + length > 365:
+                break
+            rows.append((day, day + length))
+            day += length
+        bookings[apartment_id] = rows
+    return bookings
+
+
+def report(label: str, timings, batch: int):
+    print(f'{label:<10} p50 {statistics.median(timings) * 1e3:8.3f} ms   '
+          f'p99 {statistics.quantiles(timings, n=100)[98] * 1e3:8.3f} ms   '
+          f'{batch * len(timings) / sum(timings):,.0f} apartments/s')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--apartments', type=int, default=100000)
+    parser.add_argument('--occupancy', type=float, default=0.5, help='доля занятых дней')
+    parser.add_argument('--batch', type=int, default=500, help='квартир в одном запросе')
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    bookings = synthetic_year(rnd, args.apartments, args.occupancy)
+    ids, arrivals, departures = [], [], []
+    for apartment_id, rows in bookings.items():
+        for arrival, departure in rows:
+            ids.append(apartment_id)
+            arrivals.append(arrival)
+            departures.append(departure)
+    print(f'{args.apartments} apartments, {len(ids)} bookings')
+
+    started = time.perf_counter()
+    bitmap = YearBitmap.from_reservations(YEAR, ids, arrivals, departures)
+    print(f'build      {time.perf_counter() - started:.2f} s, {bitmap.bits.nbytes / 2 ** 20:.1f} MiB')
+
+    entries = {
+        a: ApartmentBookings(
+            Booking(YEAR_START + datetime.timedelta(days=s), YEAR_START + datetime.timedelta(days=e), '', i)
+            for i, (s, e) in enumerate(rows)
+        )
+        for a, rows in bookings.items()
+    }
+
+    queries = []
+    for _ in range(args.queries):
+        start = YEAR_START + datetime.timedelta(days=rnd.randint(0, 350))
+        end = start + datetime.timedelta(days=rnd.randint(1, 14))
+        queries.append((np.array(rnd.sample(range(1, args.apartments + 1), args.batch)), start, end))
+
+    bitmap_timings, bitmap_results = [], []
+    for apartment_ids, start, end in queries:
+        started = time.perf_counter()
+        free = ~bitmap.occupied(apartment_ids, *_day_span(YEAR, start, end))
+        bitmap_timings.append(time.perf_counter() - started)
+        bitmap_results.append(free)
+    report('bitmap', bitmap_timings, args.batch)
+
+    index_timings = []
+    for (apartment_ids, start, end), expected in zip(queries, bitmap_results):
+        started = time.perf_counter()
+        free = [not entries[a].overlapping(start, end) for a in apartment_ids.tolist()]
+        index_timings.append(time.perf_counter() - started)
+        assert free == expected.tolist(), 'bitmap and per-apartment index disagree'
+    report('per-row', index_timings, args.batch)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""generated tsvector columns with GIN indexes on apartments and review
+
+Revision ID: 3b8e5a1c7d94
+Revises: 7c2f4e8d9a61
+Create Date: 2026-10-18 17:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b8e5a1c7d94'
+down_revision: Union[str, None] = '7c2f4e8d9a61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Выражения совпадают с models.search_vector; менять только новой миграцией
+SEARCH = {
+    'apartments': (
+        "setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(address, '')), 'B')"
+    ),
+    'review': (
+        "setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(description, '')), 'B')"
+    ),
+}
+INDEXES = {'apartments': 'ix_apartments_search', 'review': 'ix_review_search'}
+
+
+def upgrade() -> None:
+    for table, expression in SEARCH.items():
+        # Добавление STORED колонки переписывает таблицу
+        op.add_column(table, sa.Column('search', postgresql.TSVECTOR(), sa.Computed(expression, persisted=True)))
+        op.create_index(INDEXES[table], table, ['search'], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    for table in SEARCH:
+        op.drop_index(INDEXES[table], table_name=table)
+        op.drop_column(table, 'search')
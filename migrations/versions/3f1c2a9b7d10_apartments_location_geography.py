@@ -0,0 +1,39 @@
+"""apartments.location as geography with GiST index
+
+Revision ID: 3f1c2a9b7d10
+Revises: 
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2a9b7d10'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+    op.execute("DROP INDEX IF EXISTS idx_apartments_location")
+    # Старые строки хранили POINT(lat lon), поэтому точка пересчитывается из latitude/longitude
+    op.execute(
+        "ALTER TABLE apartments ALTER COLUMN location TYPE geography(POINT, 4326) "
+        "USING ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography"
+    )
+    op.execute("CREATE INDEX idx_apartments_location ON apartments USING gist (location)")
+    op.execute("ANALYZE apartments")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS idx_apartments_location")
+    op.execute(
+        "ALTER TABLE apartments ALTER COLUMN location TYPE geometry(POINT, 4326) "
+        "USING ST_SetSRID(ST_MakePoint(latitude, longitude), 4326)"
+    )
+    op.execute("CREATE INDEX idx_apartments_location ON apartments USING gist (location)")
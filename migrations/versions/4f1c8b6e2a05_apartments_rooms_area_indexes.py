@@ -0,0 +1,38 @@
+"""Indexes for rooms/area range filters and sorts on apartments
+
+Revision ID: 4f1c8b6e2a05
+Revises: 9e6a2d4b8c13
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f1c8b6e2a05'
+down_revision: Union[str, None] = '9e6a2d4b8c13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = ('rooms', 'area')
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    op.create_index(
+        'ix_apartments_location_rooms_area', 'apartments', ['location', 'rooms', 'area'], postgresql_using='gist'
+    )
+    for column in COLUMNS:
+        op.create_index(
+            f'ix_apartments_{column}_id', 'apartments', [column, 'id'],
+            postgresql_where=sa.text(f'{column} IS NOT NULL')
+        )
+
+
+def downgrade() -> None:
+    for column in COLUMNS:
+        op.drop_index(f'ix_apartments_{column}_id', table_name='apartments')
+    op.drop_index('ix_apartments_location_rooms_area', table_name='apartments')
@@ -0,0 +1,34 @@
+"""version and updated_at on apartments, reservation and review for conditional GETs
+
+Revision ID: 5d9e1f3a7c22
+Revises: c72a5e90d4b1
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d9e1f3a7c22'
+down_revision: Union[str, None] = 'c72a5e90d4b1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ('apartments', 'reservation', 'review')
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        op.add_column(table, sa.Column('version', sa.Integer(), nullable=False, server_default=sa.text('1')))
+        op.add_column(table, sa.Column(
+            'updated_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()
+        ))
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.drop_column(table, 'updated_at')
+        op.drop_column(table, 'version')
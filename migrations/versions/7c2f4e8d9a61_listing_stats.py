@@ -0,0 +1,45 @@
+"""listing_stats counters, apartment_id indexes on review and favorite_items
+
+Revision ID: 7c2f4e8d9a61
+Revises: a93d0f6e1b27
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2f4e8d9a61'
+down_revision: Union[str, None] = 'a93d0f6e1b27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_review_apartment_id', 'review', ['apartment_id'])
+    op.create_index('ix_favorite_items_apartment_id', 'favorite_items', ['apartment_id'])
+    op.create_table(
+        'listing_stats',
+        sa.Column('apartment_id', sa.Integer(), primary_key=True),
+        sa.Column('review_count', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('favorite_count', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('popularity', sa.Integer(), sa.Computed('review_count + favorite_count', persisted=True)),
+    )
+    op.execute(
+        "INSERT INTO listing_stats (apartment_id, review_count, favorite_count) "
+        "SELECT a.id, "
+        "(SELECT count(*) FROM review r WHERE r.apartment_id = a.id), "
+        "(SELECT count(*) FROM favorite_items f WHERE f.apartment_id = a.id) "
+        "FROM apartments a"
+    )
+    op.create_index('ix_listing_stats_popularity', 'listing_stats', ['popularity', 'apartment_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_listing_stats_popularity', table_name='listing_stats')
+    op.drop_table('listing_stats')
+    op.drop_index('ix_favorite_items_apartment_id', table_name='favorite_items')
+    op.drop_index('ix_review_apartment_id', table_name='review')
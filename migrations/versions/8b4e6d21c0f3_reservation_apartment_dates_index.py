@@ -0,0 +1,30 @@
+"""reservation (apartment_id, arrival_date, departure_date) index
+
+Revision ID: 8b4e6d21c0f3
+Revises: 3f1c2a9b7d10
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b4e6d21c0f3'
+down_revision: Union[str, None] = '3f1c2a9b7d10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_reservation_apartment_dates', 'reservation',
+        ['apartment_id', 'arrival_date', 'departure_date'],
+        if_not_exists=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_reservation_apartment_dates', table_name='reservation', if_exists=True)
@@ -0,0 +1,33 @@
+"""pg_trgm GIN indexes on apartments.address and title for autocomplete
+
+Revision ID: 9e6a2d4b8c13
+Revises: 3b8e5a1c7d94
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e6a2d4b8c13'
+down_revision: Union[str, None] = '3b8e5a1c7d94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = ('address', 'title')
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for column in COLUMNS:
+        op.create_index(
+            f'ix_apartments_{column}_trgm', 'apartments', [column],
+            postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'}
+        )
+
+
+def downgrade() -> None:
+    for column in COLUMNS:
+        op.drop_index(f'ix_apartments_{column}_trgm', table_name='apartments')
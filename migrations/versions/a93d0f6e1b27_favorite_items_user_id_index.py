@@ -0,0 +1,25 @@
+"""(user_email, id) index on favorite_items for keyset pages by recency
+
+Revision ID: a93d0f6e1b27
+Revises: e41b7c9a2f58
+Create Date: 2026-10-18 16:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a93d0f6e1b27'
+down_revision: Union[str, None] = 'e41b7c9a2f58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_favorite_items_user_id', 'favorite_items', ['user_email', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_favorite_items_user_id', table_name='favorite_items')
@@ -0,0 +1,38 @@
+"""reservation.stay daterange with exclusion constraint against double booking
+
+Revision ID: c72a5e90d4b1
+Revises: 8b4e6d21c0f3
+Create Date: 2026-10-18 13:00:00.000000
+
+Уже существующие пересекающиеся брони нужно разрешить вручную до применения ревизии,
+иначе ADD CONSTRAINT завершится ошибкой.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c72a5e90d4b1'
+down_revision: Union[str, None] = '8b4e6d21c0f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    op.execute(
+        "ALTER TABLE reservation ADD COLUMN IF NOT EXISTS stay daterange "
+        "GENERATED ALWAYS AS (daterange(arrival_date, departure_date, '[)')) STORED"
+    )
+    op.execute(
+        "ALTER TABLE reservation ADD CONSTRAINT reservation_no_overlap "
+        "EXCLUDE USING gist (apartment_id WITH =, stay WITH &&)"
+    )
+    op.execute("ANALYZE reservation")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE reservation DROP CONSTRAINT IF EXISTS reservation_no_overlap")
+    op.execute("ALTER TABLE reservation DROP COLUMN IF EXISTS stay")
@@ -0,0 +1,32 @@
+"""unique (user_email, apartment_id) on favorite_items for ON CONFLICT DO NOTHING
+
+Revision ID: e41b7c9a2f58
+Revises: 5d9e1f3a7c22
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41b7c9a2f58'
+down_revision: Union[str, None] = '5d9e1f3a7c22'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Дубли могли появиться при гонке SELECT + INSERT в старом add_favorite_item; оставляем самую раннюю запись
+    op.execute(
+        "DELETE FROM favorite_items a USING favorite_items b "
+        "WHERE a.user_email = b.user_email AND a.apartment_id = b.apartment_id AND a.id > b.id"
+    )
+    op.create_index(
+        'ux_favorite_items_user_apartment', 'favorite_items', ['user_email', 'apartment_id'], unique=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ux_favorite_items_user_apartment', table_name='favorite_items')
@@ -0,0 +1,85 @@
+'''
+Планы GET /apartments с фильтрами rooms/area: запросы строятся apartment_service.build_apartments_query,
+для каждого делается EXPLAIN и проверяется, что apartments читается нужным индексом, а не Seq Scan.
+Таблица apartments заполняется как в benchmarks.geo_search_bench до TEST_EXPLAIN_ROWS строк
+'''
+import asyncio
+import json
+import os
+
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects import postgresql
+
+from app.api.schemas import ApartmentsQuery
+from app.database import async_base
+from app.services import apartment_service, pagination
+from benchmarks.geo_search_bench import populate
+
+# На маленькой таблице планировщик выбирает Seq Scan, поэтому строк нужно много
+ROWS = int(os.environ.get('TEST_EXPLAIN_ROWS', 200_000))
+SPATIAL_INDEXES = {'ix_apartments_location_rooms_area', 'idx_apartments_location'}
+POINT = {"latitude": 55.75, "longitude": 37.61}
+
+# (название, параметры запроса, что объяснять: страницу или подсчет total, допустимые индексы)
+CHECKS = [
+    ('radius + rooms/area', dict(POINT, radius=50000, min_rooms=3, max_area=60), 'page', SPATIAL_INDEXES),
+    ('nearest + rooms', dict(POINT, min_rooms=4, max_rooms=4), 'page', SPATIAL_INDEXES),
+    ('sort=area', dict(sort='area', min_area=100), 'page', {'ix_apartments_area_id'}),
+    ('sort=-area cursor', dict(sort='-area', cursor=pagination.encode_cursor('-area', [120, 10 ** 6])), 'page',
+     {'ix_apartments_area_id'}),
+    ('sort=-rooms', dict(sort='-rooms', max_rooms=2), 'page', {'ix_apartments_rooms_id'}),
+    ('total area range', dict(min_area=160, max_area=165), 'count', {'ix_apartments_area_id'}),
+    ('total rooms + area', dict(min_rooms=5, min_area=160), 'count', {'ix_apartments_area_id', 'ix_apartments_rooms_id'}),
+]
+
+
+def _plan_nodes(node: dict):
+    yield node
+    for child in node.get('Plans', ()):
+        yield from _plan_nodes(child)
+
+
+async def _explain(session, statement) -> list:
+    sql = str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    plan = (await session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))).scalar()
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return list(_plan_nodes(plan[0]['Plan']))
+
+
+async def _explain_checks(dsn: str) -> dict:
+    await async_base.DB_INITIALIZER.init_db(dsn)
+    try:
+        await populate(ROWS)
+        plans = {}
+        async with async_base.DB_INITIALIZER.async_session_maker() as session:
+            for label, params, target, _ in CHECKS:
+                _, count_query, query, _, _ = await apartment_service.build_apartments_query(
+                    ApartmentsQuery(**{"city_name": None, "latitude": None, "longitude": None, "radius": None,
+                                       "limit": 20, **params})
+                )
+                if target == 'count':
+                    query = select(func.count()).select_from(count_query.subquery())
+                plans[label] = await _explain(session, query)
+        return plans
+    finally:
+        await async_base.DB_INITIALIZER.close()
+
+
+@pytest.fixture(scope='module')
+def plans(postgres_dsn) -> dict:
+    '''
+    Планы всех CHECKS: таблица заполняется один раз на модуль
+    '''
+    return asyncio.run(_explain_checks(postgres_dsn))
+
+
+@pytest.mark.parametrize('label, expected', [(label, expected) for label, _, _, expected in CHECKS])
+def test_apartments_query_uses_index(plans, label, expected):
+    nodes = plans[label]
+    used = {node['Index Name'] for node in nodes if 'Index Name' in node}
+
+    assert used & expected, f'{label}: indexes {sorted(used)}, expected one of {sorted(expected)}'
+    assert not any(
+        node['Node Type'] == 'Seq Scan' and node.get('Relation Name') == 'apartments' for node in nodes
+    ), f'{label}: Seq Scan on apartments'
@@ -0,0 +1,51 @@
+import asyncio
+import datetime
+
+import httpx
+from sqlalchemy import delete
+
+from app.database import async_base, models
+
+REQUESTS = 50
+ARRIVAL = datetime.date(2026, 7, 1)
+STAY_DAYS = 3
+
+
+async def _book_concurrently(main, dsn: str) -> list:
+    await async_base.DB_INITIALIZER.init_db(dsn)
+    try:
+        async with async_base.DB_INITIALIZER.async_session_maker() as session:
+            apartment = models.Apartment(
+                title='booking test', address='booking test', rooms=1, area=30,
+                latitude=55.75, longitude=37.61, publisher_email='owner@example.com'
+            )
+            session.add(apartment)
+            await session.commit()
+
+        try:
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+                # Заезды сдвинуты на 0..STAY_DAYS-1 дней: все брони попарно пересекаются, но не совпадают
+                responses = await asyncio.gather(*(
+                    client.post('/reservations', json={
+                        "apartment_id": apartment.id,
+                        "arrival_date": str(ARRIVAL + datetime.timedelta(days=i % STAY_DAYS)),
+                        "departure_date": str(ARRIVAL + datetime.timedelta(days=i % STAY_DAYS + STAY_DAYS)),
+                    })
+                    for i in range(REQUESTS)
+                ))
+            return [response.status_code for response in responses]
+        finally:
+            async with async_base.DB_INITIALIZER.async_session_maker() as session:
+                await session.execute(delete(models.Reservation).where(models.Reservation.apartment_id == apartment.id))
+                await session.execute(delete(models.Apartment).where(models.Apartment.id == apartment.id))
+                await session.commit()
+    finally:
+        await async_base.DB_INITIALIZER.close()
+
+
+def test_overlapping_bookings_only_one_succeeds(postgres_dsn, main_app):
+    statuses = asyncio.run(_book_concurrently(main_app, postgres_dsn))
+
+    assert statuses.count(201) == 1
+    assert statuses.count(409) == REQUESTS - 1
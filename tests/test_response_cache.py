@@ -0,0 +1,213 @@
+import asyncio
+import datetime
+import time
+import types
+import typing
+
+import pytest
+from sqlalchemy import Delete
+
+from app.api.schemas import ApartmentCreate, ApartmentsQuery, ApartmentUpdate, CountMode, ReviewUpdate
+from app.services import apartment_service, listing_stats, review_service
+from app.services.response_cache import RESPONSE_CACHE_INITIALIZER, ResponseCache
+
+
+class MemoryRedis():
+    '''
+    Общий уровень кэша в памяти (подмножество команд Redis, которым пользуется ResponseCache)
+    '''
+
+    def __init__(self):
+        self._data: typing.Dict[str, typing.Tuple[bytes, typing.Optional[float]]] = {}
+
+    def _get(self, key: str) -> typing.Optional[bytes]:
+        value, expires_at = self._data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> typing.Optional[bytes]:
+        return self._get(key)
+
+    async def set(self, key: str, value, ex: typing.Optional[int] = None):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        self._data[key] = (value, time.time() + ex if ex else None)
+        return True
+
+    async def mget(self, keys: typing.Sequence[str]) -> typing.List[typing.Optional[bytes]]:
+        return [self._get(key) for key in keys]
+
+    async def aclose(self) -> None:
+        self._data.clear()
+
+
+class Result():
+    def __init__(self, rows: list):
+        self.rows = rows
+
+    def all(self) -> list:
+        return self.rows
+
+
+class FakeSession():
+    '''
+    Таблица apartments в памяти: ровно то, что вызывают add_apartment, update_apartment и delete_apartment
+    '''
+
+    def __init__(self, apartments: dict):
+        self.apartments = apartments
+        self.versions = {}
+        self.pending = None
+
+    def add(self, item):
+        self.pending = item
+
+    async def flush(self):
+        item, self.pending = self.pending, None
+        item.id = max(self.apartments, default=0) + 1
+        item.version = self.versions[item.id] = 1
+        item.updated_at = datetime.datetime.now(datetime.timezone.utc)
+        self.apartments[item.id] = item
+
+    async def execute(self, statement):
+        assert isinstance(statement, Delete), statement
+        if statement.table.name != 'apartments':
+            return Result([])
+        apartment_id, = statement.compile().params.values()
+        item = self.apartments.pop(apartment_id, None)
+        return Result([(item.latitude, item.longitude)] if item is not None else [])
+
+    async def commit(self):
+        pass
+
+    async def refresh(self, item):
+        # update_apartment ставит version = Apartment.version + 1 (выражение SQL)
+        if not isinstance(item.version, int):
+            item.version = self.versions[item.id] = self.versions[item.id] + 1
+        item.updated_at = datetime.datetime.now(datetime.timezone.utc)
+
+
+@pytest.fixture
+def apartments(monkeypatch) -> dict:
+    '''
+    Квартиры в памяти; get_apartments фильтрует их по min_rooms вместо запроса к базе
+    '''
+    apartments = {}
+
+    async def get_apartments(session, apartments_query: ApartmentsQuery):
+        items = sorted(
+            (item for item in apartments.values()
+             if apartments_query.min_rooms is None or item.rooms >= apartments_query.min_rooms),
+            key=lambda item: item.id
+        )
+        return {"items": items, "total": len(items), "total_mode": CountMode.exact, "size": len(items)}
+
+    async def get_apartment(session, apartment_id: int):
+        return apartments.get(apartment_id)
+
+    async def created(session, apartment_id: int):
+        pass
+
+    monkeypatch.setattr(apartment_service, 'get_apartments', get_apartments)
+    monkeypatch.setattr(apartment_service, 'get_apartment', get_apartment)
+    monkeypatch.setattr(listing_stats, 'created', created)
+    return apartments
+
+
+@pytest.fixture
+def workers(monkeypatch) -> typing.Tuple[ResponseCache, ResponseCache]:
+    '''
+    Два воркера с общим уровнем: первый пишет, второй читает. У читающего local_ttl = 0,
+    поэтому каждое чтение проверяется по отметкам инвалидации в общем уровне
+    '''
+    shared = MemoryRedis()
+    writer = ResponseCache(100, 5.0, 300, shared)
+    reader = ResponseCache(100, 0.0, 300, shared)
+    monkeypatch.setattr(RESPONSE_CACHE_INITIALIZER, 'cache', writer)
+    return writer, reader
+
+
+def _apartment(rooms: int, **changes) -> dict:
+    return {
+        "title": 'flat', "address": 'street 1', "rooms": rooms, "area": 40,
+        "latitude": 55.75, "longitude": 37.61, "publisher_email": 'owner@example.com', **changes
+    }
+
+
+async def _listed(workers, min_rooms: typing.Optional[int] = None, q: typing.Optional[str] = None) -> typing.List[int]:
+    '''
+    GET /apartments?min_rooms=&q= через кэш второго воркера
+    '''
+    writer, reader = workers
+    RESPONSE_CACHE_INITIALIZER.cache = reader
+    try:
+        payload = await apartment_service.get_apartments_response(None, ApartmentsQuery(
+            city_name=None, latitude=None, longitude=None, radius=None, limit=100, min_rooms=min_rooms, q=q
+        ))
+    finally:
+        RESPONSE_CACHE_INITIALIZER.cache = writer
+    return [item["id"] for item in payload["items"]]
+
+
+def test_cached_list_is_invalidated_after_create_update_delete(apartments, workers):
+    reader = workers[1]
+    session = FakeSession(apartments)
+
+    async def scenario():
+        small = await apartment_service.add_apartment(session, ApartmentCreate(**_apartment(rooms=1)))
+        assert await _listed(workers, min_rooms=2) == []
+        # Повторный запрос - из общего уровня
+        assert await _listed(workers, min_rooms=2) == []
+        assert reader.stats()['shared_hits'] == 1
+
+        big = await apartment_service.add_apartment(session, ApartmentCreate(**_apartment(rooms=3)))
+        assert await _listed(workers, min_rooms=2) == [big.id]
+
+        # Правка на месте: координаты те же, квартира попадает в выдачу с фильтром, где ее не было
+        await apartment_service.update_apartment(session, small.id, ApartmentUpdate(**_apartment(rooms=2)))
+        assert await _listed(workers, min_rooms=2) == [small.id, big.id]
+
+        assert await apartment_service.delete_apartment(session, big.id)
+        assert await _listed(workers, min_rooms=2) == [small.id]
+
+    asyncio.run(scenario())
+
+
+class ReviewSession():
+    async def commit(self):
+        pass
+
+    async def refresh(self, item):
+        pass
+
+
+def test_cached_search_is_invalidated_after_review_update(apartments, workers, monkeypatch):
+    # q= ищет и по тексту отзывов: правка отзыва меняет выдачу, не трогая саму квартиру
+    review = types.SimpleNamespace(id=1, apartment_id=1, title='ok', description='quiet flat', version=1)
+    apartments[1] = types.SimpleNamespace(id=1, title='flat', rooms=1)
+
+    async def get_apartments(session, apartments_query: ApartmentsQuery):
+        items = [item for item in apartments.values() if apartments_query.q in review.description]
+        return {"items": items, "total": len(items), "total_mode": CountMode.exact, "size": len(items)}
+
+    async def get_review_by_uid(session, uid: int):
+        return review
+
+    monkeypatch.setattr(apartment_service, 'get_apartments', get_apartments)
+    monkeypatch.setattr(apartment_service, '_apartments_payload', lambda result, fields: {
+        "items": [{"id": item.id} for item in result["items"]], "total": result["total"]
+    })
+    monkeypatch.setattr(review_service, 'get_review_by_uid', get_review_by_uid)
+
+    async def scenario():
+        assert await _listed(workers, q='balcony') == []
+        assert await _listed(workers, q='balcony') == []
+
+        await review_service.update_review_by_uid(
+            ReviewSession(), review.id, ReviewUpdate(title='ok', description='quiet flat with a balcony')
+        )
+        assert await _listed(workers, q='balcony') == [1]
+
+    asyncio.run(scenario())